@@ -238,12 +238,10 @@ class Engine(object):
 
     def dependence_probability_pairwise(self, statenos=None):
         """Compute dependence probability between all pairs as matrix."""
-        D = np.eye(len(self.states[0].outputs))
-        reindex = {c: k for k, c in enumerate(self.states[0].outputs)}
-        for i,j in itertools.combinations(self.states[0].outputs, 2):
-            d = np.mean(self.dependence_probability(i, j, statenos=statenos))
-            D[reindex[i], reindex[j]] = D[reindex[j], reindex[i]] = d
-        return D
+        statenos = statenos or xrange(self.num_states())
+        return np.mean([
+            self.states[s].dependence_probability_matrix() for s in statenos
+        ], axis=0)
 
     def row_similarity(self, row0, row1, cols=None, statenos=None,
             multiprocess=1):
@@ -266,13 +264,11 @@ class Engine(object):
         return probs
 
     def row_similarity_pairwise(self, cols=None, statenos=None):
-        """Compute dependence probability between all pairs as matrix."""
-        n_rows = self.states[0].n_rows()
-        S = np.eye(n_rows)
-        for i,j in itertools.combinations(range(n_rows), 2):
-            s = np.mean(self.row_similarity(i,j, cols, statenos=statenos))
-            S[i,j] = S[j,i] = s
-        return S
+        """Compute row similarity between all pairs as matrix."""
+        statenos = statenos or xrange(self.num_states())
+        return np.mean([
+            self.states[s].row_similarity_matrix(cols) for s in statenos
+        ], axis=0)
 
     def alter(self, funcs, statenos=None, multiprocess=1):
         """Apply generic funcs on states in parallel."""
@@ -357,11 +353,13 @@ class Engine(object):
     # Serialize
 
     def to_metadata(self):
+        return self._to_metadata(self.states[0].data_array().tolist())
+
+    def _to_metadata(self, X):
+        # Only one dataset per engine, not once per state.
         metadata = dict()
-        metadata['X'] = self.states[0].data_array().tolist()
-        metadata['states'] = [s.to_metadata() for s in self.states]
-        for m in metadata['states']:
-            del m['X']
+        metadata['X'] = X
+        metadata['states'] = [s._to_metadata(None) for s in self.states]
         metadata['factory'] = ('cgpm.crosscat.engine', 'Engine')
         return metadata
 
@@ -387,13 +385,19 @@ class Engine(object):
         return engine
 
     def to_pickle(self, fileptr):
-        metadata = self.to_metadata()
-        pickle.dump(metadata, fileptr)
+        # The dataset pickles to a compact binary buffer as a float array,
+        # rather than element by element as nested lists.
+        metadata = self._to_metadata(self.states[0].data_array())
+        if isinstance(fileptr, str):
+            with open(fileptr, 'wb') as f:
+                pickle.dump(metadata, f, pickle.HIGHEST_PROTOCOL)
+        else:
+            pickle.dump(metadata, fileptr, pickle.HIGHEST_PROTOCOL)
 
     @classmethod
     def from_pickle(cls, fileptr, rng=None):
         if isinstance(fileptr, str):
-            with open(fileptr, 'r') as f:
+            with open(fileptr, 'rb') as f:
                 metadata = pickle.load(f)
         else:
             metadata = pickle.load(fileptr)
@@ -24,18 +24,19 @@ from itertools import chain
 
 import numpy as np
 
-from cgpm.primitives.crp import Crp
-
-from cgpm.utils.general import log_normalize
 from cgpm.utils.general import log_pflip
 from cgpm.utils.general import logsumexp
 from cgpm.utils.general import merged
 
-from cgpm.utils.validation import partition_query_evidence
+from cgpm.utils.validation import partition_list
+
+
+# Largest number of Gumbel variates to draw when simulating cluster assignments.
+_GUMBEL_MAX_SIZE = 10**5
 
 
 def state_logpdf(state, rowid, query, evidence=None):
-    (queries, evidences) = partition_query_evidence(state.Zv(), query, evidence)
+    (queries, evidences) = _partition_query_evidence(state, query, evidence)
     logps = (
         view_logpdf(
             view=state.views[v],
@@ -49,7 +50,7 @@ def state_logpdf(state, rowid, query, evidence=None):
 
 
 def state_simulate(state, rowid, query, evidence=None, N=None):
-    (queries, evidences) = partition_query_evidence(state.Zv(), query, evidence)
+    (queries, evidences) = _partition_query_evidence(state, query, evidence)
     N_sim = N if N is not None else 1
     draws = (
         view_simulate(
@@ -65,43 +66,103 @@ def state_simulate(state, rowid, query, evidence=None, N=None):
     return samples if N is not None else samples[0]
 
 
+def _partition_query_evidence(state, query, evidence):
+    """Partition query and evidence by view, as vu.partition_query_evidence.
+
+    The grouping of columns into views is cached on the state, keyed on the
+    version of its column partition Zv and on the query and evidence columns.
+    """
+    evidence = evidence if evidence is not None else {}
+    cache = state._zv_partitions
+    key = (state._zv_version, tuple(query), tuple(evidence))
+    if key not in cache:
+        if len(cache) >= 1024:
+            cache.clear()
+        Zv = state.crp.clusters[0].data
+        cache[key] = (partition_list(Zv, query), partition_list(Zv, evidence))
+    query_cols, evidence_cols = cache[key]
+    if isinstance(query, dict):
+        queries = {
+            v: {c: query[c] for c in cols}
+            for v, cols in query_cols.items()
+        }
+    else:
+        queries = {v: list(cols) for v, cols in query_cols.items()}
+    evidences = {
+        v: {c: evidence[c] for c in cols}
+        for v, cols in evidence_cols.items()
+    }
+    return queries, evidences
+
+
 def view_logpdf(view, rowid, query, evidence):
     if not view.hypothetical(rowid):
         return _logpdf_row(view, query, view.Zr(rowid))
-    Nk = view.Nk()
-    N_rows = len(view.Zr())
-    K = view.crp.clusters[0].gibbs_tables(-1)
-    lp_crp = [Crp.calc_predictive_logp(k, N_rows, Nk, view.alpha()) for k in K]
-    lp_evidence = [_logpdf_row(view, evidence, k) for k in K]
-    if all(np.isinf(lp_evidence)):
-        raise ValueError('Zero density evidence: %s' % (evidence))
-    lp_cluster = log_normalize(np.add(lp_crp, lp_evidence))
-    lp_query = [_logpdf_row(view, query, k) for k in K]
-    return logsumexp(np.add(lp_cluster, lp_query))
+    K, lp_cluster = _logpdf_cluster_weights(view, evidence)
+    lp_query = _logpdf_row_clusters(view, query, K)
+    # Fuse normalization of lp_cluster into the final logsumexp.
+    return logsumexp(np.add(lp_cluster, lp_query)) - logsumexp(lp_cluster)
 
 
 def view_simulate(view, rowid, query, evidence, N):
     if not view.hypothetical(rowid):
         return _simulate_row(view, query, view.Zr(rowid), N)
+    K, lp_cluster = _logpdf_cluster_weights(view, evidence)
+    # Sample clusters by the Gumbel-max trick, which needs no normalization of
+    # lp_cluster; log_pflip uses less memory when N*len(K) is very large.
+    if N * len(K) <= _GUMBEL_MAX_SIZE:
+        gumbels = view.rng.gumbel(size=(N, len(K)))
+        ks = np.asarray(K)[np.argmax(lp_cluster + gumbels, axis=1)]
+    else:
+        ks = log_pflip(lp_cluster, array=K, size=N, rng=view.rng)
+    clusters, counts = np.unique(ks, return_counts=True)
+    samples = (
+        _simulate_row(view, query, k, n) for k, n in zip(clusters, counts))
+    return chain.from_iterable(samples)
+
+
+def _logpdf_cluster_weights(view, evidence):
+    """Return tables of a hypothetical row and their unnormalized log weights.
+
+    The weight of each table is its CRP predictive probability times the
+    joint density of the evidence in that table, as in Crp.calc_predictive_logp
+    but vectorized over the tables.
+    """
     Nk = view.Nk()
-    N_rows = len(view.Zr())
+    alpha = view.alpha()
     K = view.crp.clusters[0].gibbs_tables(-1)
-    lp_crp = [Crp.calc_predictive_logp(k, N_rows, Nk, view.alpha()) for k in K]
-    lp_evidence = [_logpdf_row(view, evidence, k) for k in K]
-    if all(np.isinf(lp_evidence)):
+    counts = np.fromiter((Nk.get(k, alpha) for k in K), float, len(K))
+    lp_crp = np.log(counts) - np.log(view.n_rows() + alpha)
+    if not evidence:
+        return K, lp_crp
+    lp_evidence = _logpdf_row_clusters(view, evidence, K)
+    if np.isinf(lp_evidence).all():
         raise ValueError('Zero density evidence: %s' % (evidence))
-    lp_cluster = np.add(lp_crp, lp_evidence)
-    ks = log_pflip(lp_cluster, array=K, size=N, rng=view.rng)
-    counts = {k:n for k,n in enumerate(np.bincount(ks)) if n > 0}
-    samples = (_simulate_row(view, query, k, counts[k]) for k in counts)
-    return chain.from_iterable(samples)
+    return K, lp_crp + lp_evidence
 
 
 def _logpdf_row(view, query, cluster):
     """Return joint density of the query in a fixed cluster."""
+    # Dim.logpdf copies the evidence, so one dict serves all the dims.
+    evidence = {view.outputs[0]: cluster}
+    if len(query) == 1:
+        [c] = query
+        return view.dims[c].logpdf(None, query, evidence)
+    return sum(
+        view.dims[c].logpdf(None, {c:x}, evidence)
+        for c, x in query.items()
+    )
+
+
+def _logpdf_row_clusters(view, query, clusters):
+    """Return array of joint density of the query in each fixed cluster."""
+    if len(query) == 1:
+        [c] = query
+        return view.dims[c].logpdf_clusters(None, query, clusters)
     return sum(
-        view.dims[c].logpdf(None, {c:x}, {view.outputs[0]: cluster})
-        for c, x in query.iteritems()
+        (view.dims[c].logpdf_clusters(None, {c:x}, clusters)
+            for c, x in query.items()),
+        np.zeros(len(clusters))
     )
 
 
@@ -14,8 +14,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import cPickle as pickle
-import copy
 import importlib
 import itertools
 import sys
@@ -25,6 +23,11 @@ from collections import OrderedDict
 from collections import defaultdict
 from math import isnan
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 import numpy as np
 
 from cgpm.cgpm import CGpm
@@ -39,6 +42,8 @@ from cgpm.utils import config as cu
 from cgpm.utils import general as gu
 from cgpm.utils import timer as tu
 from cgpm.utils import validation as vu
+from cgpm.utils.dataset import Dataset
+from cgpm.utils.parallel_map import parallel_map
 
 
 class State(CGpm):
@@ -65,9 +70,12 @@ class State(CGpm):
             assert len(outputs) == X.shape[1]
             assert all(o >= 0 for o in outputs)
         self.outputs = list(outputs)
-        self.X = OrderedDict()
-        for i, c in enumerate(self.outputs):
-            self.X[c] = X[:,i].tolist()
+        self.X = Dataset(X, self.outputs)
+        self._outputs_array = np.asarray(self.outputs)
+        self._col_pos = {c: i for i, c in enumerate(self.outputs)}
+        # Schemas of query and evidence which passed validation, see
+        # _validate_query_evidence_schema.
+        self._valid_schemas = set()
 
         # -- Column CRP --------------------------------------------------------
         crp_alpha = None if alpha is None else {'alpha': alpha}
@@ -81,11 +89,13 @@ class State(CGpm):
         )
         self.crp.transition_hyper_grids([1]*self.n_cols())
         if Zv is None:
-            for c in self.outputs:
-                s = self.crp.simulate(c, [self.crp_id], {-1:0})
-                self.crp.incorporate(c, s, {-1:0})
+            # Draw the whole column partition from the CRP prior at once.
+            Zv_prior = gu.simulate_crp(
+                self.n_cols(), self.alpha(), rng=self.rng)
+            for c, z in zip(self.outputs, Zv_prior):
+                self.crp.incorporate(c, {self.crp_id: z}, {-1:0})
         else:
-            for c, z in Zv.iteritems():
+            for c, z in Zv.items():
                 self.crp.incorporate(c, {self.crp_id: z}, {-1:0})
         assert len(self.Zv()) == len(self.outputs)
 
@@ -94,6 +104,11 @@ class State(CGpm):
         self.Ci = [] if Ci is None else Ci
         self.Rd = {} if Rd is None else Rd
         self.Ri = {} if Ri is None else Ri
+        # Mapping of each column to the columns it must be independent of.
+        self._Ci_avoid = {}
+        for p in self.Ci:
+            for c in p:
+                self._Ci_avoid.setdefault(c, []).extend(a for a in p if a != c)
         if len(self.Cd) > 0: # XXX Github issue #13.
             raise ValueError('Dependency constraints not yet implemented.')
         if self.Cd or self.Ci:
@@ -107,6 +122,15 @@ class State(CGpm):
                 self.crp.incorporate(c, {self.crp_id: z}, {-1:0})
             assert len(self.Zv()) == len(self.outputs)
 
+        # -- Column partition version ------------------------------------------
+        # Incremented whenever Zv changes, to invalidate caches keyed on Zv.
+        self._zv_version = 0
+        self._zv_partitions = {}
+        self._zv_cache = (None, None, None)
+        self._view_positions_cache = (None, None)
+        # Last column partition checkpointed in diagnostics, and its version.
+        self._zv_diagnostics = (None, None)
+
         # -- View data ---------------------------------------------------------
         cctypes = cctypes or [None] * len(self.outputs)
         distargs = distargs or [None] * len(self.outputs)
@@ -123,11 +147,14 @@ class State(CGpm):
         # -- Views -------------------------------------------------------------
         self.views = OrderedDict()
         self.crp_id_view = 10**7
+        view_outputs = {}
+        for c in self.outputs:
+            view_outputs.setdefault(self.Zv(c), []).append(c)
         for v in set(self.Zv().values()):
-            v_outputs = [o for o in self.outputs if self.Zv(o) == v]
-            v_cctypes = [cctypes[self.outputs.index(c)] for c in v_outputs]
-            v_distargs = [distargs[self.outputs.index(c)] for c in v_outputs]
-            v_hypers = [hypers[self.outputs.index(c)] for c in v_outputs]
+            v_outputs = view_outputs[v]
+            v_cctypes = [cctypes[self._col_pos[c]] for c in v_outputs]
+            v_distargs = [distargs[self._col_pos[c]] for c in v_outputs]
+            v_hypers = [hypers[self._col_pos[c]] for c in v_outputs]
             view = View(
                 self.X,
                 outputs=[self.crp_id_view+v] + v_outputs,
@@ -140,11 +167,21 @@ class State(CGpm):
                 rng=self.rng
             )
             self.views[v] = view
+        # Mapping of each column to its view, maintained alongside Zv.
+        self._col_view = {c: self.views[self.Zv(c)] for c in self.outputs}
 
         # -- Foreign CGpms -----------------------------------------------------
         self.token_generator = itertools.count(start=57481)
         self.hooked_cgpms = dict()
 
+        # -- Importance networks -----------------------------------------------
+        # Mapping of accuracy to the ImportanceNetwork over build_cgpms(),
+        # cleared by _invalidate_network whenever the set of cgpms changes.
+        self._networks = dict()
+        # Topology queries on build_cgpms(), such as retrieve_ancestors, which
+        # are also cleared by _invalidate_network.
+        self._topologies = dict()
+
         # -- Diagnostic Checkpoints---------------------------------------------
         if diagnostics is None:
             self.diagnostics = defaultdict(list)
@@ -162,6 +199,9 @@ class State(CGpm):
         # Does the state have any conditional GPMs? Conditional GPMs come from
         # - a hooked cgpm;
         # - a conditional dim.
+        # The conditional flag is kept separately, since column transitions
+        # consult it once per column.
+        self._conditional = any(d.is_conditional() for d in self.dims())
         self._composite = False
 
     # --------------------------------------------------------------------------
@@ -189,7 +229,9 @@ class State(CGpm):
         # Append new output to outputs.
         col = outputs[0]
         self.X[col] = T
+        self._col_pos[col] = len(self.outputs)
         self.outputs.append(col)
+        self._outputs_array = np.asarray(self.outputs)
         # If v unspecified then transition the col.
         transition = [col] if v is None else []
         # Determine correct view.
@@ -211,6 +253,9 @@ class State(CGpm):
         D.transition_hyper_grids(self.X[col])
         view.incorporate_dim(D)
         self.crp.incorporate(col, {self.crp_id: v_add}, {-1:0})
+        self._col_view[col] = view
+        self._zv_version += 1
+        self._invalidate_network()
         # Transition.
         self.transition_dims(cols=transition)
         self.transition_dim_hypers(cols=[col])
@@ -231,12 +276,17 @@ class State(CGpm):
         delete = self.Nv(v_del) == 1
         self.views[v_del].unincorporate_dim(d_del)
         self.crp.unincorporate(col)
+        del self._col_view[col]
+        self._zv_version += 1
+        self._invalidate_network()
         # Clear a singleton.
         if delete:
             self._delete_view(v_del)
         # Clear data, outputs, and view assignment.
         del self.X[col]
-        del self.outputs[self.outputs.index(col)]
+        del self.outputs[self._col_pos[col]]
+        self._outputs_array = np.asarray(self.outputs)
+        self._col_pos = {c: i for i, c in enumerate(self.outputs)}
         # Update composite flag.
         self._update_is_composite()
         # Validate.
@@ -251,19 +301,21 @@ class State(CGpm):
         valid_clusters = set([self.views[v].outputs[0] for v in self.views])
         query_clusters = [q for q in query if q in valid_clusters]
         query_outputs = [q for q in query if q not in query_clusters]
-        if not all(q in self.outputs for q in query_outputs):
+        if not all(q in self._col_pos for q in query_outputs):
             raise ValueError('Invalid query: %s' % query)
         if any(isnan(v) for v in query.values()):
             raise ValueError('Cannot incorporate nan: %s.' % query)
         # Append the observation to dataset.
-        for c in self.outputs:
-            self.X[c].append(query.get(c, float('nan')))
+        self.X.append({c: query[c] for c in query_outputs})
         # Pick a fresh rowid.
         if self.hypothetical(rowid):
             rowid = self.n_rows()-1
-        # Tell the views.
+        # Tell the views, gathering the values of their dims from the row.
+        row = self.X.row(rowid)
+        view_positions = self._view_positions()
         for v in self.views:
-            query_v = {d: self.X[d][rowid] for d in self.views[v].dims}
+            dims, positions = view_positions[v]
+            query_v = dict(zip(dims, row[positions].tolist()))
             crp_v = self.views[v].outputs[0]
             cluster_v = {crp_v: query[crp_v]} if crp_v in query else {}
             self.views[v].incorporate(rowid, gu.merged(cluster_v, query_v))
@@ -272,15 +324,14 @@ class State(CGpm):
 
     def unincorporate(self, rowid):
         # XXX WHATTA HACK. Only permit unincorporate the last rowid, which means
-        # we can pop the last entry of each list in self.X without affecting any
-        # existing rowids.
+        # we can pop the last row of self.X without affecting any existing
+        # rowids.
         if rowid != self.n_rows() - 1:
             raise ValueError('Only last rowid may be unincorporated.')
         if self.n_rows() == 1:
             raise ValueError('Cannot unincorporate last rowid.')
         # Remove the observation from the dataset.
-        for c in self.outputs:
-            self.X[c].pop()
+        self.X.pop()
         # Tell the views.
         for v in self.views:
             self.views[v].unincorporate(rowid)
@@ -291,12 +342,16 @@ class State(CGpm):
     def force_cell(self, rowid, query):
         if not 0 <= rowid < self.n_rows():
             raise ValueError('Force observation requires existing rowid.')
-        if not all(np.isnan(self.X[c][rowid]) for c in query):
+        # Read and write the cells through one index into the row.
+        row = self.X.row(rowid)
+        cols = list(query)
+        positions = [self._col_pos[c] for c in cols]
+        if not np.isnan(row[positions]).all():
             raise ValueError('Force observations requires NaN cells.')
-        for col, value in query.iteritems():
-            self.X[col][rowid] = value
-        queries = vu.partition_list({c: self.Zv(c) for c in query}, query)
-        for view_id, view_variables in queries.iteritems():
+        row[positions] = [query[c] for c in cols]
+        Zv, _view_of = self._Zv_cached()
+        queries = vu.partition_list(Zv, cols)
+        for view_id, view_variables in queries.items():
             query_v = {c: query[c] for c in view_variables}
             self.views[view_id].force_cell(rowid, query_v)
 
@@ -307,6 +362,7 @@ class State(CGpm):
         """Update the distribution type of self.dims[col] to cctype."""
         assert col in self.outputs
         self.view_for(col).update_cctype(col, cctype, distargs=distargs)
+        self._invalidate_network()
         self.transition_dim_grids(cols=[col])
         self.transition_dim_params(cols=[col])
         self.transition_dim_hypers(cols=[col])
@@ -322,10 +378,12 @@ class State(CGpm):
         """Returns `token` to be used in the call to decompose_cgpm."""
         token = next(self.token_generator)
         self.hooked_cgpms[token] = cgpm
+        self._invalidate_network()
         try:
             self.build_network()
         except ValueError as e:
             del self.hooked_cgpms[token]
+            self._invalidate_network()
             raise e
         self._update_is_composite()
         return token
@@ -333,14 +391,15 @@ class State(CGpm):
     def decompose_cgpm(self, token):
         """Remove the composed cgpm with identifier `token`."""
         del self.hooked_cgpms[token]
+        self._invalidate_network()
         self._update_is_composite()
         self.build_network()
 
     def _update_is_composite(self):
         """Update state._composite attribute."""
         hooked = len(self.hooked_cgpms) > 0
-        conditional = any(d.is_conditional() for d in self.dims())
-        self._composite = hooked or conditional
+        self._conditional = any(d.is_conditional() for d in self.dims())
+        self._composite = hooked or self._conditional
 
     def is_composite(self):
         return self._composite
@@ -350,7 +409,7 @@ class State(CGpm):
 
     def logpdf_score(self):
         logp_crp = self.crp.logpdf_score()
-        logp_views = sum(v.logpdf_score() for v in self.views.itervalues())
+        logp_views = sum(v.logpdf_score() for v in self.views.values())
         return logp_crp + logp_views
 
     # --------------------------------------------------------------------------
@@ -360,6 +419,9 @@ class State(CGpm):
         assert isinstance(query, dict)
         assert evidence is None or isinstance(evidence, dict)
         self._validate_query_evidence(rowid, query, evidence)
+        return self._logpdf_unchecked(rowid, query, evidence, accuracy)
+
+    def _logpdf_unchecked(self, rowid, query, evidence=None, accuracy=None):
         if not self._composite:
             return sampling.state_logpdf(self, rowid, query, evidence)
         evidence = self._populate_evidence(rowid, query, evidence)
@@ -373,6 +435,10 @@ class State(CGpm):
         assert isinstance(query, list)
         assert evidence is None or isinstance(evidence, dict)
         self._validate_query_evidence(rowid, query, evidence)
+        return self._simulate_unchecked(rowid, query, evidence, N, accuracy)
+
+    def _simulate_unchecked(
+            self, rowid, query, evidence=None, N=None, accuracy=None):
         if not self._composite:
             return sampling.state_simulate(self, rowid, query, evidence, N)
         evidence = self._populate_evidence(rowid, query, evidence)
@@ -384,10 +450,28 @@ class State(CGpm):
 
     def build_network(self, accuracy=None):
         if accuracy is None: accuracy=1
-        return ImportanceNetwork(self.build_cgpms(), accuracy, rng=self.rng)
+        if accuracy not in self._networks:
+            self._networks[accuracy] = ImportanceNetwork(
+                self.build_cgpms(), accuracy, rng=self.rng)
+        return self._networks[accuracy]
+
+    def _invalidate_network(self):
+        self._networks.clear()
+        self._topologies.clear()
+
+    def _topology(self, retrieve, *args):
+        """Return retrieve(self.build_cgpms(), *args), a function of the
+        network topology cached until the network is invalidated."""
+        key = (retrieve.__name__,) + args
+        if key not in self._topologies:
+            self._topologies[key] = retrieve(self.build_cgpms(), *args)
+        return self._topologies[key]
+
+    def _ancestors(self, col):
+        return self._topology(retrieve_ancestors, col)
 
     def build_cgpms(self):
-        return [self.views[v] for v in self.views] + self.hooked_cgpms.values()
+        return list(self.views.values()) + list(self.hooked_cgpms.values())
 
     def _populate_evidence(self, rowid, query, evidence):
         """Loads query evidence from the dataset."""
@@ -396,81 +480,160 @@ class State(CGpm):
         if self.hypothetical(rowid):
             return evidence
         # Retrieve all other values for this rowid not in query or evidence.
-        data = {
-            c: self.X[c][rowid]
-            for c in self.outputs[1:]
-            if not any([
-                (c in query),
-                (c in evidence),
-                (isnan(self.X[c][rowid]))
-            ])
-        }
-        return gu.merged(evidence, data)
+        # The columns of self.X are stored in the same order as self.outputs.
+        row = self.X.row(rowid)
+        mask = ~np.isnan(row)
+        if query or evidence:
+            mask &= ~np.in1d(self._outputs_array, list(query) + list(evidence))
+        data = dict(zip(self._outputs_array[mask].tolist(), row[mask].tolist()))
+        # The evidence columns were masked out, so updating the fresh dict
+        # in place matches merging it into a copy of evidence.
+        data.update(evidence)
+        return data
 
     def _validate_query_evidence(self, rowid, query, evidence):
-        # Is the rowid fresh?
-        fresh = self.hypothetical(rowid)
-        # Is the query simulate or logpdf?
-        simulate = isinstance(query, list)
+        self._validate_query_evidence_schema(query, evidence)
+        self._validate_rowid_cells(rowid, query, evidence)
+
+    def _validate_query_evidence_bulk(self, rowids, queries, evidences):
+        for rowid, query, evidence in zip(rowids, queries, evidences):
+            self._validate_query_evidence_schema(query, evidence)
+            self._validate_rowid_cells(rowid, query, evidence)
+
+    def _validate_query_evidence_schema(self, query, evidence):
+        # The checks depend only on the columns of the query and evidence, so
+        # they run once for each distinct schema which passes them. Only a
+        # bounded number of schemas is remembered.
+        schema = (isinstance(query, list), tuple(query), tuple(evidence or ()))
+        if schema in self._valid_schemas:
+            return
         # Disallow duplicated query cols.
-        if simulate and len(set(query)) != len(query):
+        if isinstance(query, list) and len(set(query)) != len(query):
             raise ValueError('Query columns must be unique.')
+        # Disallow overlap between query and evidence.
+        if evidence and len(set.intersection(set(query), set(evidence))) > 0:
+            raise ValueError('Query and evidence columns must be disjoint.')
+        if len(self._valid_schemas) >= 1024:
+            self._valid_schemas.clear()
+        self._valid_schemas.add(schema)
+
+    def _validate_rowid_cells(self, rowid, query, evidence):
+        # Observed cells only constrain rows which are not fresh.
+        if self.hypothetical(rowid):
+            return
+        # Is the query simulate or logpdf?
+        simulate = isinstance(query, list)
+        # The cells of rowid are gathered from one view of its row, whose
+        # entries are stored in the same order as self.outputs.
+        row = self.X.row(rowid)
         # Disallow query constraining observed cells.
         # XXX Only disallow logpdf constraints; simulate is permitted for
         # INFER EXPLICIT PREDICT through BQL to work. Refer to
         # https://github.com/probcomp/cgpm/issues/116
-        if (not fresh) and (not simulate) and any(
-                not np.isnan(self.X[q][rowid]) for q in query):
-            raise ValueError('Query cannot constrain observed cell.')
-        # Check if the evidence is valid.
+        if not simulate:
+            cells = row[[self._col_pos[q] for q in query]]
+            if not np.all(np.isnan(cells)):
+                raise ValueError('Query cannot constrain observed cell.')
+        # Disallow evidence constraining/disagreeing with observed cells.
         if evidence:
-            # Disallow overlap between query and evidence.
-            if len(set.intersection(set(query), set(evidence))) > 0:
-                raise ValueError('Query and evidence columns must be disjoint.')
-            # Disallow evidence constraining/disagreeing with observed cells.
-            def good_evidence(rowid, e):
-                return (e not in self.outputs) \
-                    or np.isnan(self.X[e][rowid]) \
-                    or np.allclose(self.X[e][rowid], evidence[e])
-            if (not fresh) and \
-                    any(not good_evidence(rowid, e) for e in evidence):
+            columns = [e for e in evidence if e in self._col_pos]
+            cells = row[[self._col_pos[e] for e in columns]]
+            observed = ~np.isnan(cells)
+            values = [evidence[e] for e, o in zip(columns, observed) if o]
+            if not np.allclose(cells[observed], values):
                 raise ValueError('Evidence cannot constrain observed cell.')
 
     # --------------------------------------------------------------------------
     # Bulk operations
 
-    def simulate_bulk(self, rowids, queries, evidences=None, Ns=None):
+    def simulate_bulk(
+            self, rowids, queries, evidences=None, Ns=None, multiprocess=0):
         """Evaluate multiple queries at once, used by Engine."""
         if evidences is None:
-            evidences = [{} for i in xrange(len(rowids))]
+            evidences = [{} for i in range(len(rowids))]
         if Ns is None:
-            Ns = [1 for i in xrange(len(rowids))]
+            Ns = [1 for i in range(len(rowids))]
         assert len(rowids) == len(queries) == len(evidences) == len(Ns)
-        return [
-            self.simulate(r, q, e, n)
-            for (r, q, e, n) in zip(rowids, queries, evidences, Ns)
-        ]
-
-    def logpdf_bulk(self, rowids, queries, evidences=None):
+        self._validate_query_evidence_bulk(rowids, queries, evidences)
+        if not multiprocess:
+            return [
+                self._simulate_unchecked(r, q, e, n)
+                for (r, q, e, n) in zip(rowids, queries, evidences, Ns)
+            ]
+        def simulate(args):
+            r, q, e, n, seed = args
+            self.rng.seed(seed)
+            return self._simulate_unchecked(r, q, e, n)
+        seeds = self._bulk_seeds(len(rowids))
+        return parallel_map(
+            simulate, list(zip(rowids, queries, evidences, Ns, seeds)))
+
+    def logpdf_bulk(self, rowids, queries, evidences=None, multiprocess=0):
         """Evaluate multiple queries at once, used by Engine."""
         if evidences is None:
-            evidences = [{} for _ in xrange(len(rowids))]
+            evidences = [{} for _ in range(len(rowids))]
         assert len(rowids) == len(queries) == len(evidences)
-        return [
-            self.logpdf(r, q, e)
-            for (r, q, e) in zip(rowids, queries, evidences)
-        ]
+        self._validate_query_evidence_bulk(rowids, queries, evidences)
+        if not multiprocess:
+            return [
+                self._logpdf_unchecked(r, q, e)
+                for (r, q, e) in zip(rowids, queries, evidences)
+            ]
+        def logpdf(args):
+            r, q, e, seed = args
+            self.rng.seed(seed)
+            return self._logpdf_unchecked(r, q, e)
+        seeds = self._bulk_seeds(len(rowids))
+        return parallel_map(
+            logpdf, list(zip(rowids, queries, evidences, seeds)))
+
+    def _bulk_seeds(self, n):
+        # The worker processes of parallel_map are forked with identical copies
+        # of self.rng, so each query reseeds from an entropy drawn here to keep
+        # the results independent and reproducible regardless of scheduling.
+        return self.rng.randint(low=1, high=2**31, size=n).tolist()
 
     # --------------------------------------------------------------------------
     # Dependence probability.
 
     def dependence_probability(self, col0, col1):
+        # Two CrossCat columns are dependent iff they share a view.
+        if col0 in self._col_pos and col1 in self._col_pos:
+            return 1. if self.Zv(col0) == self.Zv(col1) else 0.
         cgpms = self.build_cgpms()
-        Zv = {i: self.Zv(i) for i in self.outputs}
-        return State._dependence_probability(cgpms, Zv, col0, col1)
+        Zv, _view_of = self._Zv_cached()
+        return State._dependence_probability(
+            cgpms, Zv, col0, col1, ancestors=self._ancestors)
+
+    def dependence_probability_pairs(self, pairs):
+        """Compute dependence probability of each (col0, col1) in pairs."""
+        if not pairs:
+            return np.zeros(0)
+        if any(c not in self._col_pos for pair in pairs for c in pair):
+            return np.asarray([
+                self.dependence_probability(col0, col1)
+                for col0, col1 in pairs
+            ])
+        _Zv, view_of = self._Zv_cached()
+        index0, index1 = np.asarray([
+            (self._col_pos[col0], self._col_pos[col1])
+            for col0, col1 in pairs
+        ]).T
+        return (view_of[index0] == view_of[index1]).astype(float)
+
+    def dependence_probability_matrix(self):
+        """Compute dependence probability between all pairs of outputs.
+
+        Entry [i,j] of the returned matrix is the dependence probability of
+        self.outputs[i] and self.outputs[j].
+        """
+        _Zv, view_of = self._Zv_cached()
+        return (view_of[:,np.newaxis] == view_of[np.newaxis,:]).astype(float)
 
     @staticmethod
-    def _dependence_probability(cgpms, Zv, col0, col1):
+    def _dependence_probability(cgpms, Zv, col0, col1, ancestors=None):
+        if ancestors is None:
+            ancestors = lambda c: retrieve_ancestors(cgpms, c)
         # Use the CrossCat view partition for state variables.
         if col0 in Zv and col1 in Zv:
             return 1. if Zv[col0] == Zv[col1] else 0.
@@ -478,9 +641,9 @@ class State(CGpm):
         if any(col0 in c.outputs and col1 in c.outputs for c in cgpms):
             return 1.
         # Use the BayesBall algorithm on the cgpm network.
-        ancestors0 = retrieve_ancestors(cgpms, col0) if col0 not in Zv\
+        ancestors0 = ancestors(col0) if col0 not in Zv\
             else [c for c in Zv if Zv[c]==Zv[col0]]
-        ancestors1 = retrieve_ancestors(cgpms, col1) if col1 not in Zv\
+        ancestors1 = ancestors(col1) if col1 not in Zv\
             else [c for c in Zv if Zv[c]==Zv[col1]]
         # Direct common ancestor implies dependent.
         if set.intersection(set(ancestors0), set(ancestors1)):
@@ -502,6 +665,38 @@ class State(CGpm):
         views = set(self.view_for(c) for c in cols)
         return np.mean([v.Zr(row0)==v.Zr(row1) for v in views])
 
+    def row_similarity_pairs(self, pairs, cols=None):
+        """Compute row similarity of each (row0, row1) in pairs."""
+        if not pairs:
+            return np.zeros(0)
+        rows0, rows1 = np.asarray(pairs, dtype=int).T
+        Zr = self._row_partitions(cols)
+        return np.mean(Zr[:,rows0] == Zr[:,rows1], axis=0)
+
+    def row_similarity_matrix(self, cols=None):
+        """Compute row similarity between all pairs of rows.
+
+        Entry [i,j] of the returned matrix is row_similarity(i, j, cols).
+        """
+        Zr = self._row_partitions(cols)
+        S = np.zeros((self.n_rows(), self.n_rows()))
+        for z in Zr:
+            S += z[:,np.newaxis] == z[np.newaxis,:]
+        return S / len(Zr)
+
+    def _row_partitions(self, cols):
+        """Return array whose rows are the row partitions of views of cols."""
+        if cols is None:
+            cols = self.outputs
+        views = set(self.view_for(c) for c in cols)
+        return np.asarray([self._row_partition(v) for v in views])
+
+    def _row_partition(self, view):
+        """Return array whose ith entry is the cluster of row i in view."""
+        n_rows = self.n_rows()
+        Zr = view.Zr()
+        return np.fromiter((Zr[r] for r in range(n_rows)), int, n_rows)
+
     # --------------------------------------------------------------------------
     # Relevance probability.
 
@@ -512,30 +707,36 @@ class State(CGpm):
         # Retrieve the relevant view.
         view = self.view_for(col)
         # Select the hypothetical rows which are compatible with the view.
-        hypotheticals = filter(
-            lambda r: not all(np.isnan(r.values())),
-            [{d: h.get(d, np.nan) for d in view.dims} for h in hypotheticals]
-        ) if hypotheticals else []
-        # Produce hypothetical rowids.
-        rowid_hypothetical = range(
-            self.n_rows(), self.n_rows() + len(hypotheticals))
-        # Incorporate hypothetical rows.
-        for rowid, query in zip(rowid_hypothetical, hypotheticals):
-            for d in view.dims:
-                self.X[d].append(query[d])
+        hypotheticals = [
+            r for r in (
+                {d: h.get(d, np.nan) for d in view.dims} for h in hypotheticals)
+            if not all(np.isnan(list(r.values())))
+        ] if hypotheticals else []
+        # No query rows is irrelevant by convention.
+        if not rowid_query and not hypotheticals:
+            return 0
+        # The query rows must all share the cluster of the target row; check
+        # the observed rows first, before paying for any incorporate.
+        k_target = view.Zr(rowid_target)
+        if any(view.Zr(rq) != k_target for rq in rowid_query):
+            return 0
+        # Incorporate hypothetical rows one at a time, stopping at the first
+        # one placed outside the cluster of the target row.
+        relevance = 1
+        rowid_hypothetical = []
+        for query in hypotheticals:
+            rowid = self.n_rows()
+            self.X.append({d: query[d] for d in view.dims})
             view.incorporate(rowid, query)
-        # Compute the relevance probability.
-        rowid_all = rowid_query + rowid_hypothetical
-        relevance = all(
-            view.Zr(rowid_target) == view.Zr(rq)
-            for rq in rowid_all
-        ) if rowid_all else 0
+            rowid_hypothetical.append(rowid)
+            if view.Zr(rowid) != k_target:
+                relevance = 0
+                break
         # Unincorporate hypothetical rows.
         for rowid in reversed(rowid_hypothetical):
-            for d in view.dims:
-                self.X[d].pop()
+            self.X.pop()
             view.unincorporate(rowid)
-        return int(relevance)
+        return relevance
 
     # --------------------------------------------------------------------------
     # Mutual information
@@ -563,8 +764,8 @@ class State(CGpm):
         N = N or 100
         T = T or 100
         # Partition evidence into equality `e` and marginalization `m` types.
-        e_evidence = {e:x for e, x in evidence.iteritems() if x is not None}
-        m_evidence = [e for e, x in evidence.iteritems() if x is None]
+        e_evidence = {e:x for e, x in evidence.items() if x is not None}
+        m_evidence = [e for e, x in evidence.items() if x is None]
         # Determine the estimator to use.
         estimator = self._compute_mi if set(col0) != set(col1) else\
             self._compute_entropy
@@ -581,42 +782,55 @@ class State(CGpm):
         if progress:
             self._progress(0./T)
         samples = self.simulate(-1, m_evidence, N=T)
-        mi = sum(compute_one(i,s) for (i,s) in enumerate(samples))
-        return mi / float(T)
+        mi = np.fromiter(
+            (compute_one(i,s) for (i,s) in enumerate(samples)),
+            dtype=float, count=len(samples))
+        return np.mean(mi)
 
     def _compute_mi(self, col0, col1, evidence, N):
         samples = self.simulate(-1, col0 + col1, evidence=evidence, N=N)
-        PXY = self.logpdf_bulk(
-            rowids=[-1]*N,
-            queries=samples,
-            evidences=[evidence]*N
-        )
-        PX = self.logpdf_bulk(
-            rowids=[-1]*N,
-            queries=[{c0: s[c0] for c0 in col0} for s in samples],
-            evidences=[evidence]*N,
-        )
-        PY = self.logpdf_bulk(
-            rowids=[-1]*N,
-            queries=[{c1: s[c1] for c1 in col1} for s in samples],
-            evidences=[evidence]*N,
-        )
-        return (np.sum(PXY) - np.sum(PX) - np.sum(PY)) / N
+        PXY = self._logpdf_shared(-1, samples, evidence)
+        PX = self._logpdf_shared(
+            -1, [{c0: s[c0] for c0 in col0} for s in samples], evidence)
+        PY = self._logpdf_shared(
+            -1, [{c1: s[c1] for c1 in col1} for s in samples], evidence)
+        # Fold the marginals into the fresh PXY array to avoid temporaries.
+        PXY -= PX
+        PXY -= PY
+        return PXY.mean()
 
     def _compute_entropy(self, col0, col1, evidence, N):
         assert set(col0) == set(col1)
         samples = self.simulate(-1, col0, evidence=evidence, N=N)
-        PX = self.logpdf_bulk(
-            rowids=[-1]*N,
-            queries=[{c0: s[c0] for c0 in col0} for s in samples],
-            evidences=[evidence]*N,
-        )
-        return - np.sum(PX) / N
+        PX = self._logpdf_shared(
+            -1, [{c0: s[c0] for c0 in col0} for s in samples], evidence)
+        return - PX.mean()
+
+    def _logpdf_shared(self, rowid, queries, evidence):
+        """Evaluate logpdf of queries sharing the same columns and evidence.
+
+        The queries are validated, the evidence populated and the network
+        built once, instead of once per query as in logpdf_bulk. Returns an
+        array with the logpdf of each query.
+        """
+        logps = np.empty(len(queries))
+        if not queries:
+            return logps
+        self._validate_query_evidence(rowid, queries[0], evidence)
+        if not self._composite:
+            for i, q in enumerate(queries):
+                logps[i] = sampling.state_logpdf(self, rowid, q, evidence)
+            return logps
+        evidence = self._populate_evidence(rowid, queries[0], evidence)
+        network = self.build_network()
+        for i, q in enumerate(queries):
+            logps[i] = network.logpdf(rowid, q, evidence)
+        return logps
 
     def _partition_mutual_information_query(self, col0, col1, evidence):
-        cgpms = self.build_cgpms()
-        var_to_cgpm = retrieve_variable_to_cgpm(cgpms)
-        connected_components = retrieve_weakly_connected_components(cgpms)
+        var_to_cgpm = self._topology(retrieve_variable_to_cgpm)
+        connected_components = self._topology(
+            retrieve_weakly_connected_components)
         blocks = defaultdict(lambda: ([], [], {}))
         for variable in col0:
             component = connected_components[var_to_cgpm[variable]]
@@ -627,14 +841,15 @@ class State(CGpm):
         for variable in evidence:
             component = connected_components[var_to_cgpm[variable]]
             blocks[component][2][variable] = evidence[variable]
-        return blocks.values()
+        return list(blocks.values())
 
     # --------------------------------------------------------------------------
     # Inference
 
     def transition(
             self, N=None, S=None, kernels=None, rowids=None,
-            cols=None, views=None, progress=True, checkpoint=None):
+            cols=None, views=None, progress=True, checkpoint=None,
+            compiled=False):
         # XXX Many combinations of the above kwargs will cause havoc.
 
         # Check columns exist, silently ignore non-existent columns.
@@ -653,14 +868,14 @@ class State(CGpm):
                 lambda : self.transition_dim_hypers(cols=cols)),
             ('rows',
                 lambda : self.transition_view_rows(
-                    views=views, cols=cols, rows=rowids)),
+                    views=views, cols=cols, rows=rowids, compiled=compiled)),
             ('columns' ,
                 lambda : self.transition_dims(cols=cols)),
         ])
 
         # Run all kernels by default.
         if kernels is None:
-            kernels = _kernel_lookup.keys()
+            kernels = list(_kernel_lookup.keys())
 
         kernel_funcs = [_kernel_lookup[k] for k in kernels]
         assert kernel_funcs
@@ -700,13 +915,16 @@ class State(CGpm):
             self.dim_for(c).transition_hyper_grids(self.X[c])
         self._increment_iterations('column_grids')
 
-    def transition_view_rows(self, views=None, rows=None, cols=None):
+    def transition_view_rows(
+            self, views=None, rows=None, cols=None, block=False,
+            compiled=False):
         if self.n_rows() == 1:
             return
         if views is None:
             views = set(self.Zv(col) for col in cols) if cols else self.views
         for v in views:
-            self.views[v].transition_rows(rows=rows)
+            self.views[v].transition_rows(
+                rows=rows, block=block, compiled=compiled)
         self._increment_iterations('rows')
 
     def transition_dims(self, cols=None, m=1):
@@ -726,7 +944,7 @@ class State(CGpm):
             raise ValueError(
                 'Only normal and categorical cgpms supported by lovecat: %s'
                 % (self.cctypes()))
-        if any(d.is_conditional() for d in self.dims()):
+        if self._conditional:
             raise ValueError('Cannot transition lovecat with conditional dims.')
         from cgpm.crosscat import lovecat
         seed = self.rng.randint(1, 2**31-1)
@@ -757,8 +975,9 @@ class State(CGpm):
         if cols is None:
             cols = list(itertools.chain.from_iterable(
                 c.outputs for c in self.hooked_cgpms.values()))
-        if any(c in self.outputs for c in cols):
+        if any(c in self._col_pos for c in cols):
             raise ValueError('Only foreign variables allowed: %s' % (cols,))
+        cols = set(cols)
         def build_transition(token):
             def kernel():
                 self.hooked_cgpms[token].transition()
@@ -766,8 +985,8 @@ class State(CGpm):
             return kernel
         kernels= [
             build_transition(token)
-            for token in self.hooked_cgpms
-            if any(i in self.hooked_cgpms[token].outputs for i in cols)
+            for token, cgpm in self.hooked_cgpms.items()
+            if not cols.isdisjoint(cgpm.outputs)
         ]
         self._transition_generic(kernels, N=N, S=S, progress=progress)
 
@@ -792,12 +1011,17 @@ class State(CGpm):
 
         iters = 0
         start = time.time()
+        # Redraw the progress bar at most every 0.1 seconds.
+        last_progress = -float('inf')
 
         while True and kernels:
             for kernel in kernels:
                 p = _proportion_done(N, S, iters, start)
                 if progress:
-                    self._progress(p)
+                    now = time.time()
+                    if p >= 1. or now - last_progress >= .1:
+                        self._progress(p)
+                        last_progress = now
                 if p >= 1.:
                     break
                 kernel()
@@ -809,8 +1033,8 @@ class State(CGpm):
             break
 
         if progress:
-            print '\rCompleted: %d iterations in %f seconds.' % \
-                (iters, time.time()-start)
+            sys.stdout.write('\rCompleted: %d iterations in %f seconds.\n' %
+                (iters, time.time()-start))
 
     def _increment_iterations(self, kernel, N=1):
         previous = self.diagnostics['iterations'].get(kernel, 0)
@@ -819,7 +1043,11 @@ class State(CGpm):
     def _increment_diagnostics(self):
         self.diagnostics['logscore'].append(self.logpdf_score())
         self.diagnostics['column_crp_alpha'].append(self.alpha())
-        self.diagnostics['column_partition'].append(self.Zv().items())
+        # Checkpoints share one snapshot while the column partition is
+        # unchanged, rather than copying Zv at every checkpoint.
+        if self._zv_diagnostics[0] != self._zv_version:
+            self._zv_diagnostics = (self._zv_version, list(self.Zv().items()))
+        self.diagnostics['column_partition'].append(self._zv_diagnostics[1])
 
     def _progress(self, percentage):
         tu.progress(percentage, sys.stdout)
@@ -830,11 +1058,11 @@ class State(CGpm):
 
     def data_array(self):
         """Return dataset as a numpy array."""
-        return np.asarray(self.X.values()).T
+        return self.X.to_array()
 
     def n_rows(self):
         """Number of incorporated rows."""
-        return len(self.X[self.outputs[0]])
+        return self.X.n_rows()
 
     def n_cols(self):
         """Number of incorporated columns."""
@@ -903,17 +1131,40 @@ class State(CGpm):
         Zv = self.crp.clusters[0].data
         return Zv[c] if c is not None else Zv.copy()
 
+    def _Zv_cached(self):
+        """Return Zv and the array of views of self.outputs, cached until the
+        column partition changes; callers must not modify either."""
+        if self._zv_cache[0] != self._zv_version:
+            Zv = self.Zv()
+            view_of = np.fromiter(
+                (Zv[c] for c in self.outputs),
+                dtype=int, count=len(self.outputs))
+            self._zv_cache = (self._zv_version, Zv, view_of)
+        return self._zv_cache[1:]
+
+    def _view_positions(self):
+        """Return mapping from each view to its dims and their positions in
+        the rows of self.X, cached until the column partition changes."""
+        if self._view_positions_cache[0] != self._zv_version:
+            positions = {
+                v: (list(view.dims), np.asarray(
+                    [self._col_pos[d] for d in view.dims], dtype=int))
+                for v, view in self.views.items()
+            }
+            self._view_positions_cache = (self._zv_version, positions)
+        return self._view_positions_cache[1]
+
     # --------------------------------------------------------------------------
     # Accessors
 
     def dim_for(self, c):
-        return self.view_for(c).dims[c]
+        return self._col_view[c].dims[c]
 
     def dims(self):
-        return [self.view_for(c).dims[c] for c in self.outputs]
+        return [self._col_view[c].dims[c] for c in self.outputs]
 
     def view_for(self, c):
-        return self.views[self.Zv(c)]
+        return self._col_view[c]
 
     # --------------------------------------------------------------------------
     # Inference helpers.
@@ -921,73 +1172,65 @@ class State(CGpm):
     def _gibbs_transition_dim(self, col, m):
         """Gibbs on col assignment to Views, with m auxiliary parameters"""
         # XXX Disable col transitions if \exists conditional model anywhere.
-        if any(d.is_conditional() for d in self.dims()):
+        if self._conditional:
             raise ValueError('Cannot transition columns with conditional dims.')
 
-        def is_member(view, dim):
-            return view is not None and dim.index in view.dims
+        # Current dim object and view index.
+        dim = self.dim_for(col)
+
+        # Retrieve current view; the column partition is read directly from
+        # the crp, which is not modified until the dim migrates.
+        Zv = self.crp.clusters[0].data
+        v_a = Zv[col]
 
         # Compute probability of dim data under view partition.
-        def get_data_logp(view, dim):
+        def get_data_logp(view, dim, member):
             # collasped   member  reassign
             # 0           0       1
             # 0           1       0
             # 1           0       1
             # 1           0       1
             # implies reassign = collapsed or (not member)
-            reassign = dim.is_collapsed() or not is_member(view, dim)
-            logp = view.incorporate_dim(dim, reassign=reassign)
-            view.unincorporate_dim(dim)
-            return logp
-
-        # Reuse collapsed, deepcopy uncollapsed.
-        def get_prop_dim(view, dim):
-            if dim.is_collapsed() or is_member(view, dim):
+            reassign = dim.is_collapsed() or not member
+            return view.score_dim(dim, reassign=reassign)
+
+        # Reuse collapsed, clone uncollapsed, whose clusters are reassigned.
+        def get_prop_dim(member, dim):
+            if dim.is_collapsed() or member:
                 return dim
-            return copy.deepcopy(dim)
+            return dim.clone_empty()
 
-        # Current dim object and view index.
-        dim = self.dim_for(col)
+        # The dim is left out of every view while the proposals are scored.
+        self.views[v_a].unincorporate_dim(dim)
 
-        # Retrieve current view.
-        v_a = self.Zv(col)
+        # Proposal tables, the existing views followed by auxiliary views,
+        # and their CRP probabilities, to which the data logps are added.
+        tables, logp_crp = self.crp.clusters[0].gibbs_tables_logps(col, m=m)
+        p_view = np.array(logp_crp)
 
         # Existing view proposals.
-        dprop = [get_prop_dim(self.views[v], dim) for v in self.views]
-        logp_data = [
-            get_data_logp(self.views[v], dim)
-            for (v, dim) in zip(self.views, dprop)
-        ]
+        dprop = [get_prop_dim(v == v_a, dim) for v in self.views]
+        for i, (v, d) in enumerate(zip(self.views, dprop)):
+            p_view[i] += get_data_logp(self.views[v], d, v == v_a)
 
         # Auxiliary view proposals.
-        tables = self.crp.clusters[0].gibbs_tables(col, m=m)
         t_aux = tables[len(self.views):]
-        dprop_aux = [get_prop_dim(None, dim) for t in t_aux]
+        dprop_aux = [get_prop_dim(False, dim) for t in t_aux]
         vprop_aux = [
             View(self.X, outputs=[self.crp_id_view + t], rng=self.rng)
             for t in t_aux
         ]
-        logp_data_aux = [
-            get_data_logp(view, dim)
-            for (view, dim) in zip(vprop_aux, dprop_aux)
-        ]
+        for i, (view, d) in enumerate(zip(vprop_aux, dprop_aux)):
+            p_view[len(self.views) + i] += get_data_logp(view, d, False)
 
         # Extend data structs with auxiliary proposals.
         dprop.extend(dprop_aux)
-        logp_data.extend(logp_data_aux)
-
-        # Compute the CRP probabilities.
-        logp_crp = self.crp.clusters[0].gibbs_logps(col, m=m)
-        assert len(logp_data) == len(logp_crp)
-
-        # Overall view probabilities.
-        p_view = np.add(logp_data, logp_crp)
 
         # Enforce independence constraints.
-        avoid = [a for p in self.Ci if col in p for a in p if a != col]
-        for a in avoid:
-            index = self.views.keys().index(self.Zv(a))
-            p_view[index] = float('-inf')
+        avoid = self._Ci_avoid.get(col)
+        if avoid:
+            view_index = {v: i for i, v in enumerate(self.views)}
+            p_view[[view_index[Zv[a]] for a in avoid]] = float('-inf')
 
         # Draw view.
         assert len(tables) == len(p_view)
@@ -1024,6 +1267,9 @@ class State(CGpm):
         # CRP Accounting
         self.crp.unincorporate(dim.index)
         self.crp.incorporate(dim.index, {self.crp_id: v_b}, {-1:0})
+        self._col_view[dim.index] = self.views[v_b]
+        self._zv_version += 1
+        self._invalidate_network()
         # Delete empty view?
         if delete:
             self._delete_view(v_a)
@@ -1031,11 +1277,13 @@ class State(CGpm):
     def _delete_view(self, v):
         assert v not in self.crp.clusters[0].counts
         del self.views[v]
+        self._invalidate_network()
 
     def _append_view(self, view, identity):
         """Append a view and return and its index."""
         assert len(view.dims) == 0
         self.views[identity] = view
+        self._invalidate_network()
 
     def hypothetical(self, rowid):
         return not 0 <= rowid < self.n_rows()
@@ -1043,43 +1291,55 @@ class State(CGpm):
     # --------------------------------------------------------------------------
     # Data structure invariants.
 
+    @cu.debug_only
     def _check_partitions(self):
-        if not cu.check_env_debug():
-            return
+        # Snapshot the partitions once for all the checks below.
+        Zv = self.Zv()
+        Nv = self.Nv()
+        n_cols = self.n_cols()
         assert self.alpha() > 0.
-        assert all(len(self.views[v].dims) == self.crp.clusters[0].counts[v]
-                for v in self.views)
+        assert all(len(self.views[v].dims) == Nv[v] for v in self.views)
+        # Cached Zv should be current.
+        if self._zv_cache[0] == self._zv_version:
+            assert self._zv_cache[1] == Zv
+        # Column to view mapping should match Zv.
+        assert all(self._col_view[c] is self.views[Zv[c]] for c in Zv)
+        assert len(self._col_view) == n_cols
         # All outputs should be in the dataset keys.
-        assert all([c in self.X.keys() for c in self.outputs])
+        assert all([c in self.X for c in self.outputs])
         # Zv and dims should match n_cols.
-        assert sorted(self.Zv().keys()) == sorted(self.outputs)
-        assert len(self.Zv()) == self.n_cols()
-        assert len(self.dims()) == self.n_cols()
+        assert sorted(Zv.keys()) == sorted(self.outputs)
+        assert len(Zv) == n_cols
+        assert len(self.dims()) == n_cols
         # Nv should account for each column.
-        assert sum(self.Nv().values()) == self.n_cols()
+        assert sum(Nv.values()) == n_cols
         # Nv should have an entry for each view.
         # assert len(self.Nv_list()) == max(self.Zv.values())+1
         for v in self.views:
-            assert len(self.views[v].dims) == self.Nv(v)
             self.views[v]._check_partitions()
         # Dependence constraints.
         assert vu.validate_crp_constrained_partition(
-            [self.Zv(c) for c in self.outputs], self.Cd, self.Ci,
+            [Zv[c] for c in self.outputs], self.Cd, self.Ci,
             self.Rd, self.Ri)
 
     # --------------------------------------------------------------------------
     # Serialize
 
     def to_metadata(self):
+        return self._to_metadata(self.data_array().tolist())
+
+    def _to_metadata(self, X):
+        """Serialize the state with dataset X, omitted when X is None."""
         metadata = dict()
 
         # Dataset.
-        metadata['X'] = self.data_array().tolist()
+        if X is not None:
+            metadata['X'] = X
         metadata['outputs'] = self.outputs
 
         # View partition data.
         metadata['alpha'] = self.alpha()
-        metadata['Zv'] = self.Zv().items()
+        metadata['Zv'] = list(self.Zv().items())
 
         # Column data.
         metadata['cctypes'] = []
@@ -1093,9 +1353,8 @@ class State(CGpm):
         # View data.
         metadata['Zrv'] = []
         metadata['view_alphas'] = []
-        for v, view in self.views.iteritems():
-            rowids = sorted(view.Zr())
-            metadata['Zrv'].append((v, [view.Zr(i) for i in rowids]))
+        for v, view in self.views.items():
+            metadata['Zrv'].append((v, self._row_partition(view).tolist()))
             metadata['view_alphas'].append((v, view.alpha()))
 
         # Diagnostic data.
@@ -1103,7 +1362,7 @@ class State(CGpm):
 
         # Hooked CGPMs.
         metadata['hooked_cgpms'] = dict()
-        for token, cgpm in self.hooked_cgpms.iteritems():
+        for token, cgpm in self.hooked_cgpms.items():
             metadata['hooked_cgpms'][token] = cgpm.to_metadata()
 
         # Path of a Loom project.
@@ -1115,8 +1374,14 @@ class State(CGpm):
         return metadata
 
     def to_pickle(self, fileptr):
-        metadata = self.to_metadata()
-        pickle.dump(metadata, fileptr)
+        # The dataset pickles to a compact binary buffer as a float array,
+        # rather than element by element as nested lists.
+        metadata = self._to_metadata(self.data_array())
+        if isinstance(fileptr, str):
+            with open(fileptr, 'wb') as f:
+                pickle.dump(metadata, f, pickle.HIGHEST_PROTOCOL)
+        else:
+            pickle.dump(metadata, fileptr, pickle.HIGHEST_PROTOCOL)
 
     @classmethod
     def from_metadata(cls, metadata, rng=None):
@@ -1139,7 +1404,7 @@ class State(CGpm):
             rng=rng,
         )
         # Hook up the composed CGPMs.
-        for token, cgpm_metadata in metadata['hooked_cgpms'].iteritems():
+        for token, cgpm_metadata in metadata['hooked_cgpms'].items():
             builder = getattr(
                 importlib.import_module(cgpm_metadata['factory'][0]),
                 cgpm_metadata['factory'][1])
@@ -1150,7 +1415,7 @@ class State(CGpm):
     @classmethod
     def from_pickle(cls, fileptr, rng=None):
         if isinstance(fileptr, str):
-            with open(fileptr, 'r') as f:
+            with open(fileptr, 'rb') as f:
                 metadata = pickle.load(f)
         else:
             metadata = pickle.load(fileptr)
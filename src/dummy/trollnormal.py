@@ -14,14 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import time
-
-import numpy as np
+from math import log
+from math import pi
 
 from cgpm.cgpm import CGpm
 from cgpm.utils import general as gu
 
 
+LOG_2PI_HALF = log(2 * pi) / 2
+
+
 class TrollNormal(CGpm):
     def __init__(self, outputs, inputs, rng=None, distargs=None):
         if rng is None:
@@ -42,11 +44,12 @@ class TrollNormal(CGpm):
         self.rowids.remove(rowid)
 
     def simulate(self, rowid, query, evidence=None, N=None):
-        if N is not None:
-            return [self.simulate(rowid, query, evidence) for i in xrange(N)]
         x = self.rng.normal(
             self._retrieve_location(evidence),
-            self._retrieve_scale(evidence))
+            self._retrieve_scale(evidence),
+            size=N)
+        if N is not None:
+            return [{self.outputs[0]: xi} for xi in x]
         return {self.outputs[0]: x}
 
     def logpdf(self, rowid, query, evidence=None):
@@ -57,11 +60,11 @@ class TrollNormal(CGpm):
         )
 
     def _gaussian_log_pdf(self, x, mu, s):
-        normalizing_constant = -(np.log(2 * np.pi) / 2) - np.log(s)
+        normalizing_constant = -LOG_2PI_HALF - log(s)
         return normalizing_constant - ((x - mu)**2 / (2 * s**2))
 
     def transition(self, N=None, S=None):
-        time.sleep(.1)
+        pass
 
     def _retrieve_location(self, evidence):
         return evidence[self.inputs[0]]
@@ -14,8 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import math
 
+from collections import OrderedDict
+
 import numpy as np
 
 from cgpm.cgpm import CGpm
@@ -23,6 +26,12 @@ from cgpm.utils import config as cu
 from cgpm.utils import general as gu
 
 
+# Number of tuples of clusters whose gathered suffstats a Dim caches. The
+# tables scored for a row change whenever a table opens or closes, so only the
+# most recently used tuples are kept, see Dim.gather_suffstats.
+SUFFSTATS_CACHE_SIZE = 8
+
+
 class Dim(CGpm):
     """CGpm representing a homogeneous mixture of univariate CGpm.
 
@@ -82,9 +91,7 @@ class Dim(CGpm):
         self.hypers = dict(hypers) if hypers is not None else {}
 
         # -- Clusters and Assignments ------------------------------------------
-        self.clusters = {}  # Mapping of cluster k to the object.
-        self.Zr = {}        # Mapping of non-nan rowids to cluster k.
-        self.Zi = {}        # Mapping of nan rowids to cluster k.
+        self._reset_clusters()
 
         # -- Auxiliary Singleton ---- ------------------------------------------
         self.aux_model = self.create_aux_model()
@@ -93,6 +100,20 @@ class Dim(CGpm):
     # Observe
 
     def incorporate(self, rowid, query, evidence=None):
+        k = self._incorporate_unscored(rowid, query, evidence)
+        self._update_cluster(k)
+
+    def incorporate_bulk(self, rowids, queries, evidences):
+        """Incorporate each rowid with its query and evidence, rescoring each
+        cluster that receives rows only once, after all rows are added."""
+        self._suffstats.clear()
+        clusters = set(
+            self._incorporate_unscored(rowid, query, evidence)
+            for rowid, query, evidence in zip(rowids, queries, evidences))
+        for k in clusters:
+            self._rescore_cluster(k)
+
+    def _incorporate_unscored(self, rowid, query, evidence):
         if rowid in self.Zr or rowid in self.Zi:
             raise ValueError('rowid already incorporated: %d.' % rowid)
         k, evidence, valid = self.preprocess(query, evidence)
@@ -104,22 +125,99 @@ class Dim(CGpm):
             self.Zr[rowid] = k
         else:
             self.Zi[rowid] = k
+        return k
 
     def unincorporate(self, rowid):
         if rowid in self.Zi:
             del self.Zi[rowid]
         elif rowid in self.Zr:
-            cluster = self.clusters[self.Zr[rowid]]
-            cluster.unincorporate(rowid)
-            del self.Zr[rowid]
+            k = self.Zr.pop(rowid)
+            self.clusters[k].unincorporate(rowid)
+            self._update_cluster(k)
         else:
             raise ValueError('rowid not incorporated: %d.' % rowid)
 
+    def migrate(self, rowid, query, evidence=None):
+        """Move incorporated rowid to the cluster k in evidence, updating the
+        sufficient statistics of its old and new clusters only. Empty clusters
+        are not removed."""
+        k, evidence, valid = self.preprocess(query, evidence)
+        if rowid in self.Zi:
+            del self.Zi[rowid]
+        elif rowid in self.Zr:
+            k_old = self.Zr.pop(rowid)
+            self.clusters[k_old].unincorporate(rowid)
+            self._update_cluster(k_old)
+        else:
+            raise ValueError('rowid not incorporated: %d.' % rowid)
+        if k not in self.clusters:
+            self.clusters[k] = self.aux_model
+            self.aux_model = self.create_aux_model()
+        if valid:
+            self.clusters[k].incorporate(rowid, query, evidence)
+            self.Zr[rowid] = k
+        else:
+            self.Zi[rowid] = k
+        self._update_cluster(k)
+
+    def remove_cluster(self, k):
+        """Delete the cluster k, which must be empty."""
+        del self.clusters[k]
+        self._refresh_suffstats(k)
+        score = self._cluster_scores.pop(k, 0.)
+        if self._log_marginal is not None:
+            self._log_marginal -= score
+
     # --------------------------------------------------------------------------
     # logpdf score
 
     def logpdf_score(self):
-        return sum(self.clusters[k].logpdf_score() for k in self.clusters)
+        return self.log_marginal
+
+    @property
+    def log_marginal(self):
+        """Sum of the logpdf_score of the clusters, maintained incrementally
+        as rows move and recomputed only after the hypers or params change."""
+        if self._log_marginal is None:
+            self._cluster_scores = {
+                k: self.clusters[k].logpdf_score() for k in self.clusters}
+            self._log_marginal = sum(self._cluster_scores.itervalues())
+        return self._log_marginal
+
+    def _rescore_cluster(self, k):
+        if self._log_marginal is not None:
+            score = self.clusters[k].logpdf_score()
+            self._log_marginal += score - self._cluster_scores.get(k, 0.)
+            self._cluster_scores[k] = score
+
+    def _update_cluster(self, k):
+        self._rescore_cluster(k)
+        self._refresh_suffstats(k)
+
+    def _refresh_suffstats(self, k):
+        # Regather the entry of k in each cached gather_suffstats, in place,
+        # which leaves the entries of the other clusters valid.
+        model = self.clusters.get(k, self.aux_model)
+        single = None
+        for key, stats in self._suffstats.iteritems():
+            if k in key:
+                if single is None:
+                    single = self.model.gather_suffstats([model])
+                i = key.index(k)
+                for name, value in single.iteritems():
+                    stats[name][i] = value[0]
+
+    def _invalidate_scores(self):
+        self._cluster_scores = {}
+        self._log_marginal = None
+
+    def logpdf_score_partition(self, X, Z):
+        """Return logpdf_score of data X were its rows clustered by Z.
+
+        Requires a collapsed model implementing calc_logpdf_partition; the
+        clusters of the Dim are left untouched.
+        """
+        return self.model.calc_logpdf_partition(X, Z, self.hypers)
 
     # --------------------------------------------------------------------------
     # logpdf
@@ -129,6 +227,50 @@ class Dim(CGpm):
         cluster = self.clusters.get(k, self.aux_model)
         return cluster.logpdf(rowid, query, evidence) if valid else 0
 
+    def logpdf_clusters(self, rowid, query, clusters, evidence=None):
+        """Return array of logpdf of query in each cluster k of clusters.
+
+        The clusters are supplied directly rather than through inputs[0] in
+        the evidence. Models may provide `calc_cluster_logps` to evaluate the
+        query against all the clusters in one vectorized pass.
+        """
+        evidence = evidence if evidence is not None else {}
+        if math.isnan(query[self.index]) \
+                or (evidence and any(np.isnan(evidence.values()))):
+            return np.zeros(len(clusters))
+        if hasattr(self.model, 'calc_cluster_logps') and not evidence:
+            stats = self.gather_suffstats(clusters)
+            return self.model.calc_cluster_logps(stats, query[self.index])
+        models = [self.clusters.get(k, self.aux_model) for k in clusters]
+        return np.asarray(
+            [model.logpdf(rowid, query, evidence) for model in models])
+
+    def logpdf_clusters_excluding(self, rowid, query, clusters, evidence=None):
+        """Return logpdf_clusters of query in clusters with the incorporated
+        rowid removed from its own cluster, leaving the Dim unchanged.
+
+        Models providing `remove_suffstats` remove the cell from the gathered
+        suffstats of its cluster in closed form, which keeps the cache of
+        gather_suffstats; otherwise rowid is unincorporated and incorporated
+        again around the call.
+        """
+        evidence = evidence if evidence is not None else {}
+        if rowid not in self.Zr:
+            # The cell is missing, so it contributes to no cluster.
+            return self.logpdf_clusters(rowid, query, clusters, evidence)
+        k = self.Zr[rowid]
+        if hasattr(self.model, 'remove_suffstats') and not evidence:
+            x = query[self.index]
+            stats = self.gather_suffstats(clusters)
+            if k in clusters:
+                stats = self.model.remove_suffstats(
+                    stats, list(clusters).index(k), x)
+            return self.model.calc_cluster_logps(stats, x)
+        self.unincorporate(rowid)
+        logps = self.logpdf_clusters(rowid, query, clusters, evidence)
+        self.incorporate(rowid, query, gu.merged(evidence, {self.inputs[0]: k}))
+        return logps
+
     # --------------------------------------------------------------------------
     # Simulate
 
@@ -144,9 +286,11 @@ class Dim(CGpm):
 
     def transition_params(self):
         """Transitions the component parameters of each cluster."""
+        self._suffstats.clear()
         if not self.is_collapsed():
             for k in self.clusters:
                 self.clusters[k].transition_params()
+            self._invalidate_scores()
 
     def transition_hypers(self):
         """Transitions the hyperparameters of each cluster."""
@@ -157,7 +301,13 @@ class Dim(CGpm):
                 return self.clusters[k].logpdf_score()
             def compute_proposal(g):
                 return sum(compute_cluster_proposal(k,g) for k in self.clusters)
-            logps = [compute_proposal(g) for g in self.hyper_grids[target]]
+            # Models may score the entire grid in one vectorized pass.
+            if hasattr(self.model, 'calc_hyper_logps'):
+                logps = self.model.calc_hyper_logps(
+                    self.gather_suffstats(self.clusters.keys()),
+                    self.hyper_grids[target], self.hypers, target)
+            else:
+                logps = [compute_proposal(g) for g in self.hyper_grids[target]]
             index = gu.log_pflip(logps, rng=self.rng)
             self.hypers[target] = self.hyper_grids[target][index]
         # Transition each of the hyperparameters.
@@ -168,6 +318,8 @@ class Dim(CGpm):
         for k in self.clusters:
             self.clusters[k].set_hypers(self.hypers)
         self.aux_model = self.create_aux_model()
+        self._suffstats.clear()
+        self._invalidate_scores()
 
     def transition_hyper_grids(self, X, n_grid=30):
         """Transitions hyperparameter grids using empirical Bayes."""
@@ -178,6 +330,8 @@ class Dim(CGpm):
             for h in self.hyper_grids:
                 self.hypers[h] = self.rng.choice(self.hyper_grids[h])
         self.aux_model = self.create_aux_model()
+        self._suffstats.clear()
+        self._invalidate_scores()
 
     # --------------------------------------------------------------------------
     # Attributes from self.model
@@ -204,6 +358,8 @@ class Dim(CGpm):
         self.hypers = hypers
         for model in self.clusters.values():
             model.set_hypers(hypers)
+        self._suffstats.clear()
+        self._invalidate_scores()
 
     # --------------------------------------------------------------------------
     # Plotter
@@ -220,11 +376,71 @@ class Dim(CGpm):
     # --------------------------------------------------------------------------
     # Internal
 
+    def clone_empty(self):
+        """Return a copy of the Dim without clusters or incorporated rows.
+
+        The copy is to be populated by a bulk incorporate, as in
+        View.incorporate_dim with reassign, so the clusters are not copied.
+        As with a deepcopy of the Dim, the copy has its own copy of the rng.
+        """
+        dim = type(self).__new__(type(self))
+        dim.rng = copy.deepcopy(self.rng)
+        dim.outputs = list(self.outputs)
+        dim.inputs = list(self.inputs)
+        dim.index = self.index
+        dim.model = self.model
+        dim.cctype = self.cctype
+        dim.distargs = dict(self.distargs)
+        dim.hyper_grids = dict(self.hyper_grids)
+        dim.hypers = dict(self.hypers)
+        dim._reset_clusters()
+        memo = {
+            id(self.rng): dim.rng,
+            id(self.distargs): dim.distargs,
+            id(self.hypers): dim.hypers,
+        }
+        dim.aux_model = copy.deepcopy(self.aux_model, memo)
+        return dim
+
+    def _reset_clusters(self):
+        """Remove all clusters and rows, and the caches derived from them."""
+        self.clusters = {}  # Mapping of cluster k to the object.
+        self.Zr = {}        # Mapping of non-nan rowids to cluster k.
+        self.Zi = {}        # Mapping of nan rowids to cluster k.
+        # Mapping of tuple of clusters to their suffstats from the model's
+        # gather_suffstats, least recently used first. A row moving updates
+        # the entries of its clusters in place, and changing the hypers or
+        # params clears the mapping.
+        self._suffstats = OrderedDict()
+        # Mapping of cluster k to its logpdf_score, and the running total of
+        # the scores, or None when they must be recomputed from the clusters.
+        self._cluster_scores = {}
+        self._log_marginal = 0.
+
     def create_aux_model(self):
         return self.model(
             outputs=[self.index], inputs=self.inputs[1:], hypers=self.hypers,
             distargs=self.distargs, rng=self.rng)
 
+    def gather_suffstats(self, clusters):
+        """Return the model's gather_suffstats of the given clusters.
+
+        Clusters not in self.clusters are represented by the aux_model. The
+        result is cached, and the entry of a cluster, along the first axis of
+        each array, is updated in place whenever a row enters or leaves it.
+        Only the SUFFSTATS_CACHE_SIZE most recently used results are kept.
+        """
+        key = tuple(clusters)
+        try:
+            stats = self._suffstats.pop(key)
+        except KeyError:
+            models = [self.clusters.get(k, self.aux_model) for k in clusters]
+            stats = self.model.gather_suffstats(models)
+            if len(self._suffstats) >= SUFFSTATS_CACHE_SIZE:
+                self._suffstats.popitem(last=False)
+        self._suffstats[key] = stats
+        return stats
+
     def preprocess(self, query, evidence):
         evidence = evidence.copy()
         try:
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compiled row Gibbs sweep for views whose dims are all normal or bernoulli.
+
+The view is exported to arrays: the data of its dims, the row assignments
+relabelled to slots 0..K-1, and the suffstats of each slot and dim. One
+numba kernel then runs the entire sweep, and the rows which changed cluster
+are migrated in the view. The chain is the same as View.transition_rows with
+one auxiliary table, but the tables are enumerated in a different order, so
+a seeded sweep does not reproduce the draws of the Python implementation.
+"""
+
+import math
+
+import numpy as np
+
+from cgpm.utils import jit as ju
+
+
+SUPPORTED_CCTYPES = ('normal', 'bernoulli')
+
+
+def is_supported(view):
+    """True if transition_rows can sweep the rows of view."""
+    return all(
+        dim.cctype in SUPPORTED_CCTYPES and not dim.is_conditional()
+        for dim in view.dims.itervalues())
+
+
+def transition_rows(view, rows=None):
+    """Gibbs sweep over the cluster assignments of rows in view."""
+    if not is_supported(view):
+        raise ValueError('Compiled sweep requires %s dims: %s.'
+            % (SUPPORTED_CCTYPES, [d.cctype for d in view.dims.itervalues()]))
+    if rows is None:
+        rows = view.Zr().keys()
+    if len(rows) == 0:
+        return
+    rows = view.rng.permutation(rows)
+    uniforms = view.rng.random_sample(len(rows))
+    # Relabel the tables to contiguous slots, with room for one new table
+    # per row in the sweep.
+    tables = sorted(view.Nk())
+    Z = np.searchsorted(tables, view._cluster_array())
+    capacity = len(tables) + len(rows)
+    counts = np.bincount(Z, minlength=capacity).astype(float)
+    # Data, suffstats, and hypers of the normal and the bernoulli dims.
+    normals = [d for d in view.outputs[1:] if view.dims[d].cctype == 'normal']
+    bernoullis = [
+        d for d in view.outputs[1:] if view.dims[d].cctype == 'bernoulli']
+    X_n = _gather_data(view, normals)
+    X_b = _gather_data(view, bernoullis)
+    N_n, sum_x_n, sum_x_sq_n = _gather_suffstats(X_n, Z, capacity)
+    N_b, sum_x_b, _sum_x_sq_b = _gather_suffstats(X_b, Z, capacity)
+    h_n = _gather_hypers(view, normals, ['m', 'r', 's', 'nu'])
+    h_b = _gather_hypers(view, bernoullis, ['alpha', 'beta'])
+    Z_new = Z.copy()
+    _gibbs_sweep(
+        Z_new, counts, view.alpha(), len(tables),
+        np.asarray(rows, dtype=int), uniforms,
+        X_n, N_n, sum_x_n, sum_x_sq_n, h_n[0], h_n[1], h_n[2], h_n[3],
+        X_b, N_b, sum_x_b, h_b[0], h_b[1])
+    # Slots beyond the original tables receive fresh labels.
+    labels = tables + range(tables[-1] + 1, tables[-1] + 1 + len(rows))
+    for rowid in np.flatnonzero(Z_new != Z):
+        view._migrate_row(int(rowid), labels[Z_new[rowid]])
+    view._check_partitions()
+
+
+def _gather_data(view, dims):
+    if not dims:
+        return np.zeros((view.n_rows(), 0))
+    # Stack only the columns of dims, rather than copying the whole Dataset,
+    # which holds the columns of every view of the State.
+    return np.column_stack([view.X[d] for d in dims])
+
+
+def _gather_hypers(view, dims, names):
+    return np.asarray(
+        [[view.dims[d].hypers[h] for d in dims] for h in names],
+        dtype=float).reshape(len(names), len(dims))
+
+
+def _gather_suffstats(X, Z, capacity):
+    N = np.zeros((capacity, X.shape[1]))
+    sum_x = np.zeros((capacity, X.shape[1]))
+    sum_x_sq = np.zeros((capacity, X.shape[1]))
+    for d in xrange(X.shape[1]):
+        observed = ~np.isnan(X[:,d])
+        x, z = X[observed, d], Z[observed]
+        N[:,d] = np.bincount(z, minlength=capacity)
+        sum_x[:,d] = np.bincount(z, weights=x, minlength=capacity)
+        sum_x_sq[:,d] = np.bincount(z, weights=x*x, minlength=capacity)
+    return N, sum_x, sum_x_sq
+
+
+@ju.njit
+def _calc_log_Z(N, sum_x, sum_x_sq, m, r, s, nu):
+    rn = r + N
+    nun = nu + N
+    mn = (r*m + sum_x) / rn
+    sn = s + sum_x_sq + r*m*m - rn*mn*mn
+    if sn == 0:
+        sn = s
+    return ((nun + 1.) / 2.) * math.log(2) + .5 * math.log(math.pi) \
+        - .5 * math.log(rn) - (nun/2.) * math.log(sn) + math.lgamma(nun/2.)
+
+
+@ju.njit
+def _update_suffstats(X, i, k, N, sum_x, sum_x_sq, sign):
+    """Add (sign=1) or remove (sign=-1) the observed cells of row i in X to
+    the suffstats of slot k."""
+    for d in range(X.shape[1]):
+        x = X[i,d]
+        if not math.isnan(x):
+            N[k,d] += sign
+            sum_x[k,d] += sign*x
+            sum_x_sq[k,d] += sign*x*x
+
+
+@ju.njit
+def _gibbs_sweep(
+        Z, counts, alpha, n_slots, rows, uniforms,
+        X_n, N_n, sum_x_n, sum_x_sq_n, m, r, s, nu,
+        X_b, N_b, sum_x_b, alpha_b, beta_b):
+    """Resample Z[i] for each i in rows in turn, updating the suffstats.
+
+    Slots 0..n_slots-1 are occupied. When a row leaves a singleton table,
+    that table is its auxiliary table, else a free slot is, matching
+    Crp.gibbs_tables with m=1. Only the occupied tables are scored.
+    """
+    log_2pi_half = .5 * math.log(2*math.pi)
+    # The bernoulli dims keep no sum of squares; it is updated but unused.
+    sum_x_sq_b = np.zeros(N_b.shape)
+    # Occupied slots, the position of each in active, and emptied slots.
+    active = np.empty(len(counts), dtype=np.int64)
+    position = np.empty(len(counts), dtype=np.int64)
+    free = np.empty(len(counts), dtype=np.int64)
+    n_active = 0
+    n_free = 0
+    for k in range(n_slots):
+        active[n_active] = k
+        position[k] = n_active
+        n_active += 1
+    logps = np.empty(len(counts))
+    for t in range(len(rows)):
+        i = rows[t]
+        k_old = Z[i]
+        counts[k_old] -= 1
+        _update_suffstats(X_n, i, k_old, N_n, sum_x_n, sum_x_sq_n, -1.)
+        _update_suffstats(X_b, i, k_old, N_b, sum_x_b, sum_x_sq_b, -1.)
+        # Choose the auxiliary table.
+        singleton = counts[k_old] == 0
+        if singleton:
+            last = active[n_active-1]
+            active[position[k_old]] = last
+            position[last] = position[k_old]
+            n_active -= 1
+            aux = k_old
+        elif n_free > 0:
+            aux = free[n_free-1]
+        else:
+            aux = n_slots
+        # Score the occupied tables, then the auxiliary table.
+        m_logp = -np.inf
+        for c in range(n_active+1):
+            k = active[c] if c < n_active else aux
+            lp = math.log(counts[k]) if c < n_active else math.log(alpha)
+            for d in range(X_n.shape[1]):
+                x = X_n[i,d]
+                if not math.isnan(x):
+                    ZN = _calc_log_Z(
+                        N_n[k,d], sum_x_n[k,d], sum_x_sq_n[k,d],
+                        m[d], r[d], s[d], nu[d])
+                    ZM = _calc_log_Z(
+                        N_n[k,d]+1, sum_x_n[k,d]+x, sum_x_sq_n[k,d]+x*x,
+                        m[d], r[d], s[d], nu[d])
+                    lp += -log_2pi_half + ZM - ZN
+            for d in range(X_b.shape[1]):
+                x = X_b[i,d]
+                if not math.isnan(x):
+                    numer = sum_x_b[k,d] + alpha_b[d] if x == 1 \
+                        else N_b[k,d] - sum_x_b[k,d] + beta_b[d]
+                    lp += math.log(numer) \
+                        - math.log(N_b[k,d] + alpha_b[d] + beta_b[d])
+            logps[c] = lp
+            m_logp = max(m_logp, lp)
+        # Inverse transform sampling of the new table. The unnormalized
+        # probabilities overwrite logps, so each is exponentiated once.
+        total = 0.
+        for c in range(n_active+1):
+            logps[c] = math.exp(logps[c] - m_logp)
+            total += logps[c]
+        target = uniforms[t] * total
+        cumulative = 0.
+        c_new = n_active
+        for c in range(n_active+1):
+            cumulative += logps[c]
+            if cumulative > target:
+                c_new = c
+                break
+        if c_new < n_active:
+            k_new = active[c_new]
+            if singleton:
+                free[n_free] = k_old
+                n_free += 1
+                N_n[k_old,:] = 0.
+                sum_x_n[k_old,:] = 0.
+                sum_x_sq_n[k_old,:] = 0.
+                N_b[k_old,:] = 0.
+                sum_x_b[k_old,:] = 0.
+        else:
+            k_new = aux
+            if not singleton:
+                if n_free > 0:
+                    n_free -= 1
+                else:
+                    n_slots += 1
+            active[n_active] = k_new
+            position[k_new] = n_active
+            n_active += 1
+        Z[i] = k_new
+        counts[k_new] += 1
+        _update_suffstats(X_n, i, k_new, N_n, sum_x_n, sum_x_sq_n, 1.)
+        _update_suffstats(X_b, i, k_new, N_b, sum_x_b, sum_x_sq_b, 1.)
@@ -198,7 +198,7 @@ def relevance_probability(view, rowid_target, rowid_query):
             for (a, b) in zip(logps_diff_table, logps_clusters_diff)
         ]
         # Sum the deltas.
-        logp_diff_table = logsumexp([logsumexp(l) for l in logps_delta])
+        logp_diff_table = logsumexp(np.concatenate(logps_delta))
 
         # Confirm logp_same_table + logp_diff_table equal normalizing constant.
         assert np.allclose(
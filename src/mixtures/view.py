@@ -16,16 +16,18 @@
 
 import itertools
 
-from math import isnan
+from collections import OrderedDict
 
 import numpy as np
 
 from cgpm.cgpm import CGpm
+from cgpm.mixtures import gibbs
 from cgpm.mixtures.dim import Dim
 from cgpm.network.importance import ImportanceNetwork
 from cgpm.utils import config as cu
 from cgpm.utils import general as gu
 from cgpm.utils.config import cctype_class
+from cgpm.utils.dataset import Dataset
 from cgpm.utils.general import merged
 
 
@@ -40,10 +42,10 @@ class View(CGpm):
 
         Parameters
         ----------
-        X : dict{int:list}
+        X : dict{int:list} or cgpm.utils.dataset.Dataset
             Dataset, where the cell `X[outputs[i]][rowid]` contains the value
             for column outputs[i] and rowd index `rowid`. All rows are
-            incorporated by default.
+            incorporated by default. A dict is copied into a Dataset.
         outputs : list<int>
             List of output variables. The first item is mandatory, corresponding
             to the token of the exposed cluster. outputs[1:] are the observable
@@ -72,7 +74,18 @@ class View(CGpm):
         self.inputs = []
 
         # -- Dataset -----------------------------------------------------------
-        self.X = X
+        self.X = X if isinstance(X, Dataset) else Dataset.from_dict(X)
+        # Mapping of rowid to its observed cells, see _observed_cells.
+        self._evidence_cache = {}
+        # Evidence dict reused by _get_evidence, see its docstring.
+        self._evidence_scratch = {}
+        # ImportanceNetwork over the crp and dims, cleared by
+        # _invalidate_network whenever the set of dims changes.
+        self._network = None
+        # Array of all the rowids, shuffled in place by transition_rows.
+        self._rowids_buffer = np.arange(0)
+        # Array of the cluster of each rowid, see _cluster_array.
+        self._clusters_buffer = None
 
         # -- Outputs -----------------------------------------------------------
         if len(outputs) < 1:
@@ -85,7 +98,8 @@ class View(CGpm):
             assert len(outputs[1:])==len(cctypes)
             assert len(distargs) == len(cctypes)
             assert len(hypers) == len(cctypes)
-        self.outputs = list(outputs)
+        # The observable outputs are appended by incorporate_dim.
+        self.outputs = list(outputs[:1])
 
         # -- Row CRP -----------------------------------------------------------
         self.crp = Dim(
@@ -106,8 +120,8 @@ class View(CGpm):
                 self.crp.incorporate(i, {self.outputs[0]: z}, {-1:0})
 
         # -- Dimensions --------------------------------------------------------
-        self.dims = dict()
-        for i, c in enumerate(self.outputs[1:]):
+        self.dims = OrderedDict()
+        for i, c in enumerate(outputs[1:]):
             dim = Dim(
                 outputs=[c],
                 inputs=[self.outputs[0]],
@@ -132,14 +146,34 @@ class View(CGpm):
         dim.inputs[0] = self.outputs[0]
         if reassign:
             self._bulk_incorporate(dim)
+        if dim.index not in self.dims:
+            self.outputs.append(dim.index)
         self.dims[dim.index] = dim
-        self.outputs = self.outputs[:1] + self.dims.keys()
+        self._evidence_cache.clear()
+        self._invalidate_network()
         return dim.logpdf_score()
 
+    def score_dim(self, dim, reassign=True):
+        """Return logpdf_score of dim were it incorporated into this View.
+
+        Equals incorporate_dim(dim, reassign) followed by unincorporate_dim.
+        A collapsed dim whose model implements calc_logpdf_partition is scored
+        from the row partition directly, leaving the dim untouched.
+        """
+        if reassign and dim.is_collapsed() \
+                and hasattr(dim.model, 'calc_logpdf_partition'):
+            X = np.asarray(self.X[dim.index], dtype=float)
+            return dim.logpdf_score_partition(X, self._cluster_array())
+        logp = self.incorporate_dim(dim, reassign=reassign)
+        self.unincorporate_dim(dim)
+        return logp
+
     def unincorporate_dim(self, dim):
         """Remove dim from this View (does not modify)."""
         del self.dims[dim.index]
-        self.outputs = self.outputs[:1] + self.dims.keys()
+        self.outputs.remove(dim.index)
+        self._evidence_cache.clear()
+        self._invalidate_network()
         return dim.logpdf_score()
 
     def incorporate(self, rowid, query, evidence=None):
@@ -156,29 +190,67 @@ class View(CGpm):
             has a generative model for k, unlike Dim which takes k as evidence.
         """
         k = query.get(self.outputs[0], 0)
+        self._evidence_cache.pop(rowid, None)
         self.crp.incorporate(rowid, {self.outputs[0]: k}, {-1: 0})
+        self._clusters_buffer = None
         for d in self.dims:
             self.dims[d].incorporate(
                 rowid,
                 query={d: query[d]},
                 evidence=self._get_evidence(rowid, self.dims[d], k))
-        # If the user did not specify a cluster assignment, sample one.
+        # If the user did not specify a cluster assignment, sample one. The
+        # first row of the view is alone at its table, which is then the only
+        # table the sweep can choose, so the tables are not scored; its
+        # uniform is still drawn, so that seeded chains are unchanged.
         if self.outputs[0] not in query:
-            self.transition_rows(rows=[rowid])
+            if self.n_rows() == 1:
+                self.rng.random_sample(1)
+            else:
+                self.transition_rows(rows=[rowid])
+
+    def incorporate_bulk(self, rowids, queries):
+        """Incorporate multiple observations at once, see incorporate.
+
+        The rows whose query specifies their cluster are added to the crp and
+        to each dim in one pass per dim. The other rows are incorporated one
+        at a time afterwards, since the cluster sampled for each depends on
+        the rows before it.
+        """
+        assert len(rowids) == len(queries)
+        z = self.outputs[0]
+        fixed = [(r, q) for r, q in zip(rowids, queries) if z in q]
+        for rowid, _query in fixed:
+            self._evidence_cache.pop(rowid, None)
+        self.crp.incorporate_bulk(
+            [r for r, _q in fixed],
+            [{z: q[z]} for _r, q in fixed],
+            [{-1: 0}] * len(fixed))
+        self._clusters_buffer = None
+        for d, dim in self.dims.iteritems():
+            dim.incorporate_bulk(
+                [r for r, _q in fixed],
+                [{d: q[d]} for _r, q in fixed],
+                [dict(self._get_evidence(r, dim, q[z])) for r, q in fixed])
+        for rowid, query in zip(rowids, queries):
+            if z not in query:
+                self.incorporate(rowid, query)
 
     def unincorporate(self, rowid):
+        self._evidence_cache.pop(rowid, None)
         # Unincorporate from dims.
         for dim in self.dims.itervalues():
             dim.unincorporate(rowid)
         # Account.
         k = self.Zr(rowid)
         self.crp.unincorporate(rowid)
+        self._clusters_buffer = None
         if k not in self.Nk():
             for dim in self.dims.itervalues():
-                del dim.clusters[k]     # XXX Abstract me!
+                dim.remove_cluster(k)
 
     # XXX Major hack to force values of NaN cells in incorporated rowids.
     def force_cell(self, rowid, query):
+        self._evidence_cache.pop(rowid, None)
         k = self.Zr(rowid)
         for d in query:
             self.dims[d].unincorporate(rowid)
@@ -222,7 +294,6 @@ class View(CGpm):
 
     def transition_crp_alpha(self):
         self.crp.transition_hypers()
-        self.crp.transition_hypers()
 
     def transition_dim_hypers(self, cols=None):
         if cols is None:
@@ -236,20 +307,41 @@ class View(CGpm):
         for c in cols:
             self.dims[c].transition_hyper_grids(self.X[c])
 
-    def transition_rows(self, rows=None):
+    def transition_rows(self, rows=None, block=False, compiled=False):
+        """Gibbs sweep over the cluster assignments of rows. If block, follow
+        the sweep with split-merge proposals which move whole groups of rows,
+        see _transition_rows_block. If compiled and all the dims are normal or
+        bernoulli, run the sweep in the kernel of cgpm.mixtures.gibbs."""
+        if compiled and gibbs.is_supported(self):
+            rows = self.Zr().keys() if rows is None else rows
+            gibbs.transition_rows(self, rows=rows)
+            if block:
+                self._transition_rows_block(rows)
+            return
         if rows is None:
-            rows = self.Zr().keys()
-        rows = self.rng.permutation(rows)
-        for rowid in rows:
-            self._gibbs_transition_row(rowid)
+            rows = self._all_rowids()
+            self.rng.shuffle(rows)
+        else:
+            rows = self.rng.permutation(rows)
+        # The tables and their log counts only change when a row migrates.
+        sweep = None
+        # The uniforms of the sequential draws are generated together.
+        uniforms = self.rng.random_sample(len(rows))
+        for rowid, u in zip(rows, uniforms):
+            if sweep is None:
+                sweep = self.crp.clusters[0].sweep_tables_logps()
+            if self._gibbs_transition_row(rowid, sweep, u):
+                sweep = None
+        if block:
+            self._transition_rows_block(rows)
 
     # --------------------------------------------------------------------------
     # logscore.
 
     def logpdf_score(self):
         """Compute the marginal logpdf CRP assignment and data."""
-        logp_crp = self.crp.logpdf_score()
-        logp_dims = [dim.logpdf_score() for dim in self.dims.itervalues()]
+        logp_crp = self.crp.log_marginal
+        logp_dims = [dim.log_marginal for dim in self.dims.itervalues()]
         return logp_crp + sum(logp_dims)
 
     # --------------------------------------------------------------------------
@@ -302,10 +394,11 @@ class View(CGpm):
             # p(z=K[i]|xE)                              logp_evidence[i]
             # p(xQ|z=K[i],xE)                           logp_query[i]
             K = self.crp.clusters[0].gibbs_tables(-1)
-            evidences = [merged(evidence, {self.outputs[0]: k}) for k in K]
-            lp_evidence_unorm = [network.logpdf(rowid, ev) for ev in evidences]
+            lp_evidence_unorm = self._logpdf_clusters(
+                network, rowid, evidence, None, K)
             lp_evidence = gu.log_normalize(lp_evidence_unorm)
-            lp_query = [network.logpdf(rowid, query, ev) for ev in evidences]
+            lp_query = self._logpdf_clusters(
+                network, rowid, query, evidence, K)
             return gu.logsumexp(np.add(lp_evidence, lp_query))
 
     # --------------------------------------------------------------------------
@@ -330,8 +423,8 @@ class View(CGpm):
             query = [q for q in query if q != self.outputs[0]]
         # Weight cluster assignments by likelihood of evidence in each cluster.
         K = self.crp.clusters[0].gibbs_tables(-1)
-        evidences = [merged(evidence, {self.outputs[0]: k}) for k in K]
-        lp_evidence_unorm = [network.logpdf(rowid, ev) for ev in evidences]
+        lp_evidence_unorm = self._logpdf_clusters(
+            network, rowid, evidence, None, K)
         # Find number of samples in each cluster.
         Ks = gu.log_pflip(lp_evidence_unorm, array=K, size=N, rng=self.rng)
         counts = {k:n for k, n in enumerate(np.bincount(Ks)) if n > 0}
@@ -362,51 +455,143 @@ class View(CGpm):
     # Internal simulate/logpdf helpers
 
     def build_network(self):
-        return ImportanceNetwork(
-            cgpms=[self.crp.clusters[0]] + self.dims.values(),
-            accuracy=1,
-            rng=self.rng)
+        if self._network is None:
+            self._network = ImportanceNetwork(
+                cgpms=[self.crp.clusters[0]] + self.dims.values(),
+                accuracy=1,
+                rng=self.rng)
+        return self._network
+
+    def _invalidate_network(self):
+        self._network = None
+
+    def _logpdf_clusters(self, network, rowid, query, evidence, K):
+        """Return array of log p(xQ|xE,z=k) for each cluster k in K, or of
+        the joint log p(xQ,z=k) if evidence is None.
+
+        If no dim is conditional, the cells are independent given the cluster
+        and each dim scores its cell in all the clusters in one call to
+        Dim.logpdf_clusters, instead of running the network once per k.
+        """
+        z = self.outputs[0]
+        if any(dim.is_conditional() for dim in self.dims.itervalues()):
+            # The network copies its query and evidence, so a single dict
+            # is updated with each k in turn.
+            scratch = dict(query if evidence is None else evidence)
+            logps = []
+            for k in K:
+                scratch[z] = k
+                logps.append(
+                    network.logpdf(rowid, scratch) if evidence is None
+                    else network.logpdf(rowid, query, scratch))
+            return logps
+        logps = np.zeros(len(K))
+        if evidence is None:
+            crp = self.crp.clusters[0]
+            logps += [crp.logpdf(rowid, {z: k}) for k in K]
+        for c, x in query.iteritems():
+            if c in self.dims:
+                logps += self.dims[c].logpdf_clusters(rowid, {c: x}, K)
+        return logps
 
     # --------------------------------------------------------------------------
     # Internal row transition.
 
-    def _gibbs_transition_row(self, rowid):
+    def _all_rowids(self):
+        """Return array of all the rowids, which is reused across sweeps and
+        reallocated only when the number of rows changes."""
+        if len(self._rowids_buffer) != self.n_rows():
+            self._rowids_buffer = np.arange(self.n_rows())
+        return self._rowids_buffer
+
+    def _gibbs_transition_row(self, rowid, sweep=None, u=None):
+        """Resample the cluster of rowid, returning True if it migrated. The
+        optional uniform u drives the categorical draw."""
         # Probability of row crp assignment to each cluster.
-        K = self.crp.clusters[0].gibbs_tables(rowid)
-        logp_crp = self.crp.clusters[0].gibbs_logps(rowid)
+        K, logp_crp = self.crp.clusters[0].gibbs_tables_logps(
+            rowid, sweep=sweep)
         # Probability of row data in each cluster.
         logp_data = self._logpdf_row_gibbs(rowid, K)
         assert len(logp_data) == len(logp_crp)
         # Sample new cluster.
-        p_cluster = np.add(logp_data, logp_crp)
-        z_b = gu.log_pflip(p_cluster, array=K, rng=self.rng)
+        p_cluster = np.add(logp_data, logp_crp, out=logp_data)
+        z_b = gu.log_pflip(p_cluster, array=K, rng=self.rng) if u is None \
+            else gu.log_pflip_uniform(p_cluster, u, array=K)
         # Migrate the row.
-        if self.Zr(rowid) != z_b:
+        migrate = self.Zr(rowid) != z_b
+        if migrate:
             self._migrate_row(rowid, z_b)
         self._check_partitions()
+        return migrate
+
+    def _transition_rows_block(self, rows):
+        """Make one split-merge proposal per cluster, anchored at rows.
+
+        Each proposal picks two anchor rows. If they share a cluster, the other
+        rows of the cluster are split uniformly at random between the anchors,
+        otherwise the cluster of the first anchor is merged into that of the
+        second. The move is accepted with the Metropolis-Hastings ratio of the
+        joint logpdf_score, which is the marginal likelihood of the partition
+        only when all the dims are collapsed; otherwise no moves are made.
+        """
+        if len(rows) < 2:
+            return
+        if not all(dim.is_collapsed() for dim in self.dims.itervalues()):
+            return
+        for _i in xrange(len(self.Nk())):
+            self._split_merge_rows(rows)
+        self._check_partitions()
+
+    def _split_merge_rows(self, rows):
+        i, j = self.rng.choice(rows, size=2, replace=False)
+        k_i, k_j = self.Zr(i), self.Zr(j)
+        members = [r for r, k in self.Zr().iteritems() if k == k_i]
+        if k_i == k_j:
+            # Split: i moves to a fresh cluster with each other row w.p. 1/2.
+            others = [r for r in members if r != i and r != j]
+            coins = self.rng.uniform(size=len(others)) < .5
+            moved = [i] + [r for r, c in zip(others, coins) if c]
+            k_new = max(self.Nk()) + 1
+            log_q = len(others) * np.log(2)
+        else:
+            # Merge: the reverse split must reproduce both clusters.
+            moved = members
+            k_new = k_j
+            log_q = -(len(members) + self.Nk(k_j) - 2) * np.log(2)
+        logp_old = self.logpdf_score()
+        for rowid in moved:
+            self._migrate_row(rowid, k_new)
+        logp_new = self.logpdf_score()
+        if np.log(self.rng.uniform()) >= logp_new - logp_old + log_q:
+            for rowid in moved:
+                self._migrate_row(rowid, k_i)
 
     def _logpdf_row_gibbs(self, rowid, K):
-        return [sum([self._logpdf_cell_gibbs(rowid, dim, k)
-            for dim in self.dims.itervalues()]) for k in K]
+        logps = np.zeros(len(K))
+        for dim in self.dims.itervalues():
+            logps += self._logpdf_cell_gibbs(rowid, dim, K)
+        return logps
 
-    def _logpdf_cell_gibbs(self, rowid, dim, k):
+    def _logpdf_cell_gibbs(self, rowid, dim, K):
+        """Return array of logpdf of the cell of rowid in dim under each of
+        the clusters K, with rowid removed from its own cluster."""
         query = {dim.index: self.X[dim.index][rowid]}
-        evidence = self._get_evidence(rowid, dim, k)
-        # If rowid in cluster k then unincorporate then compute predictive.
-        if self.Zr(rowid) == k:
-            dim.unincorporate(rowid)
-            logp = dim.logpdf(rowid, query, evidence)
-            dim.incorporate(rowid, query, evidence)
-        else:
-            logp = dim.logpdf(rowid, query, evidence)
-        return logp
+        evidence = {i: self.X[i][rowid] for i in dim.inputs[1:]}
+        return dim.logpdf_clusters_excluding(rowid, query, K, evidence)
 
     def _migrate_row(self, rowid, k):
-        self.unincorporate(rowid)
-        query = merged(
-            {d: self.X[d][rowid] for d in self.dims},
-            {self.outputs[0]: k})
-        self.incorporate(rowid, query)
+        k_old = self.Zr(rowid)
+        self.crp.migrate(rowid, {self.outputs[0]: k}, {-1: 0})
+        if self._clusters_buffer is not None:
+            self._clusters_buffer[rowid] = k
+        dims = list(self.dims)
+        values = self.X.row(rowid)[self.X.positions(dims)]
+        for d, x in zip(dims, values):
+            self.dims[d].migrate(
+                rowid, {d: x}, self._get_evidence(rowid, self.dims[d], k))
+        if k_old not in self.Nk():
+            for dim in self.dims.itervalues():
+                dim.remove_cluster(k_old)
 
     # --------------------------------------------------------------------------
     # Internal crp utils.
@@ -422,6 +607,19 @@ class View(CGpm):
         Zr = self.crp.clusters[0].data
         return Zr[rowid] if rowid is not None else Zr
 
+    def _cluster_array(self):
+        """Return int array whose ith entry is the cluster of rowid i.
+
+        The array is updated in place as rows migrate and rebuilt from Zr only
+        after rows are added or removed; callers must not modify it.
+        """
+        if self._clusters_buffer is None:
+            Zr = self.Zr()
+            self._clusters_buffer = np.fromiter(
+                (Zr[r] for r in xrange(self.n_rows())),
+                dtype=int, count=self.n_rows())
+        return self._clusters_buffer
+
     # --------------------------------------------------------------------------
     # Internal query utils.
 
@@ -440,34 +638,54 @@ class View(CGpm):
         # If the rowid is hypothetical, just return.
         if self.hypothetical(rowid):
             return evidence
-        # Retrieve all other values for this rowid not in query or evidence.
-        data = {
-            c: self.X[c][rowid]
-            for c in self.outputs[1:]
-            if (c not in query) and (c not in evidence)
-                and (not isnan(self.X[c][rowid]))
-        }
+        # Retrieve all other values for this rowid not in query or evidence,
+        # by dropping the few query columns from a copy of the observed cells.
+        data = dict(self._observed_cells(rowid))
+        for c in query:
+            data.pop(c, None)
+        data.update(evidence)
         # Add the cluster assignment.
         data[self.outputs[0]] = self.Zr(rowid)
 
-        return merged(evidence, data)
+        return data
+
+    def _observed_cells(self, rowid):
+        """Return dict of the non-nan cells of rowid in outputs[1:], cached
+        until rowid is (un)incorporated or forced, or the dims change."""
+        try:
+            return self._evidence_cache[rowid]
+        except KeyError:
+            cols = self.outputs[1:]
+            values = self.X.row(rowid)[self.X.positions(cols)]
+            observed = {
+                cols[i]: values[i] for i in np.flatnonzero(~np.isnan(values))
+            }
+            self._evidence_cache[rowid] = observed
+            return observed
 
     def _get_evidence(self, rowid, dim, k):
-        """Prepare the evidence for a Dim logpdf/simulate query."""
-        inputs = {i: self.X[i][rowid] for i in dim.inputs[1:]}
-        cluster = {self.outputs[0]: k}
-        return merged(inputs, cluster)
+        """Prepare the evidence for a Dim logpdf/simulate query.
+
+        The returned dict is reused by the next call, so callers must pass it
+        straight to a Dim, which copies its evidence in preprocess, and must
+        not retain it.
+        """
+        evidence = self._evidence_scratch
+        evidence.clear()
+        for i in dim.inputs[1:]:
+            evidence[i] = self.X[i][rowid]
+        evidence[self.outputs[0]] = k
+        return evidence
 
     def _bulk_incorporate(self, dim):
         # XXX Major hack! We should really be creating new Dim objects.
-        dim.clusters = {}   # Mapping of cluster k to the object.
-        dim.Zr = {}         # Mapping of non-nan rowids to cluster k.
-        dim.Zi = {}         # Mapping of nan rowids to cluster k.
+        dim._reset_clusters()
         dim.aux_model = dim.create_aux_model()
+        X = self.X[dim.index]
         for rowid, k in self.Zr().iteritems():
             dim.incorporate(
                 rowid,
-                query={dim.index: self.X[dim.index][rowid]},
+                query={dim.index: X[rowid]},
                 evidence=self._get_evidence(rowid, dim, k))
         assert merged(dim.Zr, dim.Zi) == self.Zr()
         dim.transition_params()
@@ -478,8 +696,9 @@ class View(CGpm):
         # Disallow duplicated query cols.
         if simulate and len(set(query)) != len(query):
             raise ValueError('Query columns must be unique.')
-        # Disallow overlap between query and evidence.
-        if len(set.intersection(set(query), set(evidence))) > 0:
+        # Disallow overlap between query and evidence, by looking up the few
+        # query columns in the evidence dict rather than building two sets.
+        if any(c in evidence for c in query):
             raise ValueError('Query and evidence columns must be disjoint.')
         # No further  check.
         if self.hypothetical(rowid):
@@ -487,11 +706,11 @@ class View(CGpm):
         # Cannot constrain the cluster of observed rowid; unincorporate first.
         if self.outputs[0] in query or self.outputs[0] in evidence:
             raise ValueError('Cannot constrain cluster of an observed rowid.')
-        # Disallow evidence constraining/disagreeing with observed cells.
-        def good_evidence(rowid, e):
-            return (e not in self.outputs) or np.isnan(self.X[e][rowid]) \
-                or np.allclose(self.X[e][rowid], evidence[e])
-        if any(not good_evidence(rowid, e) for e in evidence):
+        # Disallow evidence constraining/disagreeing with observed cells. The
+        # cached observed cells of rowid hold exactly the cells to check.
+        observed = self._observed_cells(rowid)
+        if any(e in observed and not np.allclose(observed[e], evidence[e])
+                for e in evidence):
             raise ValueError('Cannot constrain observed cell in evidence.')
         # The next check is enforced at the level of State not View.
         # Disallow query constraining observed cells (XXX logpdf, not simulate)
@@ -502,9 +721,8 @@ class View(CGpm):
     # --------------------------------------------------------------------------
     # Data structure invariants.
 
+    @cu.debug_only
     def _check_partitions(self):
-        if not cu.check_env_debug():
-            return
         # For debugging only.
         assert self.alpha() > 0.
         # Check that the number of dims actually assigned to the view
@@ -514,6 +732,9 @@ class View(CGpm):
         rowids = range(self.n_rows())
         assert set(Zr.keys()) == set(rowids)
         assert set(Zr.values()) == set(Nk)
+        Z = np.fromiter((Zr[r] for r in rowids), dtype=int, count=len(rowids))
+        if self._clusters_buffer is not None:
+            assert np.all(self._clusters_buffer == Z)
         for i, dim in self.dims.iteritems():
             # Assert first output is first input of the Dim.
             assert self.outputs[0] == dim.inputs[0]
@@ -526,11 +747,13 @@ class View(CGpm):
             assert set(assignments.values()) == set(Nk.keys())
             all_ks = dim.clusters.keys() + dim.Zi.values()
             assert set(all_ks) == set(Nk.keys())
+            # Law of conservation of rowids, counting the nan cells of each
+            # cluster in one pass over the column.
+            ks, counts = np.unique(
+                Z[np.isnan(self.X[dim.index])], return_counts=True)
+            Nk_nan = dict(zip(ks.tolist(), counts.tolist()))
             for k in dim.clusters:
-                # Law of conservation of rowids.
-                rowids_nan = np.isnan(
-                    [self.X[dim.index][r] for r in rowids if Zr[r]==k])
-                assert dim.clusters[k].N + np.sum(rowids_nan) == Nk[k]
+                assert dim.clusters[k].N + Nk_nan.get(k, 0) == Nk[k]
 
     # --------------------------------------------------------------------------
     # Metadata
@@ -539,8 +762,8 @@ class View(CGpm):
         metadata = dict()
 
         # Dataset.
-        metadata['X'] = self.X
-        metadata['outputs'] = self.outputs
+        metadata['X'] = {c: np.asarray(self.X[c]).tolist() for c in self.X}
+        metadata['outputs'] = list(self.outputs)
 
         # View partition data.
         rowids = sorted(self.Zr().keys())
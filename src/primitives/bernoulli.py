@@ -14,12 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from math import lgamma
 from math import log
 
+import numpy as np
+
 from scipy.special import betaln
 
 from cgpm.primitives.distribution import DistributionGpm
 from cgpm.utils import general as gu
+from cgpm.utils import jit as ju
 
 
 class Bernoulli(DistributionGpm):
@@ -38,29 +42,31 @@ class Bernoulli(DistributionGpm):
         self.x_sum = 0
         # Hyperparameters.
         if hypers is None: hypers = {}
-        self.alpha = hypers.get('alpha', 1.)
-        self.beta = hypers.get('beta', 1.)
-        assert self.alpha > 0
-        assert self.beta > 0
+        self.set_hypers({
+            'alpha': hypers.get('alpha', 1.),
+            'beta': hypers.get('beta', 1.),
+        })
 
     def incorporate(self, rowid, query, evidence=None):
         DistributionGpm.incorporate(self, rowid, query, evidence)
         x = query[self.outputs[0]]
-        if x not in [0, 1]:
+        if x != 0 and x != 1:
             raise ValueError('Invalid Bernoulli: %s' % str(x))
         self.N += 1
         self.x_sum += x
         self.data[rowid] = x
+        self._score = None
 
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
         self.x_sum -= x
+        self._score = None
 
     def logpdf(self, rowid, query, evidence=None):
         DistributionGpm.logpdf(self, rowid, query, evidence)
         x = query[self.outputs[0]]
-        if x not in [0, 1]:
+        if x != 0 and x != 1:
             return -float('inf')
         return Bernoulli.calc_predictive_logp(
             x, self.N, self.x_sum, self.alpha, self.beta)
@@ -79,8 +85,13 @@ class Bernoulli(DistributionGpm):
         return {self.outputs[0]: x}
 
     def logpdf_score(self):
-        return Bernoulli.calc_logpdf_marginal(
-            self.N, self.x_sum, self.alpha, self.beta)
+        # (N, x_sum) and the hypers determine the score, so it is recomputed
+        # only after one of them changes.
+        if self._score is None:
+            self._score = betaln(
+                self.x_sum + self.alpha, self.N - self.x_sum + self.beta) \
+                - self._log_beta_prior
+        return self._score
 
     ##################
     # NON-GPM METHOD #
@@ -94,6 +105,8 @@ class Bernoulli(DistributionGpm):
         assert hypers['beta'] > 0
         self.alpha = hypers['alpha']
         self.beta = hypers['beta']
+        self._log_beta_prior = betaln(self.alpha, self.beta)
+        self._score = None
 
     def get_hypers(self):
         return {'alpha': self.alpha, 'beta': self.beta}
@@ -110,8 +123,9 @@ class Bernoulli(DistributionGpm):
     @staticmethod
     def construct_hyper_grids(X, n_grid=30):
         grids = dict()
+        # Both hypers share the same support, so build the grid only once.
         grids['alpha'] = gu.log_linspace(1., float(len(X)), n_grid)
-        grids['beta'] = gu.log_linspace(1., float(len(X)),n_grid)
+        grids['beta'] = grids['alpha'].copy()
         return grids
 
     @staticmethod
@@ -139,13 +153,168 @@ class Bernoulli(DistributionGpm):
     ##################
 
     @staticmethod
-    def calc_predictive_logp(x, N, x_sum, alpha, beta):
-        log_denom = log(N + alpha + beta)
+    def calc_predictive_logp(x, N, x_sum, alpha, beta, _log=log):
+        # Binding log as a default argument makes it a fast local lookup.
+        log_denom = _log(N + alpha + beta)
+        if x == 1:
+            return _log(x_sum + alpha) - log_denom
+        else:
+            return _log(N - x_sum + beta) - log_denom
+
+    @staticmethod
+    def calc_predictive_logp_vec(x, N, x_sum, alpha, beta, log_denom=None):
+        """Vectorized calc_predictive_logp of x over arrays of suffstats.
+
+        The denominator log(N + alpha + beta) does not depend on x, so callers
+        evaluating many x against the same clusters may pass it precomputed.
+        """
+        N = np.asarray(N, dtype=float)
+        x_sum = np.asarray(x_sum, dtype=float)
+        if log_denom is None:
+            log_denom = np.log(N + alpha + beta)
         if x == 1:
-            return log(x_sum + alpha) - log_denom
+            return np.log(x_sum + alpha) - log_denom
         else:
-            return log(N - x_sum + beta) - log_denom
+            return np.log(N - x_sum + beta) - log_denom
+
+    @staticmethod
+    def gather_suffstats(clusters):
+        """Return the suffstats and hypers of clusters as parallel arrays.
+
+        The returned dict maps each of 'N', 'x_sum', 'alpha', and 'beta' to an
+        array whose ith entry belongs to the ith cluster, and 'log_denom' to
+        the predictive denominator log(N + alpha + beta) of each cluster.
+        """
+        stats = np.asarray(
+            [(c.N, c.x_sum, c.alpha, c.beta) for c in clusters], dtype=float)
+        N, x_sum, alpha, beta = stats.reshape(-1, 4).T
+        return {
+            'N': N, 'x_sum': x_sum, 'alpha': alpha, 'beta': beta,
+            'log_denom': np.log(N + alpha + beta),
+        }
+
+    @staticmethod
+    def calc_cluster_logps(stats, x):
+        """Return the predictive logpdf of x in each gathered cluster."""
+        if x != 0 and x != 1:
+            return np.full(len(stats['N']), -float('inf'))
+        return Bernoulli.calc_predictive_logp_vec(
+            x, stats['N'], stats['x_sum'], stats['alpha'], stats['beta'],
+            log_denom=stats['log_denom'])
+
+    @staticmethod
+    def remove_suffstats(stats, i, x):
+        """Return copy of gathered stats with x removed from the ith cluster,
+        as if x were unincorporated from that cluster."""
+        stats = dict(stats)
+        for key, delta in [('N', 1), ('x_sum', x)]:
+            stats[key] = stats[key].copy()
+            stats[key][i] -= delta
+        stats['log_denom'] = stats['log_denom'].copy()
+        stats['log_denom'][i] = np.log(
+            stats['N'][i] + stats['alpha'][i] + stats['beta'][i])
+        return stats
 
     @staticmethod
     def calc_logpdf_marginal(N, x_sum, alpha, beta):
         return betaln(x_sum + alpha, N - x_sum + beta) - betaln(alpha, beta)
+
+    @staticmethod
+    def calc_logpdf_partition(X, Z, hypers):
+        """Return the marginal logpdf of data X clustered by assignments Z.
+
+        Equals the sum of logpdf_score over the clusters of a Dim holding
+        X[i] in cluster Z[i], skipping nan entries of X, but is computed from
+        the arrays directly without incorporating any rows.
+        """
+        X = np.asarray(X, dtype=float)
+        Z = np.asarray(Z, dtype=int)
+        valid = ~np.isnan(X)
+        X, Z = X[valid], Z[valid]
+        alpha, beta = hypers['alpha'], hypers['beta']
+        if ju.HAVE_NUMBA:
+            return _calc_logpdf_partition(X, Z, alpha, beta)
+        N = np.bincount(Z)
+        x_sum = np.bincount(Z, weights=X)[N > 0]
+        N = N[N > 0]
+        return np.sum(betaln(x_sum + alpha, N - x_sum + beta)) \
+            - len(N) * betaln(alpha, beta)
+
+    @staticmethod
+    def calc_hyper_logps(stats, grid, hypers, target):
+        """Return the marginal logpdf of all clusters at each point in grid.
+
+        Evaluates the grid of values for the `target` hyperparameter against
+        every cluster in `stats` (from gather_suffstats) in one vectorized
+        betaln call, holding the other hyperparameter fixed at its value in
+        `hypers`.
+        """
+        if target not in ('alpha', 'beta'):
+            raise ValueError('Unknown Bernoulli hyper: %s' % (target,))
+        N, x_sum = stats['N'], stats['x_sum']
+        grid = np.asarray(grid, dtype=float)
+        if ju.HAVE_NUMBA:
+            alpha = grid if target == 'alpha' else hypers['alpha']
+            beta = grid if target == 'beta' else hypers['beta']
+            alpha, beta = np.broadcast_arrays(alpha, beta)
+            return _calc_hyper_logps(N, x_sum, alpha, beta).tolist()
+        if target == 'alpha':
+            logps = Bernoulli._kernel_alpha(N, x_sum, grid, hypers['beta'])
+        else:
+            logps = Bernoulli._kernel_beta(N, x_sum, grid, hypers['alpha'])
+        return logps.tolist()
+
+    @staticmethod
+    def _kernel_alpha(N, x_sum, grid, beta):
+        """Return hyper grid logps for alpha in grid, holding beta fixed."""
+        # Terms involving only the fixed beta are folded once per cluster, and
+        # the prior normalizer is shared by all clusters.
+        log_prior = betaln(grid, beta)
+        log_posterior = betaln(
+            x_sum[:,np.newaxis] + grid, (N - x_sum + beta)[:,np.newaxis])
+        return np.sum(log_posterior, axis=0) - len(N) * log_prior
+
+    @staticmethod
+    def _kernel_beta(N, x_sum, grid, alpha):
+        """Return hyper grid logps for beta in grid, holding alpha fixed."""
+        log_prior = betaln(alpha, grid)
+        log_posterior = betaln(
+            (x_sum + alpha)[:,np.newaxis], (N - x_sum)[:,np.newaxis] + grid)
+        return np.sum(log_posterior, axis=0) - len(N) * log_prior
+
+
+# Compiled kernels for the hyperparameter grid scan and the column partition
+# score, used when numba exists.
+
+@ju.njit(fastmath=True)
+def _betaln(a, b):
+    return lgamma(a) + lgamma(b) - lgamma(a + b)
+
+
+@ju.njit(parallel=True, fastmath=True)
+def _calc_hyper_logps(N, x_sum, alpha, beta):
+    logps = np.zeros(len(alpha))
+    for g in ju.prange(len(alpha)):
+        a, b = alpha[g], beta[g]
+        logp = -len(N) * _betaln(a, b)
+        for k in range(len(N)):
+            logp += _betaln(x_sum[k] + a, N[k] - x_sum[k] + b)
+        logps[g] = logp
+    return logps
+
+
+@ju.njit(fastmath=True)
+def _calc_logpdf_partition(X, Z, alpha, beta):
+    K = Z.max() + 1 if len(Z) > 0 else 0
+    N = np.zeros(K)
+    x_sum = np.zeros(K)
+    for i in range(len(X)):
+        N[Z[i]] += 1
+        x_sum[Z[i]] += X[i]
+    logp = 0.
+    log_prior = _betaln(alpha, beta)
+    for k in range(K):
+        if N[k] > 0:
+            logp += _betaln(x_sum[k] + alpha, N[k] - x_sum[k] + beta) \
+                - log_prior
+    return logp
@@ -148,6 +148,42 @@ class Categorical(DistributionGpm):
         denom = log(np.sum(counts) + alpha * len(counts))
         return numer - denom
 
+    @staticmethod
+    def gather_suffstats(clusters):
+        """Return the suffstats and hypers of clusters as parallel arrays.
+
+        The returned dict maps 'counts' to the array whose ith row holds the
+        category counts of the ith cluster, 'alpha' to the array of their
+        alpha, and 'log_denom' to the predictive denominator of each cluster.
+        """
+        counts = np.asarray([c.counts for c in clusters], dtype=float)
+        alpha = np.asarray([c.alpha for c in clusters], dtype=float)
+        return {
+            'counts': counts, 'alpha': alpha,
+            'log_denom': np.log(
+                np.sum(counts, axis=1) + alpha * counts.shape[1]),
+        }
+
+    @staticmethod
+    def calc_cluster_logps(stats, x):
+        """Return the predictive logpdf of x in each gathered cluster."""
+        counts = stats['counts']
+        if not (x % 1 == 0 and 0 <= x < counts.shape[1]):
+            return np.full(len(counts), -float('inf'))
+        return np.log(stats['alpha'] + counts[:,int(x)]) - stats['log_denom']
+
+    @staticmethod
+    def remove_suffstats(stats, i, x):
+        """Return copy of gathered stats with x removed from the ith cluster,
+        as if x were unincorporated from that cluster."""
+        stats = dict(stats)
+        counts = stats['counts'] = stats['counts'].copy()
+        counts[i, int(x)] -= 1
+        stats['log_denom'] = stats['log_denom'].copy()
+        stats['log_denom'][i] = np.log(
+            np.sum(counts[i]) + stats['alpha'][i] * counts.shape[1])
+        return stats
+
     @staticmethod
     def calc_logpdf_marginal(N, counts, alpha):
         K = len(counts)
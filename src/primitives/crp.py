@@ -14,9 +14,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from bisect import bisect_left
+from bisect import insort
 from collections import OrderedDict
 from math import log
 
+import numpy as np
+
 from scipy.special import gammaln
 
 from cgpm.primitives.distribution import DistributionGpm
@@ -38,9 +42,11 @@ class Crp(DistributionGpm):
         self.N = 0
         self.data = OrderedDict()
         self.counts = OrderedDict()
+        # Sorted list of the tables in counts, maintained incrementally.
+        self._tables = []
         # Hyperparameters.
         if hypers is None: hypers = {}
-        self.alpha = hypers.get('alpha', 1.)
+        self.set_hypers({'alpha': hypers.get('alpha', 1.)})
 
     def incorporate(self, rowid, query, evidence=None):
         DistributionGpm.incorporate(self, rowid, query, evidence)
@@ -48,6 +54,7 @@ class Crp(DistributionGpm):
         self.N += 1
         if x not in self.counts:
             self.counts[x] = 0
+            insort(self._tables, x)
         self.counts[x] += 1
         self.data[rowid] = x
 
@@ -57,6 +64,7 @@ class Crp(DistributionGpm):
         self.counts[x] -= 1
         if self.counts[x] == 0:
             del self.counts[x]
+            del self._tables[bisect_left(self._tables, x)]
 
     def logpdf(self, rowid, query, evidence=None):
         assert not evidence
@@ -73,7 +81,7 @@ class Crp(DistributionGpm):
         if rowid in self.data:
             x = self.data[rowid]
         else:
-            K = sorted(self.counts) + [max(self.counts) + 1] if self.counts\
+            K = self._tables + [self._tables[-1] + 1] if self._tables \
                 else [0]
             logps = [self.logpdf(rowid, {query[0]: x}, evidence) for x in K]
             x = gu.log_pflip(logps, array=K, rng=self.rng)
@@ -92,6 +100,8 @@ class Crp(DistributionGpm):
     def set_hypers(self, hypers):
         assert hypers['alpha'] > 0
         self.alpha = hypers['alpha']
+        # Cached, since alpha changes rarely relative to the counts.
+        self._log_alpha = log(self.alpha)
 
     def get_hypers(self):
         return {'alpha': self.alpha}
@@ -110,17 +120,34 @@ class Crp(DistributionGpm):
     def gibbs_logps(self, rowid, m=1):
         """Compute the CRP probabilities for a Gibbs transition of rowid,
         with table counts Nk, table assignments Z, and m auxiliary tables."""
+        return self.gibbs_tables_logps(rowid, m=m)[1]
+
+    def gibbs_tables_logps(self, rowid, m=1, sweep=None):
+        """Return the lists gibbs_tables and gibbs_logps of rowid together,
+        computing the proposal tables only once.
+
+        The optional sweep is the output of sweep_tables_logps, which may be
+        shared across rowids as long as the counts do not change."""
         assert rowid in self.data
         assert 0 < m
+        tables, logps = self.sweep_tables_logps() if sweep is None else sweep
         singleton = self.singleton(rowid)
-        p_aux = self.alpha / float(m)
-        p_rowid = p_aux if singleton else self.counts[self.data[rowid]]-1
-        tables = self.gibbs_tables(rowid, m=m)
-        def p_table(t):
-            if t == self.data[rowid]: return p_rowid    # rowid table.
-            if t not in self.counts: return p_aux       # auxiliary table.
-            return self.counts[t]                       # regular table.
-        return [log(p_table(t)) for t in tables]
+        logp_aux = self._log_alpha - log(m) if m > 1 else self._log_alpha
+        logp_rowid = logp_aux if singleton \
+            else log(self.counts[self.data[rowid]]-1)
+        m_aux = m - 1 if singleton else m
+        logps = list(logps)
+        logps[bisect_left(tables, self.data[rowid])] = logp_rowid
+        logps.extend([logp_aux] * m_aux)
+        return tables + [tables[-1] + 1 + i for i in range(m_aux)], logps
+
+    def sweep_tables_logps(self):
+        """Return the sorted list of tables and the list of their log counts,
+        from which gibbs_tables_logps derives the proposal of each rowid."""
+        tables = list(self._tables)
+        counts = np.fromiter(
+            (self.counts[t] for t in tables), dtype=float, count=len(tables))
+        return tables, np.log(counts).tolist()
 
     def gibbs_tables(self, rowid, m=1):
         """Retrieve a list of possible tables for rowid.
@@ -135,11 +162,11 @@ class Crp(DistributionGpm):
         predictive distribution, (using m auxiliary tables always).
         """
         assert 0 < m
-        K = sorted(self.counts)
+        K = self._tables
         singleton = self.singleton(rowid)
         m_aux = m - 1 if singleton else m
-        t_aux = [max(self.counts) + 1 + m for m in range(m_aux)]
-        return K + t_aux
+        t_next = K[-1] + 1 if K else 0
+        return K + [t_next + i for i in range(m_aux)]
 
     def singleton(self, rowid):
         return self.counts[self.data[rowid]] == 1 if rowid in self.data else 0
@@ -180,6 +207,33 @@ class Crp(DistributionGpm):
         denominator = N + alpha
         return log(numerator) - log(denominator)
 
+    @staticmethod
+    def gather_suffstats(clusters):
+        """Return the suffstats of clusters as parallel arrays.
+
+        The returned dict maps 'N' to the number of customers, 'K' to the
+        number of tables, and 'gammaln_counts' to the sum of the gammaln of
+        the table counts of each cluster.
+        """
+        return {
+            'N': np.asarray([c.N for c in clusters], dtype=float),
+            'K': np.asarray([len(c.counts) for c in clusters], dtype=float),
+            'gammaln_counts': np.asarray(
+                [sum(gammaln(c.counts.values())) for c in clusters],
+                dtype=float),
+        }
+
+    @staticmethod
+    def calc_hyper_logps(stats, grid, hypers, target):
+        """Return the marginal logpdf of all clusters at each point in grid,
+        evaluated in one vectorized pass over the grid of alpha."""
+        if target != 'alpha':
+            raise ValueError('Unknown Crp hyper: %s' % (target,))
+        alpha = np.asarray(grid, dtype=float)[:,np.newaxis]
+        logps = stats['K'] * np.log(alpha) + stats['gammaln_counts'] \
+            + gammaln(alpha) - gammaln(stats['N'] + alpha)
+        return np.sum(logps, axis=1).tolist()
+
     @staticmethod
     def calc_logpdf_marginal(N, counts, alpha):
         return len(counts) * log(alpha) + sum(gammaln(counts.values())) \
@@ -15,11 +15,15 @@
 # limitations under the License.
 
 from math import lgamma
+from math import log
 
 import numpy as np
 
+from scipy.special import gammaln
+
 from cgpm.primitives.distribution import DistributionGpm
 from cgpm.utils import general as gu
+from cgpm.utils import jit as ju
 
 
 class Normal(DistributionGpm):
@@ -165,6 +169,56 @@ class Normal(DistributionGpm):
         ZM = Normal.calc_log_Z(rm, sm, num)
         return -.5 * np.log(2*np.pi) + ZM - ZN
 
+    @staticmethod
+    def gather_suffstats(clusters):
+        """Return the suffstats and hypers of clusters as parallel arrays.
+
+        The returned dict maps each of 'N', 'sum_x', 'sum_x_sq', 'm', 'r', 's',
+        and 'nu' to an array whose ith entry belongs to the ith cluster, and
+        'log_Z' to the log normalizer of the posterior of each cluster.
+        """
+        stats = np.asarray(
+            [(c.N, c.sum_x, c.sum_x_sq, c.m, c.r, c.s, c.nu) for c in clusters],
+            dtype=float)
+        N, sum_x, sum_x_sq, m, r, s, nu = stats.reshape(-1, 7).T
+        _mn, rn, sn, nun = Normal.posterior_hypers_vec(
+            N, sum_x, sum_x_sq, m, r, s, nu)
+        return {
+            'N': N, 'sum_x': sum_x, 'sum_x_sq': sum_x_sq,
+            'm': m, 'r': r, 's': s, 'nu': nu,
+            'log_Z': Normal.calc_log_Z_vec(rn, sn, nun),
+        }
+
+    @staticmethod
+    def calc_cluster_logps(stats, x):
+        """Return the predictive logpdf of x in each gathered cluster."""
+        args = (
+            stats['N'], stats['sum_x'], stats['sum_x_sq'],
+            stats['m'], stats['r'], stats['s'], stats['nu'])
+        if ju.HAVE_NUMBA:
+            return _calc_cluster_logps(x, *(args + (stats['log_Z'],)))
+        N, sum_x, sum_x_sq, m, r, s, nu = args
+        _mm, rm, sm, num = Normal.posterior_hypers_vec(
+            N+1, sum_x+x, sum_x_sq+x*x, m, r, s, nu)
+        ZM = Normal.calc_log_Z_vec(rm, sm, num)
+        return -.5 * np.log(2*np.pi) + ZM - stats['log_Z']
+
+    @staticmethod
+    def remove_suffstats(stats, i, x):
+        """Return copy of gathered stats with x removed from the ith cluster,
+        as if x were unincorporated from that cluster."""
+        stats = dict(stats)
+        for key, delta in [('N', 1), ('sum_x', x), ('sum_x_sq', x*x)]:
+            stats[key] = stats[key].copy()
+            stats[key][i] -= delta
+        j = slice(i, i+1)
+        _mn, rn, sn, nun = Normal.posterior_hypers_vec(
+            stats['N'][j], stats['sum_x'][j], stats['sum_x_sq'][j],
+            stats['m'][j], stats['r'][j], stats['s'][j], stats['nu'][j])
+        stats['log_Z'] = stats['log_Z'].copy()
+        stats['log_Z'][j] = Normal.calc_log_Z_vec(rn, sn, nun)
+        return stats
+
     @staticmethod
     def calc_logpdf_marginal(N, sum_x, sum_x_sq, m, r, s, nu):
         mn, rn, sn, nun = Normal.posterior_hypers(
@@ -182,6 +236,16 @@ class Normal(DistributionGpm):
         if sn == 0: sn = s
         return mn, rn, sn, nun
 
+    @staticmethod
+    def posterior_hypers_vec(N, sum_x, sum_x_sq, m, r, s, nu):
+        """Vectorized posterior_hypers over arrays of suffstats and hypers."""
+        rn = r + N
+        nun = nu + N
+        mn = (r*m + sum_x)/rn
+        sn = s + sum_x_sq + r*m*m - rn*mn*mn
+        sn = np.where(sn == 0, s, sn)
+        return mn, rn, sn, nun
+
     @staticmethod
     def calc_log_Z(r, s, nu):
         return (
@@ -191,8 +255,38 @@ class Normal(DistributionGpm):
             - (nu/2.) * np.log(s)
             + lgamma(nu/2.0))
 
+    @staticmethod
+    def calc_log_Z_vec(r, s, nu):
+        """Vectorized calc_log_Z over arrays of posterior hypers."""
+        return (
+            ((nu + 1.) / 2.) * np.log(2)
+            + .5 * np.log(np.pi)
+            - .5 * np.log(r)
+            - (nu/2.) * np.log(s)
+            + gammaln(nu/2.0))
+
     @staticmethod
     def sample_parameters(m, r, s, nu, rng):
         rho = rng.gamma(nu/2., scale=2./s)
         mu = rng.normal(loc=m, scale=1./(rho*r)**.5)
         return mu, rho
+
+
+# Compiled kernel for the predictive logpdf of a query in gathered clusters,
+# used when numba exists.
+
+@ju.njit(fastmath=True)
+def _calc_cluster_logps(x, N, sum_x, sum_x_sq, m, r, s, nu, log_Z):
+    logps = np.empty(len(N))
+    log_2pi_half = .5 * log(2*np.pi)
+    for k in range(len(N)):
+        rm = r[k] + (N[k] + 1)
+        num = nu[k] + (N[k] + 1)
+        mm = (r[k]*m[k] + (sum_x[k] + x)) / rm
+        sm = s[k] + (sum_x_sq[k] + x*x) + r[k]*m[k]*m[k] - rm*mm*mm
+        if sm == 0:
+            sm = s[k]
+        ZM = ((num + 1.) / 2.) * log(2) + .5 * log(np.pi) - .5 * log(rm) \
+            - (num/2.) * log(sm) + lgamma(num/2.)
+        logps[k] = -log_2pi_half + ZM - log_Z[k]
+    return logps
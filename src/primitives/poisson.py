@@ -152,6 +152,48 @@ class Poisson(DistributionGpm):
         ZM = Poisson.calc_log_Z(am, bm)
         return  ZM - ZN - gammaln(x+1)
 
+    @staticmethod
+    def gather_suffstats(clusters):
+        """Return the suffstats and hypers of clusters as parallel arrays.
+
+        The returned dict maps each of 'N', 'sum_x', 'a', and 'b' to an array
+        whose ith entry belongs to the ith cluster, and 'log_Z' to the log
+        normalizer of the posterior of each cluster.
+        """
+        stats = np.asarray(
+            [(c.N, c.sum_x, c.a, c.b) for c in clusters], dtype=float)
+        N, sum_x, a, b = stats.reshape(-1, 4).T
+        an, bn = Poisson.posterior_hypers(N, sum_x, a, b)
+        return {
+            'N': N, 'sum_x': sum_x, 'a': a, 'b': b,
+            'log_Z': gammaln(an) - an*np.log(bn),
+        }
+
+    @staticmethod
+    def calc_cluster_logps(stats, x):
+        """Return the predictive logpdf of x in each gathered cluster."""
+        if not (x % 1 == 0 and x >= 0):
+            return np.full(len(stats['N']), -float('inf'))
+        am, bm = Poisson.posterior_hypers(
+            stats['N']+1, stats['sum_x']+x, stats['a'], stats['b'])
+        ZM = gammaln(am) - am*np.log(bm)
+        return ZM - stats['log_Z'] - gammaln(x+1)
+
+    @staticmethod
+    def remove_suffstats(stats, i, x):
+        """Return copy of gathered stats with x removed from the ith cluster,
+        as if x were unincorporated from that cluster."""
+        stats = dict(stats)
+        for key, delta in [('N', 1), ('sum_x', x)]:
+            stats[key] = stats[key].copy()
+            stats[key][i] -= delta
+        j = slice(i, i+1)
+        an, bn = Poisson.posterior_hypers(
+            stats['N'][j], stats['sum_x'][j], stats['a'][j], stats['b'][j])
+        stats['log_Z'] = stats['log_Z'].copy()
+        stats['log_Z'][j] = gammaln(an) - an*np.log(bn)
+        return stats
+
     @staticmethod
     def calc_logpdf_marginal(N, sum_x, sum_log_fact_x, a, b):
         an, bn = Poisson.posterior_hypers(N, sum_x, a, b)
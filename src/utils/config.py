@@ -112,3 +112,11 @@ def parse_distargs(dists):
 def check_env_debug():
     debug = os.environ.get('GPMCCDEBUG', None)
     return False if debug is None else int(debug)
+
+def debug_only(func):
+    """Decorator which replaces func by a no-op, unless GPMCCDEBUG is set when
+    func is defined, so that debugging checks cost nothing in normal runs.
+    Under python -O the assertions are stripped, so func is always a no-op."""
+    if __debug__ and check_env_debug():
+        return func
+    return lambda *args, **kwargs: None
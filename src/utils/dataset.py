@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+
+class Dataset(object):
+    """Numeric dataset stored as a column-major 2-D numpy buffer.
+
+    Dataset replaces the dictionary mapping each column to the list of its
+    values which a State shares with its Views, and supports the same access
+    patterns: X[c] is a view of column c, so that X[c][rowid] reads the cell,
+    and X[c][rowid] = x writes the cell in place. Iterating over a Dataset
+    yields the columns. Rows are appended and popped in amortized constant
+    time, by keeping spare capacity at the end of the buffer.
+
+    The buffer is stored in Fortran order, so that X[c] is contiguous for
+    the whole-column reads of the inference kernels, while row(rowid) is a
+    strided view.
+
+    Column views are invalidated when the buffer grows, so callers should
+    index X[c] afresh rather than holding on to a column.
+    """
+
+    def __init__(self, X, columns):
+        """Create a Dataset from data X with the given column identifiers.
+
+        Parameters
+        ----------
+        X : np.ndarray
+            Data matrix of shape (n_rows, len(columns)), where missing values
+            are represented by nan.
+        columns : list<int>
+            Identifiers of the columns of X.
+        """
+        X = np.array(X, dtype=float, order='F')
+        if X.ndim != 2 or X.shape[1] != len(columns):
+            raise ValueError(
+                'Dataset requires %d columns: %s.' % (len(columns), X.shape))
+        self._columns = list(columns)
+        self._index = {c: i for i, c in enumerate(self._columns)}
+        # Mapping of tuples of columns to their positions, see positions.
+        self._positions = {}
+        self._buffer = X
+        self._n_rows = X.shape[0]
+
+    @classmethod
+    def from_dict(cls, X):
+        """Create a Dataset from a dictionary mapping columns to values."""
+        columns = list(X.keys())
+        return cls(np.column_stack([X[c] for c in columns]), columns)
+
+    # --------------------------------------------------------------------------
+    # Columns
+
+    def __getitem__(self, c):
+        return self._buffer[:self._n_rows, self._index[c]]
+
+    def __setitem__(self, c, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) != self._n_rows:
+            raise ValueError(
+                '%d rows are required, received: %d.'
+                % (self._n_rows, len(values)))
+        if c not in self._index:
+            buffer = np.full(
+                (len(self._buffer), len(self._columns) + 1), np.nan,
+                order='F')
+            buffer[:, :-1] = self._buffer
+            self._buffer = buffer
+            self._index[c] = len(self._columns)
+            self._columns.append(c)
+            self._positions.clear()
+        self._buffer[:self._n_rows, self._index[c]] = values
+
+    def __delitem__(self, c):
+        self._buffer = np.asfortranarray(
+            np.delete(self._buffer, self._index[c], axis=1))
+        self._columns.remove(c)
+        self._index = {c: i for i, c in enumerate(self._columns)}
+        self._positions.clear()
+
+    def __contains__(self, c):
+        return c in self._index
+
+    def __iter__(self):
+        return iter(list(self._columns))
+
+    def __len__(self):
+        return len(self._columns)
+
+    def keys(self):
+        return list(self._columns)
+
+    def values(self):
+        return [self[c] for c in self._columns]
+
+    def items(self):
+        return [(c, self[c]) for c in self._columns]
+
+    def positions(self, columns):
+        """Return array of the positions of columns in keys().
+
+        The array is cached until a column is added or deleted, since the
+        same few lists of columns are looked up on every row of a sweep, so
+        callers must not modify it.
+        """
+        key = tuple(columns)
+        try:
+            return self._positions[key]
+        except KeyError:
+            positions = np.array([self._index[c] for c in key], dtype=int)
+            self._positions[key] = positions
+            return positions
+
+    # --------------------------------------------------------------------------
+    # Rows
+
+    def n_rows(self):
+        return self._n_rows
+
+    def row(self, rowid):
+        """Return view of the values of rowid, in the order of keys()."""
+        if not 0 <= rowid < self._n_rows:
+            raise IndexError('Invalid rowid: %s.' % (rowid,))
+        return self._buffer[rowid]
+
+    def append(self, row):
+        """Append a row from the dict row, where missing columns are nan."""
+        if self._n_rows == len(self._buffer):
+            capacity = max(2 * len(self._buffer), 1)
+            buffer = np.full(
+                (capacity, len(self._columns)), np.nan, order='F')
+            buffer[:self._n_rows] = self._buffer[:self._n_rows]
+            self._buffer = buffer
+        self._buffer[self._n_rows] = np.nan
+        for c, x in row.items():
+            self._buffer[self._n_rows, self._index[c]] = x
+        self._n_rows += 1
+
+    def pop(self):
+        """Remove the last row."""
+        if self._n_rows == 0:
+            raise IndexError('Cannot pop from empty Dataset.')
+        self._n_rows -= 1
+
+    def to_array(self):
+        """Return a copy of the data as an array of shape (n_rows, n_cols)."""
+        return self._buffer[:self._n_rows].copy()
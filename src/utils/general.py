@@ -15,13 +15,15 @@
 # limitations under the License.
 
 import math
-import warnings
 
 from math import lgamma
 from math import log
 
 import numpy as np
 
+from scipy.special import gammaln
+
+from cgpm.utils import jit as ju
 from cgpm.utils import validation as vu
 
 
@@ -37,8 +39,11 @@ def curve_color(k):
     return (colors[k], .7) if k < len(colors) else ('gray', .3)
 
 def merged(*dicts):
-    result = {}
-    for d in dicts:
+    if not dicts:
+        return {}
+    # Copying the first dict clones its hash table, without reinserting keys.
+    result = dict(dicts[0])
+    for d in dicts[1:]:
         result.update(d)
     return result
 
@@ -51,14 +56,15 @@ def log_normalize(logp):
 
 def normalize(p):
     """Normalizes a np array of probabilites."""
-    return np.asarray(p, dtype=float) / sum(p)
+    p = np.asarray(p, dtype=float)
+    return p / np.sum(p)
 
 def logp_crp(N, Nk, alpha):
     """Returns the log normalized P(N,K|alpha), where N is the number of
     customers and K is the number of tables.
     https://www.cs.princeton.edu/~blei/papers/GershmanBlei2012.pdf#page=4 (eq 8)
     """
-    return len(Nk)*log(alpha) + np.sum(lgamma(c) for c in Nk) \
+    return len(Nk)*log(alpha) + np.sum(gammaln(np.asarray(Nk, dtype=float))) \
         + lgamma(alpha) - lgamma(N+alpha)
 
 def logp_crp_unorm(N, K, alpha):
@@ -71,58 +77,118 @@ def logp_crp_unorm(N, K, alpha):
 def logp_crp_gibbs(Nk, Z, i, alpha, m):
     """Compute the CRP probabilities for a Gibbs transition of customer i,
     with table counts Nk, table assignments Z, and m auxiliary tables."""
-    # XXX F ME
-    K = sorted(Nk) if isinstance(Nk, dict) else xrange(len(Nk))
-    singleton = Nk[Z[i]] == 1
+    if isinstance(Nk, dict):
+        K = sorted(Nk)
+        counts = np.asarray([Nk[t] for t in K], dtype=float)
+        current = K.index(Z[i])
+    else:
+        counts = np.array(Nk, dtype=float)
+        current = Z[i]
+    singleton = counts[current] == 1
     m_aux = m-1 if singleton else m
     p_table_aux = alpha/float(m)
-    p_current = lambda : p_table_aux if singleton else Nk[Z[i]]-1
-    p_other = lambda t : Nk[t]
-    p_table = lambda t: p_current() if t == Z[i] else p_other(t)
-    return [log(p_table(t)) for t in K] + [log(p_table_aux)]*m_aux
+    counts[current] = p_table_aux if singleton else counts[current]-1
+    return np.concatenate((np.log(counts), np.full(m_aux, log(p_table_aux))))
 
 def logp_crp_fresh(N, Nk, alpha, m=1):
     """Compute the CRP probabilities for a fresh customer i=N+1, with
     table counts Nk, total customers N=sum(Nk), and m auxiliary tables."""
-    log_crp_numer = np.log(Nk + [alpha/m]*m)
+    log_crp_numer = np.log(np.concatenate((Nk, np.full(m, alpha/float(m)))))
     logp_crp_denom = log(N + alpha)
     return log_crp_numer - logp_crp_denom
 
 def log_pflip(logp, array=None, size=None, rng=None):
     """Categorical draw from a vector logp of log probabilities."""
-    p = np.exp(log_normalize(logp))
-    return pflip(p, array=array, size=size, rng=rng)
+    if len(logp) == 1:
+        x = 0 if array is None else array[0]
+        return x if size is None else [x] * size
+    if rng is None:
+        rng = gen_rng()
+    if size is None:
+        # Single draws, as in the Gibbs kernels, take one pass over logp.
+        return log_pflip_uniform(logp, rng.random_sample(), array=array)
+    # Unnormalized cdf in one pass, without normalizing logp first.
+    cdf = np.cumsum(np.exp(np.subtract(logp, np.max(logp))))
+    if not 0 < cdf[-1] < float('inf'):
+        raise ValueError('log_pflip logps are not finite: %s.' % (logp,))
+    cdf /= cdf[-1]
+    index = cdf.searchsorted(rng.random_sample(size), side='right')
+    return index if array is None else np.asarray(array)[index]
+
+def log_pflip_uniform(logp, u, array=None):
+    """Categorical draw from a vector logp of log probabilities, by inverse
+    transform of the uniform u. Used to draw the uniforms of many sequential
+    draws at once; log_pflip(logp, rng=rng) equals log_pflip_uniform(logp,
+    rng.random_sample()) whenever len(logp) > 1."""
+    if len(logp) == 1:
+        index = 0
+    elif ju.HAVE_NUMBA:
+        index = _log_pflip(np.asarray(logp, dtype=float), u)
+    else:
+        cdf = np.cumsum(np.exp(np.subtract(logp, np.max(logp))))
+        index = cdf.searchsorted(u * cdf[-1], side='right') \
+            if 0 < cdf[-1] < float('inf') else -1
+    if index < 0:
+        raise ValueError('log_pflip logps are not finite: %s.' % (logp,))
+    return index if array is None else np.asarray(array)[index]
 
 def pflip(p, array=None, size=None, rng=None):
     """Categorical draw from a vector p of probabilities."""
-    if array is None:
-        array = range(len(p))
     if len(p) == 1:
-        return array[0] if size is None else [array[0]] * size
+        x = 0 if array is None else array[0]
+        return x if size is None else [x] * size
     if rng is None:
         rng = gen_rng()
-    p = normalize(p)
-    if 10.**(-8.) < math.fabs(1.-sum(p)):
-        warnings.warn('pflip probability vector sums to %f.' % sum(p))
-    return rng.choice(array, size=size, p=p)
-
-def logsumexp(array):
+    # Inverse transform sampling, drawing the same uniforms as rng.choice but
+    # skipping its validation of array and p on every call. The cdf of p is
+    # normalized by its last entry, so p itself is never normalized.
+    cdf = np.cumsum(p, dtype=float)
+    if not 0 < cdf[-1] < float('inf'):
+        raise ValueError('pflip probabilities are not finite: %s.' % (p,))
+    cdf /= cdf[-1]
+    index = cdf.searchsorted(rng.random_sample(size), side='right')
+    return index if array is None else np.asarray(array)[index]
+
+def logsumexp(array, axis=None):
     # https://github.com/probcomp/bayeslite/blob/master/src/math_util.py
+    if axis is not None:
+        return _logsumexp_axis(np.asarray(array, dtype=float), axis)
     if len(array) == 0:
         return float('-inf')
-    m = max(array)
+    array = np.asarray(array, dtype=float)
+    m = np.max(array)
 
     # m = +inf means addends are all +inf, hence so are sum and log.
     # m = -inf means addends are all zero, hence so is sum, and log is
     # -inf.  But if +inf and -inf are among the inputs, or if input is
-    # NaN, let the usual computation yield a NaN.
-    if math.isinf(m) and min(array) != -m and \
-       all(not math.isnan(a) for a in array):
-        return m
+    # NaN, let the usual computation yield a NaN. Only an infinite m needs
+    # the extra passes over array.
+    if math.isinf(m):
+        if np.min(array) != -m and not np.isnan(array).any():
+            return m
 
     # Since m = max{a_0, a_1, ...}, it follows that a <= m for all a,
-    # so a - m <= 0; hence exp(a - m) is guaranteed not to overflow.
-    return m + math.log(sum(math.exp(a - m) for a in array))
+    # so a - m <= 0; hence exp(a - m) is guaranteed not to overflow. The
+    # shifted array is exponentiated in place, allocating one temporary.
+    shifted = np.subtract(array, m)
+    return m + math.log(np.sum(np.exp(shifted, out=shifted)))
+
+def _logsumexp_axis(array, axis):
+    """Vectorized logsumexp along axis, with the semantics of logsumexp for
+    each slice: infinite maxima are returned as is unless the slice also has
+    the opposite infinity or a NaN."""
+    if array.shape[axis] == 0:
+        return np.full(np.delete(array.shape, axis), float('-inf'))
+    m = np.max(array, axis=axis, keepdims=True)
+    finite = np.isfinite(m)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shifted = np.subtract(array, np.where(finite, m, 0))
+        result = m + np.log(np.sum(
+            np.exp(shifted, out=shifted), axis=axis, keepdims=True))
+        mins = np.min(array, axis=axis, keepdims=True)
+        result = np.where(
+            finite | np.isnan(m), result, np.where(mins != -m, m, np.nan))
+    return np.squeeze(result, axis=axis)
 
 def logmeanexp(array):
     # https://github.com/probcomp/bayeslite/blob/master/src/math_util.py
@@ -141,7 +207,8 @@ def logmeanexp(array):
     #
     # Can't say `a > -inf' because that excludes NaNs, but we want to
     # include them so they propagate.
-    noninfs = [a for a in array if not a == -inf]
+    array = np.asarray(array, dtype=float)
+    noninfs = array[~(array == -inf)]
 
     # probs = map(exp, logprobs)
     # log(mean(probs)) = log(sum(probs) / len(probs))
@@ -164,9 +231,10 @@ def logmeanexp_weighted(log_A, log_W):
     #     - logsumexp (log W_0, ..., log W_{n-1})
     #
     # XXX Pathological cases -- infinities, NaNs.
-    assert len(log_W) == len(log_A)
-    return logsumexp([log_w + log_a for log_w, log_a in zip(log_W, log_A)]) \
-        - logsumexp(log_W)
+    log_A = np.asarray(log_A, dtype=float)
+    log_W = np.asarray(log_W, dtype=float)
+    assert log_W.shape == log_A.shape
+    return logsumexp(log_W + log_A) - logsumexp(log_W)
 
 def log_linspace(a, b, n):
     """linspace from a to b with n entries over log scale."""
@@ -186,31 +254,21 @@ def simulate_crp(N, alpha, rng=None):
     assert N > 0 and alpha > 0.
     alpha = float(alpha)
 
+    # Customer i sits at table k with probability proportional to Nk[k], or
+    # at a new table with probability proportional to alpha, using one draw
+    # of rng per customer after the first, as Crp.simulate does.
     partition = [0]*N
     Nk = [1]
     for i in xrange(1,N):
-        K = len(Nk)
-        ps = np.zeros(K+1)
-        for k in xrange(K):
-            ps[k] = float(Nk[k])
-        ps[K] = alpha
-        ps /= (float(i) - 1 + alpha)
-        assignment = pflip(ps, rng=rng)
-        if assignment == K:
+        assignment = pflip(Nk + [alpha], rng=rng)
+        if assignment == len(Nk):
             Nk.append(1)
-        elif assignment < K:
-            Nk[assignment] += 1
         else:
-            raise ValueError("Invalid assignment: %i, max=%i" % (assignment, K))
+            Nk[assignment] += 1
         partition[i] = assignment
 
-    assert max(partition)+1 == len(Nk)
     assert len(partition)==N
-    assert sum(Nk) == N
-
-    K = len(Nk)
-    # if K > 1:
-    #     rng.shuffle(partition)
+    assert max(partition)+1 == len(Nk)
     return partition
 
 def simulate_crp_constrained(N, alpha, Cd, Ci, Rd, Ri, rng=None):
@@ -223,32 +281,44 @@ def simulate_crp_constrained(N, alpha, Cd, Ci, Rd, Ri, rng=None):
     vu.validate_crp_constrained_input(N, Cd, Ci, Rd, Ri)
     assert N > 0 and alpha > 0.
 
-    # Initial partition.
+    # Initial partition, and the customers at each table.
     Z = [-1]*N
+    tables = []
 
     # Friends dictionary from Cd.
     friends = {col:block for block in Cd for col in block}
 
-    # Assign customers.
+    # Enemies as a set of pairs. Customers without any Ci, Rd or Ri
+    # constraint are compatible with all others, so skip checking them.
+    enemies = {tuple(pair) for pair in Ci}
+    constrained = {c for pair in enemies for c in pair}.union(Rd, Ri)
+    def compatible(a, b):
+        return a not in constrained or b not in constrained \
+            or vu.check_compatible_customers(Cd, enemies, Ri, Rd, a, b)
+
+    # Assign customers, with one uniform per customer drawn up front; the
+    # uniforms of customers seated with an earlier friend go unused.
+    uniforms = rng.random_sample(N)
     for cust in xrange(N):
         if Z[cust] > -1: continue
         # Find valid tables for cust and friends.
-        assert all(Z[f] == -1 for f in friends.get(cust, [cust]))
-        prob_table = [0] * (max(Z)+1)
-        for t in xrange(max(Z)+1):
-            # Current customers at table t.
-            t_custs = [i for i,z in enumerate(Z) if z==t]
-            prob_table[t] = len(t_custs)
+        block = friends.get(cust, [cust])
+        assert all(Z[f] == -1 for f in block)
+        prob_table = [0] * len(tables)
+        for t, t_custs in enumerate(tables):
             # Does f \in {cust \union cust_friends} have an enemy in table t?
-            for tc in t_custs:
-                for f in friends.get(cust, [cust]):
-                    if not vu.check_compatible_customers(Cd,Ci,Ri,Rd,f,tc):
-                        prob_table[t] = 0
-                        break
-        # Choose from valid tables using CRP.
+            if all(compatible(f, tc) for tc in t_custs for f in block):
+                prob_table[t] = len(t_custs)
+        # Choose from valid tables using CRP, by inverse transform sampling.
         prob_table.append(alpha)
-        assignment = pflip(prob_table, rng=rng)
-        for f in friends.get(cust, [cust]):
+        cdf = np.cumsum(prob_table)
+        assignment = min(
+            cdf.searchsorted(uniforms[cust] * cdf[-1], side='right'),
+            len(tables))
+        if assignment == len(tables):
+            tables.append([])
+        tables[assignment].extend(block)
+        for f in block:
             Z[f] = assignment
 
     # At most N tables.
@@ -257,6 +327,31 @@ def simulate_crp_constrained(N, alpha, Cd, Ci, Rd, Ri, rng=None):
     return Z
 
 def build_rowid_blocks(Zvr):
-    A = np.asarray(Zvr).T
-    U = map(tuple, A)
-    return {u:np.where(np.all(A==u, axis=1))[0] for u in U}
+    """Return mapping from each tuple of cluster assignments across the views
+    in Zvr to the array of rowids with those assignments, in one pass."""
+    blocks = {}
+    for rowid, u in enumerate(zip(*Zvr)):
+        blocks.setdefault(u, []).append(rowid)
+    return {u: np.asarray(rowids) for u, rowids in blocks.iteritems()}
+
+
+# Compiled kernel for log_pflip, used when numba exists.
+
+@ju.njit
+def _log_pflip(logp, u):
+    """Return the first index whose cumulative weight exceeds u, or -1."""
+    m = -np.inf
+    for i in range(len(logp)):
+        m = max(m, logp[i])
+    total = 0.
+    for i in range(len(logp)):
+        total += math.exp(logp[i] - m)
+    if not 0 < total < np.inf:
+        return -1
+    target = u * total
+    cumulative = 0.
+    for i in range(len(logp)):
+        cumulative += math.exp(logp[i] - m)
+        if cumulative > target:
+            return i
+    return len(logp) - 1
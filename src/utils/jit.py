@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Optional numba compilation of numerical kernels.
+
+Numba is not a dependency of cgpm. When it is not installed, `njit` leaves
+the decorated function as plain Python and `prange` is `xrange`, so callers
+should consult `HAVE_NUMBA` before dispatching hot loops to a kernel.
+"""
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+HAVE_NUMBA = numba is not None
+
+
+def njit(*args, **kwargs):
+    """Decorator for numba.njit, which is a no-op when numba is missing."""
+    if HAVE_NUMBA:
+        return numba.njit(*args, **kwargs)
+    if len(args) == 1 and callable(args[0]) and not kwargs:
+        return args[0]
+    return lambda f: f
+
+
+prange = numba.prange if HAVE_NUMBA else xrange
@@ -48,11 +48,8 @@ def plot_dist_continuous(X, output, clusters, ax=None, Y=None, hist=True):
     if Y is None:
         Y = np.linspace(x_min, x_max, 200)
     # Compute weighted pdfs.
-    pdf = np.zeros((len(clusters), len(Y)))
-    W = [log(clusters[k].N) - log(float(len(X))) for k in clusters]
-    for i, k in enumerate(clusters):
-        pdf[i,:] = np.exp(
-            [W[i] + clusters[k].logpdf(-1, {output:y}, []) for y in Y])
+    pdf = _weighted_pdfs(X, output, clusters, Y)
+    for i in range(len(clusters)):
         color, alpha = gu.curve_color(i)
         ax.plot(Y, pdf[i,:], color=color, linewidth=5, alpha=alpha)
     # Plot the sum of pdfs.
@@ -81,11 +78,8 @@ def plot_dist_discrete(X, output, clusters, ax=None, Y=None, hist=True):
     X_hist = np.bincount(X) / float(len(X))
     ax.bar(Y, X_hist, color='gray', edgecolor='none')
     # Compute weighted pdfs
-    pdf = np.zeros((len(clusters), len(Y)))
-    W = [log(clusters[k].N) - log(float(len(X))) for k in clusters]
-    for i, k in enumerate(clusters):
-        pdf[i,:] = np.exp(
-            [W[i] + clusters[k].logpdf(-1, {output:y}, []) for y in Y])
+    pdf = _weighted_pdfs(X, output, clusters, Y)
+    for i in range(len(clusters)):
         color, alpha = gu.curve_color(i)
         ax.bar(Y, pdf[i,:], color=color, edgecolor='none', alpha=alpha)
     # Plot the sum of pdfs.
@@ -96,6 +90,20 @@ def plot_dist_discrete(X, output, clusters, ax=None, Y=None, hist=True):
     ax.set_title(clusters.values()[0].name())
     return ax
 
+def _weighted_pdfs(X, output, clusters, Y):
+    """Return matrix whose [i,j] entry is the pdf of Y[j] under the ith
+    cluster, weighted by the proportion of X in that cluster."""
+    models = clusters.values()
+    W = np.log([model.N for model in models]) - log(float(len(X)))
+    if hasattr(models[0], 'calc_cluster_logps'):
+        stats = models[0].gather_suffstats(models)
+        logps = np.column_stack(
+            [models[0].calc_cluster_logps(stats, y) for y in Y])
+    else:
+        logps = np.asarray(
+            [[model.logpdf(-1, {output:y}, []) for y in Y] for model in models])
+    return np.exp(W[:,np.newaxis] + logps)
+
 def plot_clustermap(D, xticklabels=None, yticklabels=None):
     import seaborn as sns
     if xticklabels is None: xticklabels = range(D.shape[0])
@@ -159,7 +167,7 @@ def partition_to_zmatrix(Zv, ordering=None):
     views = set(Zv.values())
     block_vectors = {view: np.zeros(len(Zv)) for view in views}
     for view in views:
-        cols = [column_to_index[c] for c, v in Zv.iteritems() if v == view]
+        cols = [column_to_index[c] for c, v in Zv.items() if v == view]
         block_vectors[view][cols] = 1
 
     D = np.zeros((len(Zv), len(Zv)))
@@ -192,7 +200,7 @@ def plot_logscore(logscores, ax=None):
 def engine_to_zmatrix_history(engine, ordering=None):
     num_transitions = len(engine.states[0].diagnostics['column_partition'])
     Zvs = [[dict(state.diagnostics['column_partition'][i])
-        for state in engine.states] for i in xrange(num_transitions)]
+        for state in engine.states] for i in range(num_transitions)]
 
     # Find the ordering at the final step.
     if ordering is None:
@@ -25,6 +25,7 @@ from cgpm.crosscat.state import State
 from cgpm.mixtures.dim import Dim
 from cgpm.mixtures.view import View
 from cgpm.utils import general as gu
+from cgpm.utils.dataset import Dataset
 
 
 def gen_data_table(n_rows, view_weights, cluster_weights, cctypes, distargs,
@@ -340,7 +341,7 @@ def gen_simple_view():
     R = len(data)
     D = len(data[0])
     outputs = range(D)
-    X = {c: data[:, i].tolist() for i, c in enumerate(outputs)}
+    X = Dataset(data, outputs)
     Zr = [0 for i in range(R)]
     view = View(
         X,
@@ -356,7 +357,7 @@ def gen_multitype_view():
                      [1, 1, 1]])
     D = len(data[0])
     dpm_outputs = range(D)
-    X = {c: data[:, i].tolist() for i, c in enumerate(dpm_outputs)}
+    X = Dataset(data, dpm_outputs)
     crp_alpha = 1.
     cctypes = ['bernoulli', 'categorical', 'normal']
     hypers = {
@@ -430,6 +431,20 @@ def restrict_evidence_to_query(query, evidence):
     """Return subset of evidence whose rows are also present in query."""
     return {i: j for i, j in evidence.iteritems() if i in query.keys()}
 
+def assert_matches_fresh_view(view):
+    """Assert that view scores the same as a View built afresh from its data,
+    dims, and row partition, e.g. after rows were migrated incrementally."""
+    dims = [view.dims[c] for c in view.outputs[1:]]
+    fresh = View(
+        Dataset(view.X.to_array(), view.X.keys()),
+        outputs=view.outputs,
+        alpha=view.alpha(),
+        cctypes=[dim.cctype for dim in dims],
+        distargs=[dim.distargs for dim in dims],
+        hypers=[dim.hypers for dim in dims],
+        Zr=[view.Zr(r) for r in sorted(view.Zr())])
+    assert np.allclose(fresh.logpdf_score(), view.logpdf_score())
+
 _gen_data = {
     'bernoulli'         : _gen_bernoulli_data,
     'beta'              : _gen_beta_data,
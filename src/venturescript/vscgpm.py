@@ -15,11 +15,9 @@
 #   limitations under the License.
 
 import base64
-import copy
 import math
 
 from collections import defaultdict
-from datetime import datetime
 
 import venture.shortcuts as vs
 
@@ -66,20 +64,31 @@ class VsCGpm(CGpm):
         if len(outputs) != len(self.ripl.sample('simulators')):
             raise ValueError('source.simulators list disagrees with outputs.')
         self.outputs = outputs
+        # Position of each output in the simulators and observers lists.
+        self._output_index = {o: i for i, o in enumerate(outputs)}
         # Check correct inputs.
         if len(inputs) != self.ripl.evaluate('(size inputs)'):
             raise ValueError('source.inputs list disagrees with inputs.')
         self.inputs = inputs
+        self._inputs_set = frozenset(inputs)
+        # Templates of the ripl calls, given rowid and then the inputs.
+        fmt_inputs = ' %s' * len(inputs)
+        self._predict_tmpl = '((lookup simulators %i) %s' + fmt_inputs + ')'
+        self._observe_tmpl = \
+            '((lookup observers %i) %s' + fmt_inputs + ' %s %s)'
         # Check overriden observers.
         if len(self.outputs) != self.ripl.evaluate('(size observers)'):
             raise ValueError('source.observers list disagrees with outputs.')
         # Evidence and labels for incorporate/unincorporate.
         self.obs = defaultdict(lambda: defaultdict(dict))
+        # Number of labels generated, which keeps each label unique.
+        self._label_seq = 0
 
     def incorporate(self, rowid, query, evidence=None):
         evidence = self._validate_incorporate(rowid, query, evidence)
+        args = self._cell_args(rowid, evidence)
         for q, value in query.iteritems():
-            self._observe_cell(rowid, q, value, evidence)
+            self._observe_cell(rowid, q, value, args)
 
     def unincorporate(self, rowid):
         if rowid not in self.obs:
@@ -92,11 +101,19 @@ class VsCGpm(CGpm):
     def logpdf(self, rowid, query, evidence=None):
         return 0
 
+    def logpdf_bulk(self, rowids, queries, evidences=None):
+        """Evaluate multiple queries at once, as in State.logpdf_bulk."""
+        if evidences is not None:
+            assert len(rowids) == len(queries) == len(evidences)
+        assert len(rowids) == len(queries)
+        return [0] * len(rowids)
+
     def simulate(self, rowid, query, evidence=None, N=None):
         ev_in, ev_out = self._validate_simulate(rowid, query, evidence)
+        args = self._cell_args(rowid, ev_in)
         # Observe output variables in evidence.
         for q,v in ev_out.iteritems():
-            self._observe_cell(rowid, q, v, ev_in)
+            self._observe_cell(rowid, q, v, args)
         # Run local inference in rowid scope, with 15 steps of MH.
         if ev_out:
             self.ripl.infer('(mh (atom %i) all %i)' % (rowid, 15))
@@ -104,7 +121,7 @@ class VsCGpm(CGpm):
         def retrieve_sample(q, l):
             # XXX Only run inference on the latent variables in the block.
             # self.ripl.infer('(mh (atom %i) all %i)' % (rowid, 5))
-            return self._predict_cell(rowid, q, ev_in, l)
+            return self._predict_cell(q, args, l)
         labels = [self._gen_label() for q in query]
         samples = {q: retrieve_sample(q, l) for q, l in zip(query, labels)}
         # Forget predicted query variables.
@@ -133,7 +150,8 @@ class VsCGpm(CGpm):
         metadata['mode'] = self.mode
         metadata['plugins'] = self.plugins
         # Save the observations. We need to convert integer keys to strings.
-        metadata['obs'] = VsCGpm._obs_to_json(copy.deepcopy(self.obs))
+        metadata['obs'] = VsCGpm._obs_to_json(self.obs)
+        metadata['label_seq'] = self._label_seq
         metadata['binary'] =  base64.b64encode(self.ripl.saves())
         metadata['factory'] = ('cgpm.venturescript.vscgpm', 'VsCGpm')
         return metadata
@@ -157,24 +175,27 @@ class VsCGpm(CGpm):
         cgpm.obs = defaultdict(lambda: defaultdict(dict))
         for key, value in obs_converted.iteritems():
             cgpm.obs[key] = defaultdict(dict, value)
+        cgpm._label_seq = metadata.get('label_seq', 0)
         return cgpm
 
     # --------------------------------------------------------------------------
     # Internal helpers.
 
-    def _predict_cell(self, rowid, query, evidence, label):
-        inputs = [evidence[i] for i in self.inputs]
-        args = str.join(' ', map(str, [rowid] + inputs))
-        i = self.outputs.index(query)
+    def _cell_args(self, rowid, evidence):
+        """Return the tuple of rowid and the inputs in evidence, shared by the
+        cells of rowid in one call to incorporate or simulate."""
+        return (rowid,) + tuple(evidence[i] for i in self.inputs)
+
+    def _predict_cell(self, query, args, label):
+        i = self._output_index[query]
         return self.ripl.predict(
-            '((lookup simulators %i) %s)' % (i, args), label=label)
+            self._predict_tmpl % ((i,) + args), label=label)
 
-    def _observe_cell(self, rowid, query, value, evidence):
-        inputs = [evidence[i] for i in self.inputs]
+    def _observe_cell(self, rowid, query, value, args):
         label = '\''+self._gen_label()
-        args = str.join(' ', map(str, [rowid] + inputs + [value, label]))
-        i = self.outputs.index(query)
-        self.ripl.evaluate('((lookup observers %i) %s)' % (i, args))
+        i = self._output_index[query]
+        self.ripl.evaluate(
+            self._observe_tmpl % ((i,) + args + (value, label)))
         self.obs[rowid]['labels'][query] = label[1:]
 
     def _forget_cell(self, rowid, query):
@@ -184,18 +205,17 @@ class VsCGpm(CGpm):
         del self.obs[rowid]['labels'][query]
 
     def _gen_label(self):
-        return 't%s%s' % (
-            self.rng.randint(1,100),
-            datetime.now().strftime('%Y%m%d%H%M%S%f'))
+        self._label_seq += 1
+        return 'l%x' % (self._label_seq,)
 
     def _validate_incorporate(self, rowid, query, evidence=None):
         if evidence is None: evidence = {}
         if not query:
             raise ValueError('No query: %s.' % query)
         # All evidence present, and no nan values.
-        if rowid not in self.obs and set(evidence) != set(self.inputs):
+        if rowid not in self.obs and set(evidence) != self._inputs_set:
             raise ValueError('Miss evidence: %s, %s' % (evidence, self.inputs))
-        if not set.issubset(set(query), set(self.outputs)):
+        if not all(q in self._output_index for q in query):
             raise ValueError('Unknown query: %s,%s' % (query, self.outputs))
         if any(math.isnan(evidence[i]) for i in evidence):
             raise ValueError('Nan evidence: %s' % evidence)
@@ -213,13 +233,15 @@ class VsCGpm(CGpm):
 
     def _validate_simulate(self, rowid, query, evidence=None):
         if evidence is None: evidence = {}
-        ev_in = {q:v for q,v in evidence.iteritems() if q in self.inputs}
-        ev_out = {q:v for q,v in evidence.iteritems() if q in self.outputs}
-        if rowid not in self.obs and set(ev_in) != set(self.inputs):
+        ev_in = {q:v for q,v in evidence.iteritems() if q in self._inputs_set}
+        ev_out = {q:v for q,v in evidence.iteritems()
+            if q in self._output_index}
+        if rowid not in self.obs and set(ev_in) != self._inputs_set:
             raise ValueError('Missing evidence: %s, %s' % (ev_in, self.inputs))
         if any(math.isnan(evidence[i]) for i in evidence):
             raise ValueError('Nan evidence: %s' % evidence)
-        if not all(i in self.inputs or i in self.outputs for i in evidence):
+        if not all(i in self._inputs_set or i in self._output_index
+                for i in evidence):
             raise ValueError('Unknown evidence: %s' % evidence)
         if rowid in self.obs:
             if ev_out and any(q in self.obs[rowid]['labels'] for q in ev_out):
@@ -228,7 +250,7 @@ class VsCGpm(CGpm):
                 self._check_matched_evidence(rowid, ev_in)
             else:
                 ev_in = self.obs[rowid]['evidence']
-        assert set(ev_in) == set(self.inputs)
+        assert set(ev_in) == self._inputs_set
         return ev_in, ev_out
 
     def _check_matched_evidence(self, rowid, evidence):
@@ -241,14 +263,18 @@ class VsCGpm(CGpm):
 
     @staticmethod
     def _obs_to_json(obs):
+        # Builds new plain dicts, leaving obs and its defaultdicts untouched.
         def convert_key_int_to_str(d):
             assert all(isinstance(c, int) for c in d)
             return {str(c): v for c, v in d.iteritems()}
-        obs2 = convert_key_int_to_str(obs)
-        for r in obs2:
-            obs2[r]['evidence'] = convert_key_int_to_str(obs2[r]['evidence'])
-            obs2[r]['labels'] = convert_key_int_to_str(obs2[r]['labels'])
-        return obs2
+        assert all(isinstance(r, int) for r in obs)
+        return {
+            str(r): {
+                'evidence': convert_key_int_to_str(o.get('evidence', {})),
+                'labels': convert_key_int_to_str(o.get('labels', {})),
+            }
+            for r, o in obs.iteritems()
+        }
 
     @staticmethod
     def _obs_from_json(obs):
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from cgpm.mixtures.dim import Dim
+from cgpm.primitives.bernoulli import Bernoulli
+from cgpm.utils import general as gu
+
+
+def test_calc_hyper_logps_matches_loop():
+    rng = gu.gen_rng(0)
+    X = rng.choice([0, 1], size=(4, 25))
+    clusters = []
+    for k, data in enumerate(X):
+        model = Bernoulli([0], [], rng=rng)
+        for rowid, x in enumerate(data):
+            model.incorporate(rowid, {0: x})
+        clusters.append(model)
+    grids = Bernoulli.construct_hyper_grids(X.ravel(), n_grid=10)
+    hypers = {'alpha': grids['alpha'][3], 'beta': grids['beta'][5]}
+    for target in ['alpha', 'beta']:
+        expected = []
+        for g in grids[target]:
+            proposal = dict(hypers)
+            proposal[target] = g
+            expected.append(sum(
+                Bernoulli.calc_logpdf_marginal(
+                    c.N, c.x_sum, proposal['alpha'], proposal['beta'])
+                for c in clusters))
+        logps = Bernoulli.calc_hyper_logps(
+            Bernoulli.gather_suffstats(clusters), grids[target], hypers,
+            target)
+        assert np.allclose(logps, expected)
+    # An unknown hyper is rejected, with or without numba.
+    with pytest.raises(ValueError):
+        Bernoulli.calc_hyper_logps(
+            Bernoulli.gather_suffstats(clusters), grids['alpha'], hypers,
+            'gamma')
+
+
+def test_calc_predictive_logp_vec_matches_scalar():
+    N = [0, 3, 10, 7]
+    x_sum = [0, 1, 10, 2]
+    for x in [0, 1]:
+        expected = [
+            Bernoulli.calc_predictive_logp(x, n, s, 1.5, .5)
+            for n, s in zip(N, x_sum)
+        ]
+        logps = Bernoulli.calc_predictive_logp_vec(x, N, x_sum, 1.5, .5)
+        assert np.allclose(logps, expected)
+
+
+def test_calc_logpdf_partition_matches_dim():
+    rng = gu.gen_rng(1)
+    X = rng.choice([0, 1], size=30).astype(float)
+    X[[2, 11, 17]] = np.nan
+    Z = rng.choice([0, 1, 4], size=30)
+    dim = Dim(outputs=[0], inputs=[-1], cctype='bernoulli', rng=rng)
+    dim.transition_hyper_grids(X)
+    for rowid, (x, z) in enumerate(zip(X, Z)):
+        dim.incorporate(rowid, {0: x}, {-1: z})
+    assert np.allclose(dim.logpdf_score_partition(X, Z), dim.logpdf_score())
+
+
+def test_logpdf_score_tracks_suffstats_and_hypers():
+    bern = Bernoulli([0], [], rng=gu.gen_rng(0))
+    def expected():
+        return Bernoulli.calc_logpdf_marginal(
+            bern.N, bern.x_sum, bern.alpha, bern.beta)
+    assert bern.logpdf_score() == expected() == 0
+    for rowid, x in enumerate([1, 0, 1, 1]):
+        bern.incorporate(rowid, {0: x})
+        assert bern.logpdf_score() == expected()
+    bern.unincorporate(2)
+    assert bern.logpdf_score() == expected()
+    bern.set_hypers({'alpha': 2.5, 'beta': .5})
+    assert bern.logpdf_score() == expected()
@@ -19,6 +19,7 @@ import os
 import pytest
 
 from cgpm.utils.config import check_env_debug
+from cgpm.utils.config import debug_only
 
 token = 'GPMCCDEBUG'
 
@@ -34,3 +35,10 @@ def test_debug_false():
 def test_debug_true():
     os.environ[token] = '1'
     assert check_env_debug()
+
+def test_debug_only():
+    func = lambda: 1
+    os.environ[token] = '0'
+    assert debug_only(func)() is None
+    os.environ[token] = '1'
+    assert debug_only(func) is func
@@ -176,6 +176,28 @@ def test_gibbs_tables_logps():
     assert K53 == [0, 2, 6, 7, 8]
     assert np.allclose(np.exp(P53), [2, 3, 1.5/3, 1.5/3, 1.5/3])
 
+    K, P = crp.gibbs_tables_logps(2, m=2)
+    assert K == K22
+    assert P == P22
+
+    # Proposals derived from a shared sweep agree with the direct ones.
+    sweep = crp.sweep_tables_logps()
+    assert sweep[0] == [0, 2, 6]
+    for rowid, _table in assignments:
+        for m in [1, 2, 3]:
+            assert crp.gibbs_tables_logps(rowid, m=m, sweep=sweep) \
+                == crp.gibbs_tables_logps(rowid, m=m)
+            assert crp.gibbs_tables_logps(rowid, m=m)[0] \
+                == crp.gibbs_tables(rowid, m=m)
+
+    # The sorted tables follow tables which empty and open.
+    crp.unincorporate(5)
+    assert crp.gibbs_tables(-1) == [0, 2, 3]
+    crp.incorporate(5, {0: 1}, None)
+    crp.incorporate(6, {0: 9}, None)
+    assert crp.gibbs_tables(-1, m=2) == [0, 1, 2, 9, 10, 11]
+    assert crp.gibbs_tables(6) == [0, 1, 2, 9]
+
 
 def test_crp_logpdf_score():
     """Ensure that logpdf_marginal agrees with sequence of predictives."""
@@ -211,6 +233,16 @@ def test_crp_logpdf_score():
     crp.incorporate(5, {0:0})
     assert not np.allclose(crp.logpdf_score(), logpdf_marginal[-1])
 
+    # The vectorized grid of alpha agrees with logpdf_score.
+    grid = [.5, 1.5, 7.]
+    logps = Crp.calc_hyper_logps(
+        Crp.gather_suffstats([crp]), grid, crp.get_hypers(), 'alpha')
+    expected = []
+    for alpha in grid:
+        crp.set_hypers({'alpha': alpha})
+        expected.append(crp.logpdf_score())
+    assert np.allclose(logps, expected)
+
 
 def test_crp_same_table_probability():
     """Compute probability of customers in same table.
@@ -392,3 +424,16 @@ def test_crp_same_table_probability():
     # Confirm no mutation has occured.
     assert crp.data == crp_data_full
     assert crp.logpdf_score() == logpdf_score_full
+
+
+def test_simulate_crp():
+    N, alpha = 20, 2.
+    rng = gu.gen_rng(7)
+    partitions = [gu.simulate_crp(N, alpha, rng=rng) for _i in xrange(2000)]
+    for Z in partitions:
+        # Tables are labelled in order of their first customer.
+        assert Z[0] == 0
+        assert all(Z[i] <= max(Z[:i]) + 1 for i in xrange(1, N))
+    # The expected number of tables is sum_i alpha/(alpha+i).
+    expected = sum(alpha / (alpha + i) for i in xrange(N))
+    assert abs(np.mean([max(Z) + 1 for Z in partitions]) - expected) < .2
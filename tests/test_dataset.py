@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from cgpm.utils.dataset import Dataset
+
+
+def test_dataset_columns():
+    X = Dataset([[1, 2], [3, np.nan], [5, 6]], [7, 4])
+    assert X.keys() == [7, 4]
+    assert len(X) == 2
+    assert 7 in X and 0 not in X
+    assert X.n_rows() == 3
+    assert np.allclose(X[7], [1, 3, 5])
+    assert np.isnan(X[4][1])
+    # Writing through a column view writes the cell.
+    X[4][1] = 8
+    assert X[4][1] == 8
+    # Columns are contiguous in the buffer.
+    assert X[7].flags['C_CONTIGUOUS']
+    # Add and delete a column.
+    X[0] = [9, 9, 9]
+    assert X.keys() == [7, 4, 0]
+    assert np.allclose(X.row(2), [5, 6, 9])
+    del X[4]
+    assert X.keys() == [7, 0]
+    assert np.allclose(X.to_array(), [[1, 9], [3, 9], [5, 9]])
+    with pytest.raises(ValueError):
+        X[1] = [1, 2]
+
+
+def test_dataset_append_pop():
+    X = Dataset(np.zeros((0, 2)), [0, 1])
+    for i in xrange(10):
+        X.append({0: i})
+    assert X.n_rows() == 10
+    assert np.allclose(X[0], range(10))
+    assert np.all(np.isnan(X[1]))
+    X.pop()
+    X.pop()
+    assert X.n_rows() == 8
+    assert X[0].flags['C_CONTIGUOUS']
+    X.append({1: -1})
+    assert np.isnan(X[0][8]) and X[1][8] == -1
+    with pytest.raises(IndexError):
+        X.row(9)
+
+
+def test_dataset_from_dict():
+    X = Dataset.from_dict({3: [1, 2, 3], 1: [np.nan, 5., 6]})
+    assert sorted(X.keys()) == [1, 3]
+    assert X.n_rows() == 3
+    assert np.allclose(X[3], [1, 2, 3])
+    assert np.isnan(X[1][0])
+    assert np.allclose(X.row(1)[X.positions([1, 3])], [5, 2])
+    assert len(X.positions([])) == 0
+
+
+def test_dataset_positions_after_column_changes():
+    X = Dataset(np.asarray([[1, 2, 3], [4, 5, 6]]), [7, 8, 9])
+    assert X.positions([9, 8]).tolist() == [2, 1]
+    del X[8]
+    assert X.positions([9]).tolist() == [1]
+    X[8] = [0, 0]
+    assert X.positions([9, 8]).tolist() == [1, 2]
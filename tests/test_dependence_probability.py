@@ -113,3 +113,36 @@ def test_dependence_probability():
         assert compute_depprob(C.dependence_probability(1821, 1721)) == 0
         assert compute_depprob(C.dependence_probability(1821, 74)) == 0
         assert compute_depprob(C.dependence_probability(154, 74)) == 0
+
+
+def test_dependence_probability_pairs():
+    cctypes, distargs = cu.parse_distargs(['normal', 'poisson', 'bernoulli'])
+    T, Zv, _Zc = tu.gen_data_table(
+        20, [.5, .5], [[.25, .75], [.4, .6]], cctypes, distargs,
+        [.95]*len(cctypes), rng=gu.gen_rng(2))
+    outputs = [1, 5, 3]
+    s = State(
+        T.T, outputs=outputs, cctypes=cctypes, distargs=distargs,
+        Zv={o:z for o,z in zip(outputs, Zv)}, rng=gu.gen_rng(0))
+    pairs = list(itertools.product(outputs, outputs))
+    expected = [s.dependence_probability(c0, c1) for c0, c1 in pairs]
+    assert np.allclose(s.dependence_probability_pairs(pairs), expected)
+    # Pairs involving a hooked cgpm use the network.
+    s.compose_cgpm(BareBonesCGpm(outputs=[1821], inputs=[outputs[0]]))
+    pairs.append((1821, outputs[0]))
+    assert s.dependence_probability_pairs(pairs)[-1] == 1
+
+
+def test_dependence_probability_matrix():
+    cctypes, distargs = cu.parse_distargs(['normal', 'poisson', 'bernoulli'])
+    T, Zv, _Zc = tu.gen_data_table(
+        20, [.5, .5], [[.25, .75], [.4, .6]], cctypes, distargs,
+        [.95]*len(cctypes), rng=gu.gen_rng(2))
+    outputs = [1, 5, 3]
+    e = Engine(
+        T.T, outputs=outputs, cctypes=cctypes, distargs=distargs,
+        num_states=4, rng=gu.gen_rng(0))
+    D = e.dependence_probability_pairwise()
+    for (i, c0), (j, c1) in itertools.product(enumerate(outputs), repeat=2):
+        assert np.allclose(
+            D[i,j], compute_depprob(e.dependence_probability(c0, c1)))
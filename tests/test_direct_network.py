@@ -167,3 +167,17 @@ def test_zero_length_samples(engine):
     ]
     for s in samples_b:
         assert len(s) == 0
+
+
+def test_crash_bulk_observed(engine):
+    query = {0:1, 1:2}
+    evidence = {2:1}
+    for state in engine.states:
+        # The observed row is validated even after a fresh one.
+        with pytest.raises(ValueError):
+            state.logpdf_bulk([-1, 1], [query, query], [evidence, evidence])
+        # Query and evidence columns overlap.
+        with pytest.raises(ValueError):
+            state.logpdf_bulk([-1], [query], [{0:1}])
+        with pytest.raises(ValueError):
+            state.simulate_bulk([-1, -1], [[0, 1], [0, 0]])
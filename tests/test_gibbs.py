@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from cgpm.crosscat.state import State
+from cgpm.mixtures import gibbs
+from cgpm.mixtures.view import View
+from cgpm.utils import general as gu
+from cgpm.utils import test as tu
+from cgpm.utils.dataset import Dataset
+
+
+def retrieve_view():
+    data = np.asarray([
+        [1.1,   -2.1,    0],  # rowid=0
+        [2.,      .1,    0],  # rowid=1
+        [1.5, np.nan,   .5],  # rowid=2
+        [4.7,    7.4,   .5],  # rowid=3
+        [5.2,    9.6,   np.nan],  # rowid=4
+    ])
+
+    outputs = [0,1,2,]
+
+    return View(
+        Dataset(data, outputs),
+        outputs=[1000] + outputs,
+        alpha=2.,
+        cctypes=['normal'] * len(outputs),
+        Zr=[0,0,0,1,1,]
+    )
+
+
+def test_transition_rows_compiled():
+    view = retrieve_view()
+    view.rng = gu.gen_rng(4)
+    assert gibbs.is_supported(view)
+    for _i in xrange(10):
+        view.transition_rows(compiled=True)
+        view._check_partitions()
+        tu.assert_matches_fresh_view(view)
+    # A subset of rows leaves the other rows in place.
+    Zr = dict(view.Zr())
+    gibbs.transition_rows(view, rows=[1, 3])
+    assert all(view.Zr(r) == Zr[r] for r in [0, 2, 4])
+
+
+def test_transition_rows_compiled_bernoulli():
+    rng = gu.gen_rng(6)
+    X = {
+        0: rng.normal(size=20).tolist(),
+        1: rng.choice([0., 1.], size=20).tolist(),
+        2: rng.choice([0., 1., np.nan], size=20).tolist(),
+    }
+    cctypes = ['normal', 'bernoulli', 'bernoulli']
+    view = View(
+        X, outputs=[1000, 0, 1, 2], alpha=1., cctypes=cctypes, rng=rng)
+    assert gibbs.is_supported(view)
+    for _i in xrange(10):
+        view.transition_rows(compiled=True)
+        view._check_partitions()
+        tu.assert_matches_fresh_view(view)
+
+
+def test_gather_data():
+    view = retrieve_view()
+    X = gibbs._gather_data(view, [2, 0])
+    assert X.shape == (view.n_rows(), 2)
+    assert np.allclose(X[:,1], view.X[0])
+    assert np.array_equal(np.isnan(X[:,0]), np.isnan(view.X[2]))
+    assert gibbs._gather_data(view, []).shape == (view.n_rows(), 0)
+
+
+def test_state_transition_compiled():
+    rng = gu.gen_rng(2)
+    X = rng.normal(size=(20,4))
+    state = State(
+        X, cctypes=['normal']*4, Zv={0:0, 1:0, 2:1, 3:1}, rng=rng)
+    state.transition(N=5, kernels=['rows'], compiled=True)
+    assert state.diagnostics['iterations']['rows'] == 5
+    for view in state.views.itervalues():
+        view._check_partitions()
+        tu.assert_matches_fresh_view(view)
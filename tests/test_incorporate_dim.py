@@ -14,10 +14,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
 import pytest
 
 from cgpm.crosscat.engine import Engine
 from cgpm.crosscat.state import State
+from cgpm.mixtures.view import View
 from cgpm.utils import config as cu
 from cgpm.utils import general as gu
 from cgpm.utils import test as tu
@@ -177,3 +179,80 @@ def test_incorporate_state():
     # Unincorporating last dim should raise.
     with pytest.raises(ValueError):
         state.unincorporate_dim(state.outputs[0])
+
+
+def test_data_array_follows_outputs():
+    state = State(
+        T[:,:2], cctypes=CCTYPES[:2], distargs=DISTARGS[:2], rng=gu.gen_rng(0))
+    state.incorporate_dim(
+        T[:,2], outputs=[10], cctype=CCTYPES[2], distargs=DISTARGS[2])
+    state.unincorporate_dim(0)
+    X = state.data_array()
+    assert X.shape == (len(T), 2)
+    assert np.allclose(X[:,0], T[:,1])
+    assert np.allclose(X[:,1], T[:,2])
+
+
+def test_dim_clone_empty():
+    state = State(
+        T[:,:2], cctypes=CCTYPES[:2], distargs=DISTARGS[:2], rng=gu.gen_rng(0))
+    dim = state.dim_for(0)
+    clone = dim.clone_empty()
+    assert clone.index == dim.index and clone.cctype == dim.cctype
+    assert clone.hypers == dim.hypers and clone.hypers is not dim.hypers
+    assert not clone.clusters and not clone.Zr and not clone.Zi
+    # A clone is usable on its own, without a bulk incorporate by a view.
+    spare = dim.clone_empty()
+    assert spare.logpdf_score() == 0
+    spare.incorporate(0, {0: T[0,0]}, {spare.inputs[0]: 0})
+    assert np.allclose(spare.logpdf_score(), spare.clusters[0].logpdf_score())
+    # Reassigning the clone to the view of dim recovers the clusters of dim.
+    view = state.views[state.Zv(0)]
+    logp = view.incorporate_dim(clone, reassign=True)
+    assert np.allclose(logp, dim.logpdf_score())
+    assert clone.Zr == dim.Zr
+    view.incorporate_dim(dim, reassign=False)
+
+
+def test_view_score_dim():
+    state = State(
+        T[:,:3], cctypes=CCTYPES[:3], distargs=DISTARGS[:3], rng=gu.gen_rng(0))
+    view = View(
+        state.X, outputs=[state.crp_id_view + 99], rng=gu.gen_rng(1))
+    # Bernoulli is scored from the row partition, normal by incorporating.
+    for col in [0, 2]:
+        dim = state.dim_for(col)
+        logp = view.score_dim(dim.clone_empty())
+        assert not view.dims
+        assert np.allclose(logp, view.incorporate_dim(dim.clone_empty()))
+        view.unincorporate_dim(dim)
+
+
+def test_view_outputs_order():
+    state = State(
+        T[:,:3], cctypes=CCTYPES[:3], distargs=DISTARGS[:3], rng=gu.gen_rng(0))
+    view = View(
+        state.X, outputs=[state.crp_id_view + 99], rng=gu.gen_rng(1))
+    # Outputs follow the order in which the dims are incorporated.
+    for col in [2, 0, 1]:
+        view.incorporate_dim(state.dim_for(col).clone_empty())
+    assert view.outputs == [state.crp_id_view + 99, 2, 0, 1]
+    assert view.dims.keys() == [2, 0, 1]
+    view.unincorporate_dim(view.dims[0])
+    assert view.outputs == [state.crp_id_view + 99, 2, 1]
+    assert view.to_metadata()['outputs'] == view.outputs
+
+
+def test_view_network_cache():
+    state = State(
+        T[:,:3], cctypes=CCTYPES[:3], distargs=DISTARGS[:3], rng=gu.gen_rng(0))
+    view = state.views[state.Zv(0)]
+    network = view.build_network()
+    assert view.build_network() is network
+    # The network is rebuilt once the dims of the view change.
+    dim = view.dims[0]
+    view.unincorporate_dim(dim)
+    assert view.build_network() is not network
+    assert dim not in view.build_network().cgpms
+    view.incorporate_dim(dim)
+    assert dim in view.build_network().cgpms
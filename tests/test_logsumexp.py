@@ -17,6 +17,8 @@
 import math
 import pytest
 
+import numpy as np
+
 from cgpm.utils import general as gu
 
 def relerr(expected, actual):
@@ -58,3 +60,30 @@ def test_logmeanexp():
     assert math.isnan(gu.logmeanexp([nan, inf]))
     assert math.isnan(gu.logmeanexp([nan, -3]))
     assert math.isnan(gu.logmeanexp([nan]))
+
+def test_logmeanexp_weighted():
+    inf = float('inf')
+    log_A = [0., -1., -2.]
+    assert relerr(gu.logmeanexp(log_A),
+            gu.logmeanexp_weighted(log_A, [0., 0., 0.])) \
+        < 1e-15
+    assert gu.logmeanexp_weighted(log_A, [-inf, 0., -inf]) == -1.
+
+def test_logsumexp_axis():
+    inf = float('inf')
+    nan = float('nan')
+    rows = [
+        [0., -1., -2.], [-1000., -1000., -inf], [-inf, -inf, -inf],
+        [+inf, -3., 0.], [-inf, 0., +inf], [nan, 1., 2.], [nan, inf, 0.]]
+    by_row = gu.logsumexp(rows, axis=1)
+    by_col = gu.logsumexp(np.transpose(rows), axis=0)
+    for row, a, b in zip(rows, by_row, by_col):
+        expected = gu.logsumexp(row)
+        if math.isnan(expected):
+            assert math.isnan(a) and math.isnan(b)
+        elif math.isinf(expected):
+            assert a == b == expected
+        else:
+            assert relerr(expected, a) < 1e-15
+            assert relerr(expected, b) < 1e-15
+    assert np.all(gu.logsumexp(np.zeros((3, 0)), axis=1) == -inf)
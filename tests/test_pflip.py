@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from cgpm.utils import general as gu
+
+
+def test_pflip_matches_choice():
+    p = [.1, .2, .05, .65]
+    for size in [None, 1, 20]:
+        expected = gu.gen_rng(4).choice(range(4), size=size, p=p)
+        assert np.all(gu.pflip(p, size=size, rng=gu.gen_rng(4)) == expected)
+        array = ['a', 'b', 'c', 'd']
+        expected = gu.gen_rng(4).choice(array, size=size, p=p)
+        samples = gu.pflip(p, array=array, size=size, rng=gu.gen_rng(4))
+        assert np.all(samples == expected)
+
+
+def test_log_pflip_degenerate():
+    assert gu.log_pflip([-1.], array=[7], rng=gu.gen_rng(0)) == 7
+    assert gu.log_pflip([0., float('-inf')], rng=gu.gen_rng(0)) == 0
+    with pytest.raises(ValueError):
+        gu.log_pflip([float('-inf'), float('-inf')], rng=gu.gen_rng(0))
+
+
+
+def test_log_pflip_matches_pflip():
+    p = [.1, .2, .05, .65]
+    for size in [None, 1, 20]:
+        expected = gu.pflip(p, size=size, rng=gu.gen_rng(5))
+        samples = gu.log_pflip(np.log(p), size=size, rng=gu.gen_rng(5))
+        assert np.all(samples == expected)
+
+def test_log_pflip_uniform():
+    logp = np.log([.1, .2, .05, .65])
+    # Draws from uniforms equal the draws consuming the same uniforms.
+    rng = gu.gen_rng(3)
+    expected = [gu.log_pflip(logp, rng=rng) for _i in xrange(20)]
+    uniforms = gu.gen_rng(3).random_sample(20)
+    assert [gu.log_pflip_uniform(logp, u) for u in uniforms] == expected
+    assert [gu.log_pflip_uniform(logp, u) for u in [0, .05, .29, .31, .99]] \
+        == [0, 0, 1, 2, 3]
+    assert gu.log_pflip_uniform([-1.], .5, array=[7]) == 7
+    with pytest.raises(ValueError):
+        gu.log_pflip_uniform([float('-inf'), float('-inf')], .5)
@@ -19,6 +19,7 @@ import pytest
 
 from cgpm.mixtures.view import View
 from cgpm.crosscat.state import State
+from cgpm.utils.dataset import Dataset
 
 """Test suite for View._populate_evidence.
 
@@ -38,7 +39,7 @@ def retrieve_view():
     ])
     outputs = [0,1,2,3,4]
     return View(
-        {c: X[:,c].tolist() for c in outputs},
+        Dataset(X, outputs),
         outputs=[-1] + outputs,
         cctypes=['normal']*5,
         Zr=[0,1,2]
@@ -93,6 +94,22 @@ def test_view_values_to_populate():
     assert evidence2 == {2:2, 0:1, 3:-1, 4:2, -1: view.Zr(rowid)}
 
 
+def test_view_populate_after_force_cell():
+    view = retrieve_view()
+
+    # The observed cells of rowid are cached by the first populate, and must
+    # be reloaded after a nan cell is forced.
+    rowid = 0
+    query1 = [1]
+    evidence2 = view._populate_evidence(rowid, query1, {})
+    assert evidence2 == {0:1, 2:2, 3:-1, -1: view.Zr(rowid)}
+
+    view.X[4][rowid] = 7
+    view.force_cell(rowid, {4:7})
+    evidence2 = view._populate_evidence(rowid, query1, {})
+    assert evidence2 == {0:1, 2:2, 3:-1, 4:7, -1: view.Zr(rowid)}
+
+
 # ------------------------------------------------------------------------------
 # Tests for cgpm.crosscat.state.State
 
@@ -140,3 +157,58 @@ def test_state_constrain_errors():
     evidence1 = {}
     with pytest.raises(ValueError):
         state._validate_query_evidence(rowid, query1, evidence1)
+
+
+def test_state_constrain_errors_repeat():
+    state = retrieve_state()
+
+    # A schema which passed validation still has its cells checked.
+    query1 = {1:1}
+    evidence1 = {4:-5}
+    state._validate_query_evidence(0, query1, evidence1)
+    with pytest.raises(ValueError):
+        state._validate_query_evidence(1, query1, evidence1)
+
+    # A schema which failed validation fails again.
+    for _i in xrange(2):
+        with pytest.raises(ValueError):
+            state._validate_query_evidence(0, [1, 1], {})
+        with pytest.raises(ValueError):
+            state._validate_query_evidence(0, {1:1}, {1:1})
+
+
+def test_state_values_to_populate():
+    state = retrieve_state()
+
+    rowid = 0
+    query1 = [1]
+    evidence1 = {4:2}
+    evidence2 = state._populate_evidence(rowid, query1, evidence1)
+    assert evidence2 == {0:1, 2:2, 3:-1, 4:2}
+
+    rowid = 1
+    query1 = {1:3}
+    evidence1 = {}
+    evidence2 = state._populate_evidence(rowid, query1, evidence1)
+    assert evidence2 == {0:1, 2:2, 3:-1, 4:-5}
+
+    rowid = -1
+    evidence2 = state._populate_evidence(rowid, query1, evidence1)
+    assert evidence2 == {}
+
+
+def test_state_populate_after_force_cell():
+    state = retrieve_state()
+
+    rowid = 0
+    query1 = [3]
+    evidence2 = state._populate_evidence(rowid, query1, {})
+    assert evidence2 == {0:1, 2:2}
+
+    # The views must not serve the cells cached before the force.
+    state.force_cell(rowid, {1:7, 4:8})
+    evidence2 = state._populate_evidence(rowid, query1, {})
+    assert evidence2 == {0:1, 1:7, 2:2, 4:8}
+    view = state.views[0]
+    evidence2 = view._populate_evidence(rowid, query1, {})
+    assert evidence2 == {0:1, 1:7, 2:2, 4:8, view.outputs[0]: view.Zr(rowid)}
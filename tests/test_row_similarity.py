@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+
+import numpy as np
+
+from cgpm.crosscat.engine import Engine
+from cgpm.utils import config as cu
+from cgpm.utils import general as gu
+from cgpm.utils import test as tu
+
+
+def get_engine():
+    cctypes, distargs = cu.parse_distargs(['normal', 'poisson', 'bernoulli'])
+    T, _Zv, _Zc = tu.gen_data_table(
+        15, [.5, .5], [[.25, .75], [.4, .6]], cctypes, distargs,
+        [.95]*len(cctypes), rng=gu.gen_rng(2))
+    return Engine(
+        T.T, cctypes=cctypes, distargs=distargs, num_states=3,
+        rng=gu.gen_rng(1), multiprocess=0)
+
+
+def test_row_similarity_pairs():
+    engine = get_engine()
+    pairs = list(itertools.product(range(15), range(15)))
+    for state in engine.states:
+        for cols in [None, [0], [1, 2]]:
+            expected = [state.row_similarity(r0, r1, cols) for r0, r1 in pairs]
+            similarities = state.row_similarity_pairs(pairs, cols)
+            assert np.allclose(similarities, expected)
+
+
+def test_row_similarity_pairwise():
+    engine = get_engine()
+    S = engine.row_similarity_pairwise()
+    assert S.shape == (15, 15)
+    assert np.allclose(S, S.T)
+    assert np.allclose(np.diag(S), 1)
+    for r0, r1 in itertools.product(range(15), range(15)):
+        assert np.allclose(S[r0,r1], np.mean(engine.row_similarity(r0, r1)))
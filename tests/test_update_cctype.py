@@ -91,12 +91,13 @@ def test_categorical_forest():
     cat_id = CCTYPES.index('categorical')
     cat_distargs = DISTARGS[cat_id]
 
-    # If cat_id is singleton migrate first.
+    # If cat_id is singleton migrate first, into the view of another column
+    # so that the forest has inputs whatever the seed.
     if len(state.view_for(cat_id).dims) == 1:
         state.unincorporate_dim(cat_id)
         state.incorporate_dim(
             T[:,cat_id], outputs=[120], cctype='categorical',
-            distargs=cat_distargs, v=0)
+            distargs=cat_distargs, v=state.Zv(0))
         cat_id = 120
     state.update_cctype(cat_id, 'random_forest', distargs=cat_distargs)
 
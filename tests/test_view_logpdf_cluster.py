@@ -18,8 +18,12 @@ import pytest
 
 import numpy as np
 
+from cgpm.crosscat import sampling
+from cgpm.mixtures.dim import SUFFSTATS_CACHE_SIZE
 from cgpm.mixtures.view import View
 from cgpm.utils import general as gu
+from cgpm.utils import test as tu
+from cgpm.utils.dataset import Dataset
 
 
 def retrieve_view():
@@ -34,7 +38,7 @@ def retrieve_view():
     outputs = [0,1,2,]
 
     return View(
-        {c: data[:,i].tolist() for i, c in enumerate(outputs)},
+        Dataset(data, outputs),
         outputs=[1000] + outputs,
         alpha=2.,
         cctypes=['normal'] * len(outputs),
@@ -90,3 +94,205 @@ def test_logpdf_bayes():
     logp_evidence = view.logpdf(None, {2:0})
     logp_joint = view.logpdf(None, {1:1, 2:0, view.outputs[0]: 0})
     assert np.allclose(logp_joint - logp_evidence, logp_posterior)
+
+
+def test_dim_logpdf_clusters():
+    view = retrieve_view()
+    clusters = [0, 1, 2]
+    for c in [0, 1, 2]:
+        logps = view.dims[c].logpdf_clusters(None, {c: 1.2}, clusters)
+        expected = [
+            view.dims[c].logpdf(None, {c: 1.2}, {view.outputs[0]: k})
+            for k in clusters
+        ]
+        assert np.allclose(logps, expected)
+
+
+def test_view_logpdf_direct():
+    view = retrieve_view()
+    query = {0: 2, 1: 3}
+    evidence = {2: .5}
+    # Joint over the clusters, summing the dims within each cluster.
+    logp_direct = sampling.view_logpdf(view, -1, query, evidence)
+    logp_recursive = view.logpdf(None, query, evidence)
+    assert np.allclose(logp_direct, logp_recursive)
+
+
+def test_logpdf_row_gibbs():
+    view = retrieve_view()
+    for rowid in [0, 2, 4]:
+        K = view.crp.clusters[0].gibbs_tables(rowid)
+        logps = view._logpdf_row_gibbs(rowid, K)
+        # Each dim scores the row with rowid removed from its own cluster.
+        expected = np.zeros(len(K))
+        for c, dim in view.dims.iteritems():
+            query = {c: view.X[c][rowid]}
+            dim.unincorporate(rowid)
+            expected += [
+                dim.logpdf(rowid, query, {view.outputs[0]: k}) for k in K]
+            dim.incorporate(rowid, query, {view.outputs[0]: view.Zr(rowid)})
+        assert np.allclose(logps, expected)
+
+
+def test_view_logpdf_clusters():
+    view = retrieve_view()
+    network = view.build_network()
+    K = view.crp.clusters[0].gibbs_tables(-1)
+    query = {0: 2, 1: np.nan}
+    evidence = {2: .5}
+    z = view.outputs[0]
+    # Joint with the cluster assignment.
+    logps = view._logpdf_clusters(network, None, query, None, K)
+    expected = [network.logpdf(None, gu.merged(query, {z: k})) for k in K]
+    assert np.allclose(logps, expected)
+    # Conditional on the cluster assignment and evidence.
+    logps = view._logpdf_clusters(network, None, query, evidence, K)
+    expected = [
+        network.logpdf(None, query, gu.merged(evidence, {z: k})) for k in K]
+    assert np.allclose(logps, expected)
+
+
+def test_migrate_row():
+    view = retrieve_view()
+    rowid = 3
+    k_new = max(view.Nk()) + 1
+    # Moving rowid to a fresh cluster and back restores the scores.
+    k_old = view.Zr(rowid)
+    logp = view.logpdf_score()
+    view._migrate_row(rowid, k_new)
+    assert view.Zr(rowid) == k_new
+    assert view.Nk(k_new) == 1
+    for dim in view.dims.itervalues():
+        assert gu.merged(dim.Zr, dim.Zi)[rowid] == k_new
+    view._check_partitions()
+    view._migrate_row(rowid, k_old)
+    assert k_new not in view.Nk()
+    view._check_partitions()
+    assert np.allclose(view.logpdf_score(), logp)
+
+
+def test_cluster_array():
+    view = retrieve_view()
+    def expected():
+        return [view.Zr(r) for r in xrange(view.n_rows())]
+    assert view._cluster_array().tolist() == expected()
+    view._migrate_row(1, 1)
+    assert view._cluster_array().tolist() == expected()
+    view.unincorporate(4)
+    assert view._cluster_array().tolist() == expected()
+    view.incorporate(4, {0: 1., 1: 2., 2: 3., 1000: 0})
+    assert view._cluster_array().tolist() == expected() == [0, 1, 0, 1, 0]
+
+
+def test_incorporate_bulk():
+    view = retrieve_view()
+    logp = view.logpdf_score()
+    rows = [3, 4]
+    queries = [
+        gu.merged({view.outputs[0]: view.Zr(r)},
+            dict(zip(view.outputs[1:],
+                view.X.row(r)[view.X.positions(view.outputs[1:])])))
+        for r in rows
+    ]
+    for rowid in rows:
+        view.unincorporate(rowid)
+    # Rows with a specified cluster restore the original scores.
+    view.incorporate_bulk(rows, queries)
+    view._check_partitions()
+    assert np.allclose(view.logpdf_score(), logp)
+    for dim in view.dims.itervalues():
+        scores = [dim.clusters[k].logpdf_score() for k in dim.clusters]
+        assert np.allclose(dim.log_marginal, sum(scores))
+    # Rows without a specified cluster are sampled one at a time.
+    for rowid in rows:
+        view.unincorporate(rowid)
+    queries = [{c: q[c] for c in view.outputs[1:]} for q in queries]
+    view.incorporate_bulk(rows, queries)
+    view._check_partitions()
+
+
+def test_gather_suffstats_updates():
+    view = retrieve_view()
+    rng = gu.gen_rng(5)
+    clusters = [0, 1, 2, 3]
+    cached = [dim.gather_suffstats(clusters) for dim in view.dims.values()]
+    for _i in xrange(10):
+        rowid = rng.randint(view.n_rows())
+        view._migrate_row(rowid, clusters[rng.randint(len(clusters))])
+        for dim, stats in zip(view.dims.values(), cached):
+            assert dim.gather_suffstats(clusters) is stats
+            models = [dim.clusters.get(k, dim.aux_model) for k in clusters]
+            expected = dim.model.gather_suffstats(models)
+            for name in expected:
+                assert np.allclose(stats[name], expected[name])
+
+
+def test_gather_suffstats_bounded():
+    view = retrieve_view()
+    view.rng = gu.gen_rng(5)
+    view.crp.set_hypers({'alpha': 100.})
+    for _i in xrange(50):
+        view.transition_rows()
+        for dim in view.dims.itervalues():
+            assert len(dim._suffstats) <= SUFFSTATS_CACHE_SIZE
+
+
+def test_log_marginal():
+    view = retrieve_view()
+    view.rng = gu.gen_rng(3)
+    def check_log_marginal():
+        for dim in [view.crp] + view.dims.values():
+            scores = [dim.clusters[k].logpdf_score() for k in dim.clusters]
+            assert np.allclose(dim.log_marginal, sum(scores))
+    for _i in xrange(5):
+        view.transition_rows()
+        check_log_marginal()
+        view.transition_dim_hypers()
+        check_log_marginal()
+    view.unincorporate(2)
+    check_log_marginal()
+
+
+def test_transition_rows_block():
+    view = retrieve_view()
+    view.rng = gu.gen_rng(2)
+    for _i in xrange(10):
+        view._split_merge_rows(view.Zr().keys())
+        view._check_partitions()
+        # The migrated sufficient statistics agree with a fresh View.
+        tu.assert_matches_fresh_view(view)
+    view.transition_rows(block=True)
+    view._check_partitions()
+
+
+@pytest.mark.parametrize('cctype, distargs', [
+    ('bernoulli', None),
+    ('categorical', {'k': 3}),
+    ('normal', None),
+    ('poisson', None),
+])
+def test_calc_cluster_logps(cctype, distargs):
+    view = View(
+        {0: [0, 1, 1, 0, 2] if cctype != 'bernoulli' else [0, 1, 1, 0, 1]},
+        outputs=[1000, 0],
+        cctypes=[cctype],
+        distargs=[distargs],
+        Zr=[0, 0, 1, 1, 2],
+        rng=gu.gen_rng(0),
+    )
+    dim = view.dims[0]
+    clusters = [0, 1, 2, 3]
+    for x in [0, 1, 2, 1.5, -1]:
+        logps = dim.logpdf_clusters(None, {0: x}, clusters)
+        expected = [dim.logpdf(None, {0: x}, {1000: k}) for k in clusters]
+        assert np.allclose(logps, expected)
+    # Removing each row from the gathered suffstats of its cluster agrees
+    # with unincorporating it.
+    for rowid in view.Zr():
+        query = {0: view.X[0][rowid]}
+        logps = dim.logpdf_clusters_excluding(rowid, query, clusters)
+        assert rowid in dim.Zr
+        dim.unincorporate(rowid)
+        expected = dim.logpdf_clusters(rowid, query, clusters)
+        dim.incorporate(rowid, query, {1000: view.Zr(rowid)})
+        assert np.allclose(logps, expected)